@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+BASE_URL = "https://mediasteward.net"
+
+CONNECT_TIMEOUT_SECONDS = 10.0
+# a check is held by the server until the status changes, for at most this long
+WAIT_SECONDS = 20
+READ_TIMEOUT_SECONDS = WAIT_SECONDS + 10.0
+# between checks when the server answers them straight away, or fails
+CHECK_SECONDS = 5.0
+POOL_CONNECTIONS = 2
+
+
+class RequestFailed(Exception):
+    """A request to the site that failed, reason the id of the string telling the user so and detail for the log."""
+
+    def __init__(self, reason, detail, **values):
+        Exception.__init__(self, detail)
+        self.reason = reason
+        self.detail = detail
+        self.values = values  # for the ${} fields of the string
+
+
+class Client(object):
+    """
+    The HTTP client of the Media Steward site. Calls share one requests session, whose pool keeps connections alive,
+    so the TCP and TLS handshakes happen once rather than per call. Every call has connect and read timeouts, a hung
+    server fails it instead of blocking the caller.
+    """
+
+    def __init__(self, base_url=BASE_URL):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_CONNECTIONS)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_json(self, path, params=None, headers=None):
+        """Returns the response to a GET of path and its JSON, None for 304 Not Modified. Raises RequestFailed."""
+        try:
+            r = self.session.get(self.base_url + path, params=params, headers=headers,
+                                 timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
+        except requests.RequestException as e:
+            raise RequestFailed(983010, e)  # "Unable to connect to Media Steward"
+        if r.status_code == 304:
+            return r, None
+        if r.status_code == 200 and r.headers.get('content-type', '').split(';')[0] == 'application/json':
+            try:
+                return r, r.json()
+            except ValueError as e:
+                raise RequestFailed(983011, e)  # "Invalid response from Media Steward"
+        raise RequestFailed(983012, r.headers, status=r.status_code)  # "Server returned ${status} error"
+
+    def close(self):
+        self.session.close()
+
+
+class ActivationCheck(threading.Thread):
+    """
+    Checks the status of an activation code until it is final or the check is stopped, on a thread of its own so the
+    dialog waiting for it reacts to cancelling at once. Each check names the status last seen by its ETag and asks the
+    server to hold the request until the status differs, for at most WAIT_SECONDS, so a change is seen as soon as it
+    happens. Checks answered sooner, by a server without long polling or on an error, go out every CHECK_SECONDS.
+
+    The JSON of every status, or the RequestFailed of a failed check, is put on results in order.
+    """
+
+    def __init__(self, client, code):
+        threading.Thread.__init__(self, name="Media Steward activation")
+        self.daemon = True  # a check the server holds must not keep the script running once the dialog closes
+        self.client = client
+        self.code = code
+        self.results = queue.Queue()
+        self._stopped = threading.Event()
+
+    def run(self):
+        etag = None
+        while not self._stopped.is_set():
+            started = time.time()
+            headers = {'If-None-Match': etag} if etag is not None else None
+            try:
+                r, status = self.client.get_json('/register/check/' + self.code, {'wait': WAIT_SECONDS}, headers)
+            except RequestFailed as err:
+                r, status = None, err
+            if self._stopped.is_set():
+                return
+            if status is not None:
+                self.results.put(status)
+                if isinstance(status, dict) and status.get('status') != 'valid':
+                    return  # activated, expired or invalid, there is nothing more to wait for
+            held = etag is not None  # the server holds only checks naming a status
+            if r is not None:
+                etag = r.headers.get('ETag', etag)
+            # a check the server could have held but answered sooner waits its turn whatever the ETag says, a server
+            # ignoring wait must not be asked in a loop
+            if r is None or etag is None or held:
+                self._stopped.wait(max(0.0, CHECK_SECONDS - (time.time() - started)))
+
+    def stop(self):
+        """Ends the checks, a check under way is abandoned to the daemon thread."""
+        self._stopped.set()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+FAST_RETRY_SECONDS = 2.0
+BASE_SECONDS = 5.0
+CAP_SECONDS = 300.0
+# a retry-after hint is stretched by up to this fraction, so clients given the same hint do not return together
+HINT_SPREAD = 0.5
+
+
+class Backoff(object):
+    """
+    Reconnect delays for the link: capped exponential backoff with full jitter, so a fleet of boxes that lost the
+    server together does not come back together. The first retry after a verified session is fast, and a retry-after
+    hint from the server replaces the next delay.
+    """
+
+    def __init__(self, base=BASE_SECONDS, cap=CAP_SECONDS, fast=FAST_RETRY_SECONDS, rand=random.random):
+        self.base = base
+        self.cap = cap
+        self.fast = fast
+        self.attempts = 0  # failed connects since the last verified session
+        self.healthy = False  # the last connection was verified
+        self._hint = None
+        self._random = rand
+
+    def succeeded(self):
+        self.attempts = 0
+        self.healthy = True
+
+    def retry_after(self, seconds):
+        self._hint = max(0.0, float(seconds))
+
+    def next_delay(self):
+        """Returns the seconds to wait before the next connect."""
+        if self._hint is not None:
+            delay = self._hint * (1.0 + HINT_SPREAD * self._random())
+            self._hint = None
+        elif self.healthy:
+            delay = self.fast * self._random()
+        else:
+            delay = min(self.cap, self.base * 2 ** min(self.attempts, 32)) * self._random()
+        if not self.healthy:
+            self.attempts += 1
+        self.healthy = False
+        return delay
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 256
+
+# read-only methods whose results only change when the library does
+CACHEABLE_METHODS = frozenset([
+    'AudioLibrary.GetAlbumDetails',
+    'AudioLibrary.GetAlbums',
+    'AudioLibrary.GetArtistDetails',
+    'AudioLibrary.GetArtists',
+    'AudioLibrary.GetGenres',
+    'AudioLibrary.GetRecentlyAddedAlbums',
+    'AudioLibrary.GetRecentlyAddedSongs',
+    'AudioLibrary.GetSongDetails',
+    'AudioLibrary.GetSongs',
+    'JSONRPC.Version',
+    'VideoLibrary.GetEpisodeDetails',
+    'VideoLibrary.GetEpisodes',
+    'VideoLibrary.GetGenres',
+    'VideoLibrary.GetMovieDetails',
+    'VideoLibrary.GetMovieSetDetails',
+    'VideoLibrary.GetMovieSets',
+    'VideoLibrary.GetMovies',
+    'VideoLibrary.GetMusicVideoDetails',
+    'VideoLibrary.GetMusicVideos',
+    'VideoLibrary.GetRecentlyAddedEpisodes',
+    'VideoLibrary.GetRecentlyAddedMovies',
+    'VideoLibrary.GetSeasons',
+    'VideoLibrary.GetTVShowDetails',
+    'VideoLibrary.GetTVShows',
+])
+
+# Kodi notifications after which cached results of that namespace may be stale
+INVALIDATING_NOTIFICATIONS = frozenset([
+    'AudioLibrary.OnCleanFinished',
+    'AudioLibrary.OnRemove',
+    'AudioLibrary.OnScanFinished',
+    'AudioLibrary.OnUpdate',
+    'VideoLibrary.OnCleanFinished',
+    'VideoLibrary.OnRemove',
+    'VideoLibrary.OnScanFinished',
+    'VideoLibrary.OnUpdate',
+])
+
+# Kodi writes the id first, after "jsonrpc" at the latest
+_RESPONSE_ID = re.compile(br'\s*\{(?:\s*"jsonrpc"\s*:\s*"2\.0"\s*,)?\s*"id"\s*:\s*')
+_ADLER_BASE = 65521
+_ZLIB_HEADER = b'\x78\x9c'
+
+
+def _raw_deflate(data, final):
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # a sync flush ends byte aligned without a final block, so another deflate stream can follow it
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _adler32(data, value=1):
+    return zlib.adler32(data, value) & 0xffffffff
+
+
+def _adler32_combine(adler1, adler2, length2):
+    """Checksum of two pieces of data from their checksums and the length of the second, as zlib's own combine."""
+    remainder = length2 % _ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % _ADLER_BASE
+    sum1 = (sum1 + (adler2 & 0xffff) + _ADLER_BASE - 1) % _ADLER_BASE
+    sum2 = (sum2 + (adler1 >> 16) + (adler2 >> 16) + _ADLER_BASE - remainder) % _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def request_key(request):
+    """
+    Returns (key, id) for a cacheable request, or None. The key is the method with its params in canonical form, the
+    id is kept apart because it differs on every call.
+    """
+    try:
+        parsed = json.loads(request)
+    except ValueError:
+        return None
+    if not isinstance(parsed, dict) or parsed.get('method') not in CACHEABLE_METHODS or 'id' not in parsed:
+        return None
+    key = json.dumps([parsed['method'], parsed.get('params')], sort_keys=True, separators=(',', ':'))
+    return key, json.dumps(parsed['id']).encode('utf-8')
+
+
+class CachedResponse(object):
+    """
+    A compressed response with a hole where the request id goes. The text before and after the id are deflated as
+    separate streams, so answering a new request only deflates the id and joins the pieces, the checksum of the
+    whole is combined from the checksums of the parts.
+    """
+
+    __slots__ = ('prefix', 'prefix_adler', 'suffix', 'suffix_adler', 'suffix_length', 'size')
+
+    def __init__(self, response, id_text):
+        match = _RESPONSE_ID.match(response)
+        if match is None or response[match.end():match.end() + len(id_text)] != id_text:
+            raise ValueError("response id not found")
+        prefix = response[:match.end()]
+        suffix = response[match.end() + len(id_text):]
+        self.prefix = _raw_deflate(prefix, False)
+        self.prefix_adler = _adler32(prefix)
+        self.suffix = _raw_deflate(suffix, True)
+        self.suffix_adler = _adler32(suffix)
+        self.suffix_length = len(suffix)
+        self.size = len(self.prefix) + len(self.suffix)
+
+    def render(self, id_text):
+        """Returns the zlib compressed response carrying id_text."""
+        adler = _adler32_combine(_adler32(id_text, self.prefix_adler), self.suffix_adler, self.suffix_length)
+        return b''.join([_ZLIB_HEADER, self.prefix, _raw_deflate(id_text, False), self.suffix,
+                         struct.pack('>L', adler)])
+
+
+class ResponseCache(object):
+    """
+    LRU cache of compressed JSON-RPC responses, bounded by entry count and compressed bytes. Shared by the worker
+    threads and Kodi's notification callback, so every access holds the lock.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._generations = {}  # per namespace, bumped on invalidation
+        self._lock = threading.Lock()
+
+    def generation(self, key):
+        """Returns a token to pass to put, it keeps a response computed before an invalidation out of the cache."""
+        with self._lock:
+            return self._generations.get(_namespace(key), 0)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            # most recently used entries live at the end
+            self._entries[key] = entry
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, generation):
+        with self._lock:
+            if entry.size > self.max_bytes or self._generations.get(_namespace(key), 0) != generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                self.bytes -= self._entries.popitem(last=False)[1].size
+                self.evictions += 1
+
+    def invalidate(self, namespace):
+        """Drops every entry of a method namespace such as 'VideoLibrary'."""
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for key in [k for k in self._entries if _namespace(k) == namespace]:
+                self.bytes -= self._entries.pop(key).size
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+
+def _namespace(key):
+    # keys start with ["Namespace.Method"
+    return key[2:key.index('.')]
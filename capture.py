@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import struct
+import time
+
+# A capture file is MAGIC followed by records: '>BdI' kind, wall clock seconds and length, then that many bytes.
+MAGIC = b'MSLCAP1\n'
+RECORD = struct.Struct('>BdI')
+IN = 1  # bytes received from the server, as read after TLS
+OUT = 2  # bytes sent to it, as written before TLS
+META = 3  # JSON: {"event": "connected", "host", "version"}, {"event": "verified", "verification"}, {"event": "closed"}
+FRAME_START = 0x80  # or'ed into the kind of IN and OUT records whose first byte starts a frame
+KINDS = 0x7f
+
+NAME = 'capture.msl'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+FILES = 4  # the current file and those rotated out, each gets an equal share of the space
+FLUSH_SECONDS = 1.0
+
+
+class Capture(object):
+    """
+    Opt-in recording of the link's traffic, for tools/replay_capture.py. The bytes of the frames in either direction
+    are appended as they are read and written, so recording costs a copy and a buffered write. Records go to NAME in
+    directory, rotated to NAME.1 and on to NAME.<files - 1> when it reaches its share of max_bytes, the oldest is
+    dropped. A file is only rotated at the start of an inbound frame, and a new one begins with the META records of
+    the connection so far, so every file can be replayed on its own. Used on the link's thread only.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, files=FILES):
+        self.path = os.path.join(directory, NAME)
+        self.files = max(1, files)
+        self.file_bytes = max(len(MAGIC), max_bytes // self.files)
+        self.state = []  # META records of the current connection, as (when, data)
+        self._file = None
+        self._size = 0
+        self._flushed = time.time()
+        # a capture starts a file of its own
+        self.rotate()
+
+    def write(self, kind, data, frame_start=False):
+        """Records bytes of kind IN or OUT, or for META a dict describing the link."""
+        when = time.time()
+        if kind == META:
+            event = data['event']
+            data = json.dumps(data, sort_keys=True).encode('utf-8')
+            if event in ('connected', 'closed'):
+                self.state = []
+            if event != 'closed':
+                self.state.append((when, data))
+        else:
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            if frame_start:
+                if kind == IN and self._size >= self.file_bytes:
+                    self.rotate()
+                kind |= FRAME_START
+        self._record(kind, when, data)
+        if when - self._flushed >= FLUSH_SECONDS:
+            self._file.flush()
+            self._flushed = when
+
+    def rotate(self):
+        """Moves the current file aside and starts a new one."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            for number in range(self.files - 1, 0, -1):
+                older = self.path if number == 1 else '%s.%d' % (self.path, number - 1)
+                if os.path.exists(older):
+                    rotated = '%s.%d' % (self.path, number)
+                    if os.path.exists(rotated):
+                        os.remove(rotated)  # os.rename does not replace files on Windows
+                    os.rename(older, rotated)
+            if os.path.exists(self.path):
+                os.remove(self.path)  # a single file is started over
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._size = len(MAGIC)
+        for when, data in self.state:
+            self._record(META, when, data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _record(self, kind, when, data):
+        self._file.write(RECORD.pack(kind, when, len(data)))
+        self._file.write(data)
+        self._size += RECORD.size + len(data)
+
+
+def read_records(path):
+    """Yields the (kind, when, data, frame_start) records of a capture file, kind without FRAME_START."""
+    with open(path, 'rb') as capture_file:
+        if capture_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a capture" % path)
+        while True:
+            header = capture_file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return  # the end, or a record cut short when the link stopped
+            kind, when, size = RECORD.unpack(header)
+            data = capture_file.read(size)
+            if len(data) < size:
+                return
+            yield kind & KINDS, when, data, bool(kind & FRAME_START)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+
+# zdict needs Python 3.3
+SUPPORTED = sys.version_info >= (3, 3)
+
+# Preset zlib dictionaries for link frames, seeded with the text JSON-RPC traffic repeats in every message. Kodi writes
+# compact JSON with its keys sorted, the link's own control messages use Python's default separators. A dictionary is
+# known by its version in the handshake and never changes once released, an improved one gets the next version.
+# Deflate codes matches nearest the end of the dictionary cheapest, so the most common text comes last.
+
+_V1 = [
+    # video details and stream information, in bulk listings
+    b'"streamdetails":{"audio":[{"channels":6,"codec":"ac3","language":"eng"}],"subtitle":[{"language":"eng"}],'
+    b'"video":[{"aspect":1.7777777910232544,"codec":"h264","duration":0,"height":1080,"stereomode":"","width":1920}]}',
+    b'"cast":[{"name":"","order":0,"role":"","thumbnail":"image://',
+    b'"uniqueid":{"imdb":"tt","tmdb":""},"userrating":0,"votes":"","top250":0,"trailer":"","tagline":"",'
+    b'"sorttitle":"","originaltitle":"","imdbnumber":"tt","mpaa":"Rated ","premiered":"","dateadded":"20',
+    b'"resume":{"position":0,"total":0},"lastplayed":"","plotoutline":"","set":"","setid":0,"tag":[],',
+    b'"country":["United States"],"studio":[""],"director":[""],"writer":[""],',
+    # music
+    b'"albumartist":[""],"albumid":0,"artistid":[0],"displayartist":"","disc":0,"track":0,"songid":',
+    b'"artist":[""],"album":"","duration":0,',
+    b'AudioLibrary.GetSongs","AudioLibrary.GetAlbums","AudioLibrary.GetArtists",',
+    # television
+    b'"episodeid":0,"firstaired":"","season":0,"episode":0,"showtitle":"","tvshowid":0,"watchedepisodes":0,',
+    b'VideoLibrary.GetEpisodes","VideoLibrary.GetTVShows","VideoLibrary.GetMovieDetails",',
+    # paths and artwork
+    b'"file":"smb://","file":"nfs:///storage/.mkv","file":"/',
+    b'"art":{"fanart":"image://","poster":"image://","thumb":"image://"},',
+    b'"fanart":"image://","thumbnail":"image://http%3a%2f%2fimage.tmdb.org%2ft%2fp%2foriginal%2f',
+    # requests
+    b'"properties":["title","year","genre","rating","runtime","playcount","thumbnail","art","file"],',
+    b'"filter":{"field":"title","operator":"contains","value":""},',
+    b'"sort":{"ignorearticle":true,"method":"label","order":"ascending"},',
+    b'"GUI.ActivateWindow","Application.SetVolume","Application.SetMute","Playlist.Clear","Playlist.Add",',
+    b'"Input.ExecuteAction","Input.Select","Input.Back","Input.Home","Input.Up","Input.Down",',
+    b'"Player.Open","Player.Stop","Player.Seek","Player.GoTo","Player.PlayPause","Player.GetItem",',
+    b'"Player.GetProperties","Player.GetActivePlayers","VideoLibrary.GetMovies",',
+    # player state
+    b'"repeat":"off","shuffled":false,"volume":100,"muted":false,"percentage":0,"position":0,"speed":1,',
+    b'"time":{"hours":0,"milliseconds":0,"minutes":0,"seconds":0},',
+    b'"totaltime":{"hours":0,"milliseconds":0,"minutes":0,"seconds":0},',
+    b'"genre":[""],"rating":0,"runtime":0,"playcount":0,"year":20',
+    b'[{"playerid":0,"playertype":"internal","type":"audio"},{"playerid":1,"playertype":"internal","type":"video"}]',
+    b'{"item":{"id":0,"label":"","type":"movie"}}',
+    # link control messages
+    b'{"id": null, "error": {"code": -32603, "message": "',
+    b'{"id": 0, "ready": true, "results": [{"type": "movie", "id": 0, "label": "", "score": ',
+    b'{"seq": 1, "rtt": null}',
+    b'{"jsonrpc": "2.0", "method": "Player.GetActivePlayers", "params": {}, "id": 1}',
+    b'{"jsonrpc":"2.0","method":"Player.GetProperties","params":{"playerid":1,"properties":["',
+    # every response
+    b'"limits":{"end":0,"start":0,"total":0},',
+    b'{"id":1,"jsonrpc":"2.0","result":"OK"}',
+    b'"label":"","movieid":',
+    b'{"id":1,"jsonrpc":"2.0","result":{"',
+]
+
+# version: dictionary
+PRESETS = {
+    1: b''.join(_V1),
+}
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import select
+import socket
+import time
+from collections import deque
+
+# monotonic clock where the interpreter has one
+now = getattr(time, 'monotonic', time.time)
+
+_POLL_READ = getattr(select, 'POLLIN', 0) | getattr(select, 'POLLPRI', 0) | getattr(select, 'POLLHUP', 0) | \
+             getattr(select, 'POLLERR', 0)
+_POLL_WRITE = getattr(select, 'POLLOUT', 0)
+_POLL_ERROR = getattr(select, 'POLLHUP', 0) | getattr(select, 'POLLERR', 0)
+
+
+def wakeup_pair():
+    """Returns a connected pair of sockets, writing to the second wakes a select() waiting on the first."""
+    if hasattr(socket, 'socketpair'):
+        reader, writer = socket.socketpair()
+    else:
+        # Python 2 on Windows has no socketpair, build one over loopback
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            writer = socket.create_connection(listener.getsockname())
+            reader = listener.accept()[0]
+        finally:
+            listener.close()
+    reader.setblocking(False)
+    writer.setblocking(False)
+    return reader, writer
+
+
+class Timer(object):
+    """Handle for a callback scheduled with EventLoop.call_later."""
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    """
+    Single threaded loop dispatching socket readiness and timers. It sleeps in poll() (select() where poll is missing)
+    until a registered file object is ready or the next timer is due, so an idle link costs no wakeups. Other threads
+    hand work to it with call_soon_threadsafe.
+
+    A callback that raises is handed to on_error, when given, and the loop goes on. Without it the exception ends
+    run().
+    """
+
+    def __init__(self, on_error=None):
+        self.wakeups = 0  # times the loop returned from waiting, for measuring idle cost
+        self._on_error = on_error  # called with the exception, inside its except block
+        self._readers = {}
+        self._writers = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._pending = deque()
+        self._wakeup_reader, self._wakeup_writer = wakeup_pair()
+        self._running = False
+
+    def add_reader(self, fileobj, callback):
+        self._readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        self._readers.pop(fileobj, None)
+
+    def add_writer(self, fileobj, callback):
+        self._writers[fileobj] = callback
+
+    def remove_writer(self, fileobj):
+        self._writers.pop(fileobj, None)
+
+    def call_later(self, delay, callback, *args):
+        timer = Timer(now() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._sequence), timer))
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        self._pending.append((callback, args))
+        try:
+            self._wakeup_writer.send(b'\0')
+        except socket.error:
+            pass  # already woken
+
+    def stop(self):
+        """Stops the loop, safe to call from any thread."""
+        self.call_soon_threadsafe(self._stop)
+
+    def run(self):
+        self._running = True
+        while self._running:
+            if self._pending:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0.0, self._timers[0][0] - now())
+            else:
+                timeout = None
+            readable, writable = self._wait(timeout)
+            self.wakeups += 1
+            for fileobj in readable:
+                if fileobj is self._wakeup_reader:
+                    self._drain_wakeup()
+                else:
+                    # a callback earlier in this pass may have unregistered it
+                    callback = self._readers.get(fileobj)
+                    if callback is not None:
+                        self._call(callback, ())
+            for fileobj in writable:
+                callback = self._writers.get(fileobj)
+                if callback is not None:
+                    self._call(callback, ())
+            self._run_timers()
+            while self._pending:
+                callback, args = self._pending.popleft()
+                self._call(callback, args)
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _stop(self):
+        self._running = False
+
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as err:
+            if self._on_error is None:
+                raise
+            self._on_error(err)
+
+    def _run_timers(self):
+        current = now()
+        while self._timers and self._timers[0][0] <= current:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                self._call(timer.callback, timer.args)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except socket.error:
+            pass  # drained
+
+    def _wait(self, timeout):
+        readers = list(self._readers) + [self._wakeup_reader]
+        writers = list(self._writers)
+        if not hasattr(select, 'poll'):
+            readable, writable = select.select(readers, writers, [], timeout)[:2]
+            return readable, writable
+        # poll has no FD_SETSIZE limit, which matters inside a process as busy as Kodi
+        poller = select.poll()
+        by_fd = {}
+        for fileobj in readers:
+            fd = fileobj.fileno()
+            by_fd[fd] = fileobj
+            poller.register(fd, _POLL_READ)
+        for fileobj in writers:
+            fd = fileobj.fileno()
+            if fd in by_fd:
+                poller.modify(fd, _POLL_READ | _POLL_WRITE)
+            else:
+                poller.register(fd, _POLL_WRITE)
+            by_fd[fd] = fileobj
+        readable = []
+        writable = []
+        for fd, event in poller.poll(None if timeout is None else int(timeout * 1000 + 0.999)):
+            fileobj = by_fd[fd]
+            if event & _POLL_READ and (fileobj in self._readers or fileobj is self._wakeup_reader):
+                readable.append(fileobj)
+            # errors are reported to writers too, their send fails and they close the socket
+            if event & (_POLL_WRITE | _POLL_ERROR) and fileobj in self._writers:
+                writable.append(fileobj)
+        return readable, writable
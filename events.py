@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+
+# notifications pushed to the server, by namespace
+NAMESPACES = frozenset(['Application', 'AudioLibrary', 'Player', 'System', 'VideoLibrary'])
+# a burst ends after this long without a notification, but is pushed at the latest MAX_DELAY after it began
+DEBOUNCE_SECONDS = 0.1
+MAX_DELAY_SECONDS = 1.0
+# last pushed data kept per connection, the oldest is forgotten and its key pushed whole again
+MAX_KEYS = 1000
+
+
+def event_key(method, data):
+    """
+    Returns what a notification is coalesced by: one key per library item for item updates, the namespace otherwise,
+    so a burst of player state changes collapses to the last one.
+    """
+    namespace, _, event = method.partition('.')
+    if event in ('OnUpdate', 'OnRemove') and isinstance(data, dict):
+        # VideoLibrary nests the item, AudioLibrary does not
+        item = data.get('item', data)
+        if isinstance(item, dict) and 'type' in item and 'id' in item:
+            return '%s/%s/%s' % (namespace, item['type'], item['id'])
+    return namespace
+
+
+def delta(old, new):
+    """Members of object new that differ from object old, recursively, with null for those new lacks."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return new
+    changed = {}
+    for name, value in new.items():
+        if name not in old:
+            changed[name] = value
+        elif old[name] != value:
+            changed[name] = delta(old[name], value)
+    for name in old:
+        if name not in new:
+            changed[name] = None
+    return changed
+
+
+class EventQueue(object):
+    """
+    Kodi notifications waiting to be pushed, coalesced by key so only the last of a burst is sent. Each event carries
+    only what changed since the last one pushed for its key. Used on the link's thread only.
+    """
+
+    def __init__(self):
+        self.started = None  # when the pending burst began
+        self.received = 0
+        self._pending = OrderedDict()  # key -> (method, data)
+        self._sent = OrderedDict()  # key -> (method, data) last pushed on this connection
+
+    def add(self, method, data, now):
+        """Queues a notification, returns True when it begins a burst."""
+        self.received += 1
+        self._pending[event_key(method, data)] = (method, data)
+        if self.started is None:
+            self.started = now
+            return True
+        return False
+
+    def take(self):
+        """
+        Returns the events of the pending burst, [{"key", "method", "data"}], leaving out any that changed nothing.
+        """
+        events = []
+        for key, (method, data) in self._pending.items():
+            last = self._sent.pop(key, None)
+            self._sent[key] = (method, data)
+            if last is None:
+                events.append({'key': key, 'method': method, 'data': data})
+                continue
+            changed = delta(last[1], data)
+            if changed != {} or method != last[0]:
+                events.append({'key': key, 'method': method, 'data': changed})
+        while len(self._sent) > MAX_KEYS:
+            self._sent.popitem(last=False)
+        self._pending.clear()
+        self.started = None
+        return events
+
+    def reset(self):
+        """Forgets what was pushed, for a new connection."""
+        self._pending.clear()
+        self._sent.clear()
+        self.started = None
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import struct
+import tempfile
+import zlib
+import msgs
+
+# largest buffer kept between messages, anything bigger is released once the message is processed
+RETAIN_BYTES = 256 * 1024
+# an inbound frame may hold this much in memory, half for its compressed packet and half for what it inflates to
+INBOUND_MEMORY_BYTES = 16 * 1024 * 1024
+# a request inflating to more is answered with an error, whatever its compressed size
+MAX_REQUEST_BYTES = 64 * 1024 * 1024
+# compressed bytes per outgoing packet when the server accepts chunked frames
+PACKET_BYTES = 64 * 1024
+# uncompressed bytes handed to the compressor at a time
+COMPRESS_STEP_BYTES = 64 * 1024
+# without a preset dictionary, messages shorter than this are stored, deflate saves them a few bytes at twice the time
+STORE_BYTES = 48
+# messages this long are bulk transfers, worth the slower and tighter level
+BULK_BYTES = 16 * 1024
+LEVEL_STORED = 0  # zlib.Z_NO_COMPRESSION, which Python 2 lacks
+LEVEL_INTERACTIVE = 1
+# level 9 takes twice the time of 6 on a library listing for 5% fewer bytes
+LEVEL_BULK = 6
+# namespaces of the methods whose responses are library listings
+BULK_NAMESPACES = frozenset(['AudioLibrary', 'Files', 'VideoLibrary'])
+
+try:
+    # Python 2 zlib only accepts strings and read-only buffers
+    readonly = buffer
+except NameError:
+    def readonly(data, offset=0, size=None):
+        if size is None:
+            return memoryview(data)[offset:]
+        return memoryview(data)[offset:offset + size]
+
+
+class FrameBuffer(object):
+    """
+    Reusable receive buffer for a link frame. Space for each packet is reserved from its size header so the socket
+    reads straight into place with recv_into, instead of concatenating every partial read into a new bytes object.
+    """
+
+    def __init__(self, retain=RETAIN_BYTES):
+        self.retain = retain
+        self.length = 0  # bytes of the frame received so far
+        self._buffer = bytearray(retain)
+
+    def reserve(self, size):
+        """Makes room for size more bytes after the received data and returns a writable view of that space."""
+        end = self.length + size
+        if end > len(self._buffer):
+            if self.length == 0:
+                # first packet of a frame, allocate exactly what the size header asked for
+                grown = bytearray(end)
+            else:
+                # later packets of a multi-packet frame, grow geometrically to keep copying linear
+                grown = bytearray(max(end, len(self._buffer) + (len(self._buffer) >> 1)))
+                memoryview(grown)[:self.length] = memoryview(self._buffer)[:self.length]
+            self._buffer = grown
+        return memoryview(self._buffer)[self.length:end]
+
+    def advance(self, size):
+        """Marks size bytes of the reserved space as received."""
+        self.length += size
+
+    def data(self):
+        """Returns a read-only, zero-copy view of the received frame."""
+        return readonly(self._buffer, 0, self.length)
+
+    def release(self):
+        """Empties the buffer for the next frame, dropping oversized storage so one big frame is not held forever."""
+        self.length = 0
+        if len(self._buffer) > self.retain:
+            self._buffer = bytearray(self.retain)
+
+
+def compression_level(size, method=None, zdict=None):
+    """
+    Returns the zlib level for a message of size bytes answering method: stored when tiny, fast for interactive
+    calls where latency matters most, tighter for listings and anything large. Tiny messages gain the most from a
+    preset dictionary, with zdict they are always deflated.
+    """
+    if size < STORE_BYTES and zdict is None:
+        return LEVEL_STORED
+    if size >= BULK_BYTES or (method is not None and method.partition('.')[0] in BULK_NAMESPACES):
+        return LEVEL_BULK
+    return LEVEL_INTERACTIVE
+
+
+def compressor(level=zlib.Z_DEFAULT_COMPRESSION, zdict=None):
+    """Returns a zlib compressor, primed with the preset dictionary zdict if given and worth it at this level."""
+    if zdict is None or level == LEVEL_STORED:
+        return zlib.compressobj(level)
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+
+
+def decompressor(zdict=None):
+    """Returns a zlib decompressor, one given zdict also inflates streams compressed without it."""
+    if zdict is None:
+        return zlib.decompressobj()
+    return zlib.decompressobj(zlib.MAX_WBITS, zdict)
+
+
+class BoundedInflater(object):
+    """
+    Inflates the packets of one frame to at most limit bytes in all, so a small frame cannot expand without bound.
+    Once more than memory bytes are inflated they go to a temporary file in directory instead, mapped and read back
+    whole by message(), which avoids holding the pieces and their joined copy at once.
+    """
+
+    def __init__(self, zdict=None, limit=MAX_REQUEST_BYTES, memory=INBOUND_MEMORY_BYTES // 2, directory=None):
+        self.limit = limit
+        self.memory = memory
+        self.directory = directory
+        self.length = 0  # bytes inflated so far
+        self.exceeded = False  # the frame inflates to more than limit, the rest of it is ignored
+        self._inflater = decompressor(zdict)
+        self._pieces = []
+        self._spill = None  # temporary file once the pieces outgrow memory
+
+    def decompress(self, data):
+        if not self.exceeded:
+            room = self.limit - self.length
+            # one byte more than there is room for tells an oversized frame apart from one that fits exactly
+            self._add(self._inflater.decompress(data, room + 1))
+
+    def message(self):
+        """Returns the inflated frame, None when it exceeded the limit."""
+        if not self.exceeded:
+            self._add(self._inflater.flush(self.limit - self.length + 1))
+        if self.exceeded:
+            return None
+        if self._spill is None:
+            return b''.join(self._pieces)
+        self._spill.flush()
+        mapped = mmap.mmap(self._spill.fileno(), self.length, access=mmap.ACCESS_READ)
+        try:
+            return mapped[:]
+        finally:
+            mapped.close()
+            self.close()
+
+    def _add(self, piece):
+        self.length += len(piece)
+        if self.length > self.limit:
+            self.exceeded = True
+            self.close()
+        elif self._spill is not None:
+            self._spill.write(piece)
+        elif self.length > self.memory:
+            self._spill = tempfile.TemporaryFile(prefix='inbound', dir=self.directory)
+            for held in self._pieces:
+                self._spill.write(held)
+            self._spill.write(piece)
+            self._pieces = []
+        else:
+            self._pieces.append(piece)
+
+    def close(self):
+        """Drops what was inflated."""
+        self._pieces = []
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+def compress(message, level=zlib.Z_DEFAULT_COMPRESSION, zdict=None):
+    deflater = compressor(level, zdict)
+    return deflater.compress(message) + deflater.flush()
+
+
+def compress_packets(message, packet_size=PACKET_BYTES, level=zlib.Z_DEFAULT_COMPRESSION, zdict=None):
+    """
+    Compresses message a step at a time and yields the compressed stream cut into packets of packet_size bytes, the
+    last one shorter. Only about one packet of compressed output exists at any moment.
+    """
+    deflater = compressor(level, zdict)
+    pending = bytearray()
+    for first in range(0, len(message), COMPRESS_STEP_BYTES):
+        pending += deflater.compress(readonly(message, first, COMPRESS_STEP_BYTES))
+        while len(pending) >= packet_size:
+            yield bytes(pending[:packet_size])
+            del pending[:packet_size]
+    pending += deflater.flush()
+    while pending:
+        yield bytes(pending[:packet_size])
+        del pending[:packet_size]
+
+
+def split_packets(compressed, packet_size=PACKET_BYTES):
+    """Yields already compressed data in packets of packet_size bytes, the last one shorter."""
+    view = memoryview(compressed)
+    for first in range(0, len(compressed), packet_size):
+        yield view[first:first + packet_size].tobytes()
+
+
+def chunked_frame(packets):
+    """Yields the packets of a chunked frame body, each with its size header, then the zero size terminator."""
+    for packet in packets:
+        yield struct.pack('>l', len(packet)) + packet
+    yield struct.pack('>l', 0)
+
+
+def sized_packets(packets):
+    """Yields the packets of a multi-packet frame body, each with its size header. None from packets is passed on."""
+    for packet in packets:
+        yield None if packet is None else struct.pack('>l', len(packet)) + packet
+
+
+def stream_packets(stream_id, packets):
+    """
+    Yields packets as MSG_ID_STREAM frames of stream stream_id, then the zero size one ending the stream. Each is
+    whole on the wire, so other frames may be written between them. None from packets is passed on.
+    """
+    for packet in packets:
+        yield None if packet is None else struct.pack('>lll', msgs.MSG_ID_STREAM, stream_id, len(packet)) + packet
+    yield struct.pack('>lll', msgs.MSG_ID_STREAM, stream_id, 0)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# The link as a standalone daemon for many Kodi instances, without Kodi's Python modules:
+#
+#     python gateway.py gateway.json [--data ~/.mediasteward-gateway]
+#
+# gateway.json names the instances by the URL of their HTTP JSON-RPC interface, and may set any of the addon's
+# settings, which otherwise keep their defaults from resources/settings.xml:
+#
+#     {"instances": [{"uuid": "...", "url": "http://192.168.1.20:8080/jsonrpc", "username": "kodi",
+#                     "password": "..."}],
+#      "idle-connections": 4,
+#      "settings": {"worker-threads": 16, "log-link": 2}}
+#
+# SIGHUP reads the file again, SIGTERM and SIGINT end the daemon.
+
+import argparse
+import base64
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import xml.etree.ElementTree as ElementTree
+import link
+import linklog
+import msgs
+import settings
+import workers
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+except ImportError:
+    import httplib
+    from urlparse import urlsplit
+
+ADDON_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+KODI_TIMEOUT_SECONDS = 30.0
+IDLE_CONNECTIONS = 4  # kept open per instance between requests
+WORKERS_PER_INSTANCE = 2  # the default pool size, at least workers.DEFAULT_WORKERS
+# Kodi's notifications do not reach the gateway, the response cache, the title index and the library snapshot would
+# go stale without them
+FORCED_SETTINGS = {'response-cache': '0', 'title-index': 'false', 'library-snapshot': 'false'}
+# linklog's levels in the logging module's terms
+LOG_LEVELS = {
+    linklog.LOGDEBUG: logging.DEBUG,
+    linklog.LOGINFO: logging.INFO,
+    linklog.LOGNOTICE: logging.INFO,
+    linklog.LOGWARNING: logging.WARNING,
+    linklog.LOGERROR: logging.ERROR,
+}
+
+logger = logging.getLogger('mediasteward.gateway')
+
+
+class KodiError(Exception):
+    pass
+
+
+def write_log(line, level=linklog.LOGDEBUG):
+    logger.log(LOG_LEVELS.get(level, logging.ERROR), line)
+
+
+def addon_version():
+    return ElementTree.parse(os.path.join(ADDON_DIRECTORY, 'addon.xml')).getroot().get('version')
+
+
+def closed_by_peer(connection):
+    """Returns True if an idle keep-alive connection can no longer be used, the other end closed it meanwhile."""
+    if connection.sock is None:
+        return True
+    try:
+        # an idle connection has nothing to read, unless it is the end of the stream
+        return bool(select.select([connection.sock], [], [], 0)[0])
+    except (socket.error, ValueError):
+        return True
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP connections to the JSON-RPC interface of one Kodi, shared by the workers. A request takes an idle
+    connection or opens a new one and puts it back once the response has been read, up to idle of them are kept.
+    Connections Kodi closed while idle are noticed before they are used. A request is sent again only when sending it
+    failed on a connection that had been used before, a call Kodi may have received never runs twice.
+    """
+
+    def __init__(self, url, username=None, password=None, idle=IDLE_CONNECTIONS, timeout=KODI_TIMEOUT_SECONDS):
+        parts = urlsplit(url)
+        self.url = url
+        self.connection_class = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/jsonrpc'
+        self.headers = {'Content-Type': 'application/json'}
+        if username is not None:
+            credentials = ('%s:%s' % (username, password or '')).encode('utf-8')
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+        self.idle = idle
+        self.timeout = timeout
+        self.opened = 0
+        self.requests = 0
+        self._connections = []  # idle, the most recently used last
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def post(self, body):
+        """Runs a JSON-RPC request and returns the body of the response, on a worker."""
+        while True:
+            connection, reused = self._take()
+            try:
+                connection.request('POST', self.path, body, self.headers)
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            try:
+                response = connection.getresponse()
+                data = response.read()
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(connection)
+            if response.status != 200:
+                raise KodiError("%s answered HTTP %d %s" % (self.url, response.status, response.reason))
+            return data
+
+    def close(self):
+        """Closes the idle connections, those in use are closed as they come back."""
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def stats(self):
+        with self._lock:
+            return {'opened': self.opened, 'requests': self.requests, 'idle': len(self._connections)}
+
+    def _take(self):
+        """Returns a connection and whether it served before."""
+        with self._lock:
+            self.requests += 1
+            while self._connections:
+                connection = self._connections.pop()
+                if not closed_by_peer(connection):
+                    return connection, True
+                connection.close()
+            self.opened += 1
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _put(self, connection):
+        with self._lock:
+            if not self._closed and len(self._connections) < self.idle:
+                self._connections.append(connection)
+                return
+        connection.close()
+
+
+class Instance(object):
+    """A Kodi served by the gateway, from its entry in the configuration."""
+
+    def __init__(self, entry, idle=IDLE_CONNECTIONS):
+        self.uuid = entry.get('uuid', '')
+        if not (isinstance(self.uuid, type(u'')) and len(self.uuid) == 32 and self.uuid.isalnum()):
+            raise ValueError("instance %r has no valid uuid" % entry.get('url'))
+        if not entry.get('url') or not isinstance(entry['url'], type(u'')):
+            raise ValueError("instance %s has no url" % self.uuid)
+        self.key = json.dumps(entry, sort_keys=True)
+        self.pool = ConnectionPool(entry['url'], entry.get('username'), entry.get('password'), idle)
+
+
+class ConfigSettings(object):
+    """The settings of the configuration file over the addon's defaults, read as the addon's are."""
+
+    def __init__(self, values, defaults):
+        self.values = values
+        self.defaults = defaults
+
+    def getSetting(self, id):
+        if id in FORCED_SETTINGS:
+            return FORCED_SETTINGS[id]
+        value = self.values.get(id, self.defaults.get(id, ''))
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return value if isinstance(value, type(u'')) else str(value)
+
+
+class Gateway(link.Link):
+    """
+    The link standalone, one upstream connection for many Kodi instances. The server names the instance of each
+    request, which runs over that Kodi's pool of HTTP connections. Searches and events need Kodi's notifications and
+    are not offered.
+    """
+
+    def __init__(self, path, directory):
+        self.path = path
+        self.instances = []
+        link.Link.__init__(self, addon_version(), self.load(), linklog.LinkLog(write_log), directory)
+
+    def load(self):
+        """Reads the configuration file, returns a snapshot of its settings and takes its instances."""
+        with open(self.path) as config_file:
+            config = json.load(config_file)
+        # read_settings keeps the settings as they were on a ValueError, a bad file must raise nothing else
+        if not isinstance(config, dict):
+            raise ValueError("%s does not hold an object" % self.path)
+        entries = config.get('instances')
+        if not isinstance(entries, list) or not entries:
+            raise ValueError("%s lists no instances" % self.path)
+        if not all(isinstance(entry, dict) for entry in entries):
+            raise ValueError("%s lists an instance that is not an object" % self.path)
+        if not isinstance(config.get('settings', {}), dict):
+            raise ValueError("%s has settings that are not an object" % self.path)
+        try:
+            idle = int(config.get('idle-connections', IDLE_CONNECTIONS))
+        except TypeError:
+            raise ValueError("%s has an idle-connections that is not a number" % self.path)
+        # unchanged instances keep their pools and connections
+        current = dict((instance.key, instance) for instance in self.instances)
+        instances = []
+        for entry in entries:
+            instance = current.pop(json.dumps(entry, sort_keys=True), None)
+            instances.append(instance if instance is not None else Instance(entry, idle))
+        for instance in current.values():
+            instance.pool.close()
+        self.instances = instances
+        defaults = settings.setting_defaults(ADDON_DIRECTORY)
+        values = dict(config.get('settings', {}))
+        values.setdefault('worker-threads', max(workers.DEFAULT_WORKERS, WORKERS_PER_INSTANCE * len(instances)))
+        # a change of the instances renumbers them, which takes a new announce
+        values['uuid'] = instances[0].uuid
+        values['instances'] = ' '.join(instance.key for instance in instances)
+        ids = [i for i, _ in defaults] + ['instances']
+        return settings.Snapshot(ConfigSettings(values, dict(defaults)), ids)
+
+    def execute_jsonrpc(self, request, instance):
+        instances = self.instances
+        if not 0 <= instance < len(instances):
+            raise KodiError("no instance %d, the gateway serves %d" % (instance, len(instances)))
+        return instances[instance].pool.post(request)
+
+    def read_settings(self):
+        try:
+            return self.load()
+        except (IOError, OSError, ValueError) as err:
+            self.log.error('link', "could not read %s, the settings stay as they were: %s", self.path, err)
+            return self.settings
+
+    def write_setting(self, id, value):
+        pass  # the file is the user's, it is never written
+
+    def capabilities(self):
+        offered = [c for c in link.Link.capabilities(self) if c not in (msgs.CAPABILITY_SEARCH, msgs.CAPABILITY_EVENTS)]
+        return offered + [msgs.CAPABILITY_GATEWAY]
+
+    def announcement(self, uuid):
+        announce = link.Link.announcement(self, uuid)
+        announce['instances'] = [instance.uuid for instance in self.instances]
+        return announce
+
+    def stats(self):
+        summary = link.Link.stats(self)
+        summary['instances'] = dict((instance.uuid, instance.pool.stats()) for instance in self.instances)
+        return summary
+
+    def close(self):
+        for instance in self.instances:
+            instance.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Media Steward link for many Kodi instances")
+    parser.add_argument('config', help="JSON file naming the Kodi instances, see the top of gateway.py")
+    parser.add_argument('--data', default=os.path.join(os.path.expanduser('~'), '.mediasteward-gateway'),
+                        help="directory for large requests and profiles")
+    parser.add_argument('--server', help="host:port to connect to instead of Media Steward, for testing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        gateway = Gateway(args.config, args.data)
+    except (IOError, OSError, ValueError) as err:
+        parser.error("could not read %s: %s" % (args.config, err))
+    if args.server:
+        host, _, port = args.server.rpartition(':')
+        gateway.host, gateway.port = host, int(port)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: gateway.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: gateway.stop())
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: gateway.on_settings_changed())
+    thread = threading.Thread(target=gateway.run, name="Media Steward gateway")
+    thread.start()
+    # joined in slices, signals are only handled on this thread between them
+    while thread.is_alive():
+        thread.join(0.5)
+    gateway.close()
+    logger.info("Media Steward gateway exiting")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
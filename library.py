@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import binascii
+import bisect
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+PAGE_SIZE = 1000
+# a reconciliation pauses this long between pages, it must not hold up Kodi's database
+RECONCILE_PAUSE_SECONDS = 0.2
+# the whole library is listed again this often, for changes Kodi sent no notification of
+RECONCILE_SECONDS = 6 * 3600.0
+# changes remembered for deltas, a version older than the oldest is answered with a full resync
+MAX_CHANGES = 20000
+DEFAULT_LIMIT = 5000
+MAX_LIMIT = 20000
+
+# media type: (list method, result key, id field, details method, details key, properties hashed)
+MEDIA_TYPES = {
+    'movie': ('VideoLibrary.GetMovies', 'movies', 'movieid', 'VideoLibrary.GetMovieDetails', 'moviedetails',
+              ['title', 'year', 'genre', 'rating', 'runtime', 'file', 'playcount', 'lastplayed', 'resume',
+               'dateadded']),
+    'tvshow': ('VideoLibrary.GetTVShows', 'tvshows', 'tvshowid', 'VideoLibrary.GetTVShowDetails', 'tvshowdetails',
+               ['title', 'year', 'genre', 'file', 'episode', 'watchedepisodes', 'playcount', 'lastplayed',
+                'dateadded']),
+    'episode': ('VideoLibrary.GetEpisodes', 'episodes', 'episodeid', 'VideoLibrary.GetEpisodeDetails',
+                'episodedetails',
+                ['title', 'tvshowid', 'season', 'episode', 'file', 'playcount', 'lastplayed', 'resume', 'dateadded']),
+    'musicvideo': ('VideoLibrary.GetMusicVideos', 'musicvideos', 'musicvideoid', 'VideoLibrary.GetMusicVideoDetails',
+                   'musicvideodetails',
+                   ['title', 'artist', 'album', 'year', 'file', 'playcount', 'lastplayed', 'resume', 'dateadded']),
+    'artist': ('AudioLibrary.GetArtists', 'artists', 'artistid', 'AudioLibrary.GetArtistDetails', 'artistdetails',
+               ['genre']),
+    'album': ('AudioLibrary.GetAlbums', 'albums', 'albumid', 'AudioLibrary.GetAlbumDetails', 'albumdetails',
+              ['title', 'artist', 'year', 'genre', 'playcount']),
+    'song': ('AudioLibrary.GetSongs', 'songs', 'songid', 'AudioLibrary.GetSongDetails', 'songdetails',
+             ['title', 'artist', 'album', 'albumid', 'track', 'duration', 'file', 'playcount', 'lastplayed']),
+}
+LIBRARY_TYPES = {
+    'VideoLibrary': ('movie', 'tvshow', 'episode', 'musicvideo'),
+    'AudioLibrary': ('artist', 'album', 'song'),
+}
+
+
+def content_hash(item):
+    """Hash of a library item as Kodi lists it, the same for the same content whichever call returned it."""
+    text = json.dumps(item, sort_keys=True, separators=(',', ':'))
+    return zlib.crc32(text.encode('utf-8')) & 0xffffffff
+
+
+class LibrarySnapshot(object):
+    """
+    Versioned snapshot of the library's item ids with a hash of each item's content, per media type, so the server
+    can ask for what changed since the version it last saw instead of listing the whole library again. Every change
+    takes the next version and is remembered, up to MAX_CHANGES of them. Items are loaded once in pages, then kept
+    current from Kodi's library notifications and reconciled with a full listing, paced, after scans and every
+    RECONCILE_SECONDS. Loading and reconciling run on a background thread.
+    """
+
+    def __init__(self, execute):
+        self.ready = False
+        self.errors = 0
+        # a new snapshot has new versions, the server resyncs when it sees another id
+        self.id = binascii.hexlify(os.urandom(8)).decode('ascii')
+        self._execute = execute  # (method, params) -> JSON-RPC result
+        self._lock = threading.Lock()
+        self._items = {}  # type -> {id: hash}, for the types loaded
+        self._sorted = {}  # type -> sorted ids, for paging, dropped when items come or go
+        self._changes = deque()  # (version, type, id, added) oldest first
+        self._version = 0
+        self._floor = 0  # versions before it are not covered by the changes
+        self._pending = set()  # (type, id) with an update queued, (type, None) with a reconciliation
+        self._tasks = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Loads the library and starts following its changes, only the first call does anything."""
+        if self._thread is not None:
+            return
+        self.reconcile()
+        self._tasks.put(('ready', None, None))
+        self._thread = threading.Thread(target=self._run, name="Media Steward library snapshot")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._tasks.put(None)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def reconcile(self, media_types=None):
+        """Queues a full listing of media_types, all by default, to be compared with the snapshot."""
+        for media_type in sorted(media_types or MEDIA_TYPES):
+            with self._lock:
+                if (media_type, None) in self._pending:
+                    continue  # one queued already, it lists the library as it is by then
+                self._pending.add((media_type, None))
+            self._tasks.put(('reconcile', media_type, None))
+
+    def on_notification(self, method, data):
+        """Queues the snapshot changes a Kodi notification implies, data is its decoded payload."""
+        library, _, event = method.partition('.')
+        if library not in LIBRARY_TYPES:
+            return
+        if event in ('OnScanFinished', 'OnCleanFinished'):
+            # the music scanner announces no items, and a clean removes files Kodi may not report one by one
+            self.reconcile(LIBRARY_TYPES[library])
+        elif event in ('OnUpdate', 'OnRemove') and isinstance(data, dict):
+            # VideoLibrary nests the item, AudioLibrary does not
+            item = data.get('item', data)
+            if isinstance(item, dict) and item.get('type') in MEDIA_TYPES and 'id' in item:
+                key = (item['type'], item['id'])
+                with self._lock:
+                    if event == 'OnRemove':
+                        # an update after it must not be folded into one queued before
+                        self._pending.discard(key)
+                    elif key in self._pending:
+                        return  # a burst of updates of one item, such as while it plays, needs one look at it
+                    else:
+                        self._pending.add(key)
+                self._tasks.put(('update' if event == 'OnUpdate' else 'remove', item['type'], item['id']))
+
+    def delta(self, snapshot=None, version=None, types=None, after=None, limit=DEFAULT_LIMIT):
+        """
+        Returns what changed since version of snapshot as {"snapshot", "version", "full", "more", "types": {type:
+        {"added", "changed", "removed"}}}: [id, hash] of items added and changed, ids of those removed. When the
+        changes do not reach back to version, or it is of another snapshot, every item is listed as added and full
+        is set, with every type loaded. Otherwise only the types with changes are there. At most limit items are
+        listed, ordered by type and id. When others follow, more is set and after holds the [type, id] of the last,
+        the same call with that after returns them.
+        """
+        types = sorted(set(types or MEDIA_TYPES) & set(MEDIA_TYPES))
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        after = tuple(after) if after else None
+        with self._lock:
+            full = snapshot != self.id or not isinstance(version, int) or not self._floor <= version <= self._version
+            if full:
+                entries = self._all(types, after, limit + 1)
+            else:
+                entries = self._since(version, types, after, limit + 1)
+            response = {'snapshot': self.id, 'version': self._version, 'full': full,
+                        'more': len(entries) > limit,
+                        'types': dict((t, {'added': [], 'changed': [], 'removed': []})
+                                      for t in types if t in self._items)}
+        for media_type, item_id, kind, item_hash in entries[:limit]:
+            listed = response['types'][media_type][kind]
+            listed.append(item_id if kind == 'removed' else [item_id, '%08x' % item_hash])
+        if response['more']:
+            response['after'] = list(entries[limit - 1][:2])
+        if not full:
+            response['types'] = dict((t, kinds) for t, kinds in response['types'].items() if any(kinds.values()))
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'items': sum(len(items) for items in self._items.values()), 'version': self._version,
+                    'changes': len(self._changes), 'queued': self._tasks.unfinished_tasks, 'ready': self.ready,
+                    'errors': self.errors}
+
+    def _all(self, types, after, count):
+        entries = []
+        for media_type in types:
+            if media_type not in self._items or (after is not None and media_type < after[0]):
+                continue
+            items = self._items[media_type]
+            ids = self._sorted.get(media_type)
+            if ids is None:
+                ids = self._sorted[media_type] = sorted(items)
+            start = bisect.bisect_right(ids, after[1]) if after is not None and media_type == after[0] else 0
+            for item_id in ids[start:start + count - len(entries)]:
+                entries.append((media_type, item_id, 'added', items[item_id]))
+            if len(entries) >= count:
+                break
+        return entries
+
+    def _since(self, version, types, after, count):
+        # the earliest change of each item after version tells whether it existed then
+        added = {}
+        for change_version, media_type, item_id, was_added in reversed(self._changes):
+            if change_version <= version:
+                break
+            added[(media_type, item_id)] = was_added
+        entries = []
+        wanted = set(types)
+        for key in sorted(added):
+            if key[0] not in wanted or (after is not None and key <= after):
+                continue
+            current = self._items.get(key[0], {}).get(key[1])
+            if current is not None:
+                entries.append(key + ('added' if added[key] else 'changed', current))
+            elif not added[key]:
+                entries.append(key + ('removed', None))
+            else:
+                continue  # came and went since version
+            if len(entries) >= count:
+                break
+        return entries
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            action, media_type, item_id = task
+            try:
+                if action == 'reconcile':
+                    self._reconcile(media_type)
+                elif action == 'update':
+                    self._update(media_type, item_id)
+                elif action == 'remove':
+                    with self._lock:
+                        self._change(media_type, item_id, None)
+                elif action == 'ready':
+                    self.ready = True
+            except Exception:
+                # the library may be busy scanning, the next reconciliation catches up
+                self.errors += 1
+            finally:
+                self._tasks.task_done()
+
+    def _reconcile(self, media_type):
+        with self._lock:
+            self._pending.discard((media_type, None))
+        method, result_key, id_field = MEDIA_TYPES[media_type][:3]
+        properties = MEDIA_TYPES[media_type][5]
+        listed = {}
+        start = 0
+        while True:
+            result = self._execute(method, {'properties': properties,
+                                            'limits': {'start': start, 'end': start + PAGE_SIZE}})
+            page = result.get(result_key, [])
+            for item in page:
+                listed[item[id_field]] = content_hash(item)
+            start += PAGE_SIZE
+            if len(page) < PAGE_SIZE or start >= result.get('limits', {}).get('total', 0):
+                break
+            time.sleep(RECONCILE_PAUSE_SECONDS)
+        with self._lock:
+            items = self._items.get(media_type)
+            if items is None:
+                # first load, deltas from versions before it would lack these items
+                self._version += 1
+                self._floor = self._version
+                self._items[media_type] = listed
+                return
+            for item_id in [i for i in items if i not in listed]:
+                self._change(media_type, item_id, None)
+            for item_id, item_hash in listed.items():
+                self._change(media_type, item_id, item_hash)
+
+    def _update(self, media_type, item_id):
+        with self._lock:
+            self._pending.discard((media_type, item_id))
+            if media_type not in self._items:
+                return  # its first load is still to come
+        details_method, details_key, properties = MEDIA_TYPES[media_type][3:]
+        id_field = MEDIA_TYPES[media_type][2]
+        try:
+            result = self._execute(details_method, {id_field: item_id, 'properties': properties})
+        except RuntimeError:
+            result = {}  # Kodi answers an error for an id it does not have
+        item = result.get(details_key)
+        with self._lock:
+            self._change(media_type, item_id, None if item is None else content_hash(item))
+
+    def _change(self, media_type, item_id, item_hash):
+        """Records an item's new hash, None when it is gone, as the next version if that changes anything."""
+        items = self._items.get(media_type)
+        if items is None:
+            return
+        current = items.get(item_id)
+        if current == item_hash:
+            return
+        self._version += 1
+        if item_hash is None:
+            del items[item_id]
+        else:
+            items[item_id] = item_hash
+        if current is None or item_hash is None:
+            self._sorted.pop(media_type, None)
+        self._changes.append((self._version, media_type, item_id, current is None))
+        while len(self._changes) > MAX_CHANGES:
+            self._floor = self._changes.popleft()[0]
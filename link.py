@@ -0,0 +1,1305 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import ssl
+import struct
+import errno
+import zlib
+import json
+import math
+import os
+import cProfile
+import functools
+import itertools
+import traceback
+from collections import deque
+import msgs
+import frames
+import workers
+import eventloop
+import cache
+import titles
+import resolver
+import backoff
+import metrics
+import linklog
+import dictionaries
+import events
+import sendqueue
+import settings
+import capture
+import library
+
+TCP_HOST = 'link.mediasteward.net'
+TCP_PORT = 59348
+
+CONNECT_TIMEOUT_SECONDS = 30.0
+ADDRESS_TIMEOUT_SECONDS = 10.0
+# the first connect waits for a route off this machine, but no longer than this
+NETWORK_WAIT_SECONDS = 30.0
+NETWORK_POLL_SECONDS = 0.5
+# the title index loads the library once the link is ready, or after this long without it
+TITLE_INDEX_DELAY_SECONDS = 30.0
+STATS_SECONDS = 60.0
+# quiet connections are pinged, the interval doubles from the first to the second with every pong
+HEARTBEAT_MIN_SECONDS = 15.0
+HEARTBEAT_MAX_SECONDS = 60.0
+PONG_TIMEOUT_SECONDS = 5.0  # at least, or four round trips when those are slower
+MISSED_PONGS = 2  # in a row, then the link is taken for dead
+PROFILE_FILES = 20  # profiles kept, the oldest is overwritten
+SEND_CHUNK_BYTES = 64 * 1024
+DISCARD_CHUNK_BYTES = 64 * 1024  # read at a time from a packet too large to take
+
+# kinds of messages for the user, Kodi's notification icons
+NOTIFY_INFO = 'info'
+NOTIFY_WARNING = 'warning'
+NOTIFY_ERROR = 'error'
+
+
+class Link(object):
+    """
+    The secure connection to Media Steward. All socket work runs on one thread inside an event loop: reads and writes
+    happen when the socket is ready, retries and settings checks are timers, and finished requests arrive from the
+    worker pool's wakeup socket. An idle link therefore sleeps until something actually happens.
+
+    Nothing here depends on Kodi. Subclasses run the requests and supply the settings: main.Link inside Kodi, and
+    gateway.Gateway standalone for many Kodi instances over their HTTP interfaces.
+    """
+
+    def __init__(self, version, snapshot, log, directory):
+        self.version = version  # of the addon, announced to the server
+        self.settings = snapshot
+        self.directory = directory  # large requests and profiles are written below it
+        self.host = TCP_HOST
+        self.port = TCP_PORT
+        self.loop = eventloop.EventLoop(self.on_callback_error)
+        self.context = ssl.create_default_context()
+        self.addresses = resolver.AddressCache()
+        self.tls_session = None  # resumed on the next connect, where the ssl module supports it
+        self.conn = None
+        self.state = 'connect'
+        self.backoff = backoff.Backoff()
+        self.retry_timer = None
+        self.retry_delay = 0.0
+        self.network_wait = None  # when waiting for the network began
+        self.connect_started = None
+        self.connect_timings = None
+        self.disconnected_at = None
+        # inbound frame
+        self.data = frames.FrameBuffer()
+        self.header = bytearray(4)
+        self.view = memoryview(self.header)
+        self.bytes_remaining = 4
+        self.packets_remaining = 0
+        self.message_id = 0  # control message being received, 0 for a request
+        self.correlation_id = None
+        self.instance = 0  # the Kodi a request is for, see msgs.CAPABILITY_GATEWAY
+        self.inflater = frames.BoundedInflater()
+        # frames too large for the inbound budget are read past and answered with an error
+        self.inbound_memory = frames.INBOUND_MEMORY_BYTES
+        self.max_request = frames.MAX_REQUEST_BYTES
+        self.spill_directory = None
+        self.oversized = False
+        self.discarding = 0  # bytes of the packet still to read past
+        self.scratch = memoryview(bytearray(DISCARD_CHUNK_BYTES))
+        self.waiting = deque()  # jobs waiting for room in the worker backlog, reading pauses meanwhile
+        self.reading_paused = False  # the connection is off the loop's readers until the backlog has room
+        # outbound messages, written by priority as the socket accepts them
+        self.outbound = sendqueue.SendQueue()
+        self.send_blocked = False  # the socket took no more, writing waits for on_writable
+        # requests handed to the worker pool
+        self.pool = None
+        self.cache = None
+        self.titles = None
+        self.library = None  # answers MSG_ID_LIBRARY, loaded once a server accepts the capability
+        self.reconcile_timer = None
+        self.epoch = 0
+        self.sequence = 0
+        self.next_sequence = 0
+        self.finished = {}
+        # negotiated with the server in the verification response
+        self.correlation = False
+        self.chunked = False
+        self.streams = False
+        self.gateway = False
+        self.controls = set([msgs.MSG_ID_VERIFICATION])  # control messages accepted from the server
+        self.zdict = None  # preset dictionary of later frames
+        # heartbeat
+        self.heartbeat_timer = None
+        self.heartbeat_interval = HEARTBEAT_MIN_SECONDS
+        self.ping_seq = 0
+        self.ping_sent = None  # when the unanswered ping went out
+        self.missed_pongs = 0
+        self.received = False  # bytes arrived since the last ping
+        self.rtt = None  # smoothed round trip in seconds
+        self.rtt_variance = None
+        # notifications pushed to the server
+        self.events = events.EventQueue()
+        self.events_enabled = False
+        self.events_timer = None
+        self.events_seq = 0
+        # instrumentation
+        self.metrics = metrics.Metrics()
+        self.frame_started = None
+        self.inflate_seconds = 0.0
+        self.executed = itertools.count(1)
+        self.profile_every = 0
+        self.last_wakeups = 0
+        self.log = log
+        self.trace_dumped = False  # the frame trace is written once per connection on errors
+        self.capture = None  # records the traffic when the capture setting is on
+        self.verification = None  # of the current connection, for captures started during it
+
+    def run(self):
+        self.log.configure(self.settings)
+        self.start_cache()
+        self.start_inbound()
+        self.start_pool()
+        self.start_profiler()
+        self.start_capture()
+        self.start_indexes()
+        self.retry_timer = self.loop.call_later(0, self.wait_for_network)
+        self.loop.call_later(STATS_SECONDS, self.log_stats)
+        self.loop.run()
+        self.state = 'disconnected'  # closing for good, no retry
+        self.soft_close()
+        self.pool.stop()
+        if self.titles is not None:
+            self.titles.stop()
+        if self.library is not None:
+            self.library.stop()
+        self.pool.join(CONNECT_TIMEOUT_SECONDS)
+        if self.titles is not None:
+            self.titles.join(CONNECT_TIMEOUT_SECONDS)
+        if self.library is not None:
+            self.library.join(CONNECT_TIMEOUT_SECONDS)
+        if self.capture is not None:
+            self.capture.close()
+
+    def stop(self):
+        """Ends the service, safe to call from any thread."""
+        self.loop.stop()
+
+    def start_pool(self):
+        if self.pool is not None:
+            self.loop.remove_reader(self.pool)
+            self.pool.stop()
+        try:
+            size = int(float(self.settings.getSetting('worker-threads')))
+        except ValueError:
+            size = workers.DEFAULT_WORKERS
+        self.pool = workers.WorkerPool(self.execute, max(size, 1))
+        self.loop.add_reader(self.pool, self.on_jobs_done)
+
+    def start_profiler(self):
+        try:
+            self.profile_every = max(0, int(float(self.settings.getSetting('profile-every'))))
+        except ValueError:
+            self.profile_every = 0
+
+    def start_cache(self):
+        try:
+            megabytes = float(self.settings.getSetting('response-cache'))
+        except ValueError:
+            megabytes = cache.DEFAULT_MAX_BYTES / (1024.0 * 1024.0)
+        self.cache = cache.ResponseCache(int(megabytes * 1024 * 1024)) if megabytes > 0 else None
+        # large listings are streamed in pages instead, never whole in memory and so never cached
+        self.progressive = self.settings.getSetting('progressive-listings') != 'false'
+
+    def start_inbound(self):
+        try:
+            self.inbound_memory = int(float(self.settings.getSetting('inbound-memory')) * 1024 * 1024)
+        except ValueError:
+            self.inbound_memory = frames.INBOUND_MEMORY_BYTES
+        try:
+            self.max_request = int(float(self.settings.getSetting('max-request')) * 1024 * 1024)
+        except ValueError:
+            self.max_request = frames.MAX_REQUEST_BYTES
+        directory = os.path.join(self.directory, 'inbound')
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError as err:
+            self.log.error('link', "could not create %s, large requests spill to the temporary directory: %s",
+                           directory, err)
+            directory = None
+        self.spill_directory = directory
+        self.new_inflater()
+
+    def start_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        if self.settings.getSetting('capture') != 'true':
+            return
+        try:
+            megabytes = float(self.settings.getSetting('capture-size'))
+        except ValueError:
+            megabytes = capture.DEFAULT_MAX_BYTES / (1024.0 * 1024.0)
+        directory = os.path.join(self.directory, 'captures')
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.capture = capture.Capture(directory, int(megabytes * 1024 * 1024))
+        except (IOError, OSError) as err:
+            self.log.error('link', "could not capture to %s: %s", directory, err)
+            return
+        self.log.notice('link', "capturing the link's traffic to %s", directory)
+        if self.conn is not None:
+            # replaying starts from the verification, which has passed already
+            self.record(capture.META, {'event': 'connected', 'host': self.host, 'version': self.version})
+            if self.verification is not None:
+                self.record(capture.META, {'event': 'verified', 'verification': self.verification})
+
+    def start_indexes(self):
+        """Creates or drops the title index and the library snapshot as their settings say."""
+        if self.settings.getSetting('title-index') != 'false':
+            if self.titles is None:
+                # loading the library competes with connecting for the CPU, it starts once the link is ready
+                self.titles = titles.TitleIndex(self.query)
+                self.loop.call_later(TITLE_INDEX_DELAY_SECONDS, self.start_titles)
+        elif self.titles is not None:
+            self.titles.stop()
+            self.titles = None
+        if self.settings.getSetting('library-snapshot') != 'false':
+            if self.library is None:
+                self.library = library.LibrarySnapshot(self.query)
+        elif self.library is not None:
+            self.library.stop()
+            self.library = None
+            if self.reconcile_timer is not None:
+                self.reconcile_timer.cancel()
+                self.reconcile_timer = None
+
+    def start_titles(self):
+        if self.titles is not None:
+            self.titles.start()
+
+    def start_library(self):
+        """Loads the library snapshot and reconciles it periodically, only the first call does anything."""
+        if self.reconcile_timer is None:
+            self.library.start()
+            self.reconcile_timer = self.loop.call_later(library.RECONCILE_SECONDS, self.reconcile_library)
+
+    def reconcile_library(self):
+        self.reconcile_timer = self.loop.call_later(library.RECONCILE_SECONDS, self.reconcile_library)
+        self.library.reconcile()
+
+    def record(self, kind, data, frame_start=False):
+        """Adds traffic to the capture, which stops on the first error writing it."""
+        try:
+            self.capture.write(kind, data, frame_start)
+        except (IOError, OSError) as err:
+            self.log.error('link', "capture stopped: %s", err)
+            self.capture.close()
+            self.capture = None
+
+    def new_inflater(self):
+        """Readies the inflater for the next frame, within the inbound budget."""
+        self.inflater = frames.BoundedInflater(self.zdict, self.max_request, self.inbound_memory // 2,
+                                               self.spill_directory)
+
+    def execute(self, job):
+        """Runs a request on a worker thread, answering read-only library queries from the cache when possible."""
+        started = eventloop.now()
+        self.metrics.observe(job.method, 'queue', started - job.submitted)
+        number = next(self.executed)
+        if self.profile_every and number % self.profile_every == 0:
+            self.profile(job, number)
+        else:
+            self.run_job(job)
+
+    def profile(self, job, number):
+        """Runs a job under cProfile and writes the profile below the link's directory."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(self.run_job, job)
+        finally:
+            directory = os.path.join(self.directory, 'profiles')
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                slot = number // self.profile_every % PROFILE_FILES
+                path = os.path.join(directory, 'request-%02d.prof' % slot)
+                profiler.dump_stats(path)
+                self.log.notice('metrics', "profiled request %d (%s) to %s", number, job.method, path)
+            except (IOError, OSError) as err:
+                self.log.error('metrics', "could not write profile: %s", err)
+
+    def run_job(self, job):
+        if job.message_id == msgs.MSG_ID_SEARCH:
+            job.response = self.search_titles(job.request)
+            return
+        if job.message_id == msgs.MSG_ID_LIBRARY:
+            job.response = self.library_changes(job.request)
+            return
+        if job.listing is not None:
+            response = None
+            if job.request is not None:
+                begin = eventloop.now()
+                response = self.execute_jsonrpc(job.request, job.instance)
+                self.metrics.observe(job.method, 'execute', eventloop.now() - begin)
+            begin = eventloop.now()
+            job.listing.page(job, response)
+            self.metrics.observe(job.method, 'compress', eventloop.now() - begin)
+            return
+        responses = self.cache
+        cacheable = cache.request_key(job.request) if responses is not None else None
+        if cacheable is not None:
+            key, id_text = cacheable
+            begin = eventloop.now()
+            entry = responses.get(key)
+            if entry is not None:
+                job.compressed = entry.render(id_text)
+                self.metrics.observe(job.method, 'cache', eventloop.now() - begin)
+                return
+            generation = responses.generation(key)
+        begin = eventloop.now()
+        job.response = self.execute_jsonrpc(job.request, job.instance)
+        self.metrics.observe(job.method, 'execute', eventloop.now() - begin)
+        if cacheable is not None:
+            try:
+                entry = cache.CachedResponse(job.response, id_text)
+            except ValueError:
+                return  # not laid out the way Kodi writes responses, send it uncached
+            responses.put(key, entry, generation)
+            job.compressed = entry.render(id_text)
+
+    def query(self, method, params):
+        """Runs a JSON-RPC call for the link itself and returns its result."""
+        request = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})
+        response = json.loads(self.execute_jsonrpc(request, 0))
+        if 'error' in response:
+            raise RuntimeError("%s failed: %s" % (method, response['error']))
+        return response['result']
+
+    def execute_jsonrpc(self, request, instance):
+        """Runs a JSON-RPC request on the Kodi numbered instance and returns its response, called on the workers."""
+        raise NotImplementedError
+
+    def notify(self, message, icon=NOTIFY_INFO, **values):
+        """
+        Shows the user a message, a string id with values for its ${} fields or text as is. Each is logged as well,
+        without a user to show it to nothing more needs to happen.
+        """
+
+    def read_settings(self):
+        """Returns a new snapshot of the settings, after on_settings_changed."""
+        raise NotImplementedError
+
+    def write_setting(self, id, value):
+        raise NotImplementedError
+
+    def capabilities(self):
+        """Returns the protocol features offered in the announce."""
+        return [c for c in msgs.CAPABILITIES
+                if (c != msgs.CAPABILITY_SEARCH or self.titles is not None) and
+                (c != msgs.CAPABILITY_LIBRARY or self.library is not None) and
+                (c != msgs.CAPABILITY_DICTIONARY or dictionaries.SUPPORTED)]
+
+    def announcement(self, uuid):
+        """Returns the announce sent on connecting."""
+        announce = {'version': self.version, 'uuid': uuid, 'capabilities': self.capabilities()}
+        if dictionaries.SUPPORTED:
+            announce['dictionaries'] = sorted(dictionaries.PRESETS)
+        return announce
+
+    def search_titles(self, request):
+        query = json.loads(request.decode('utf-8'))
+        results = self.titles.search(query.get('query', ''), query.get('types'),
+                                     int(query.get('limit', titles.DEFAULT_LIMIT)), query.get('fuzzy', True))
+        return json.dumps({'id': query.get('id'), 'ready': self.titles.ready,
+                           'results': [{'type': t, 'id': i, 'label': label, 'score': score}
+                                       for t, i, label, score in results]}).encode('utf-8')
+
+    def library_changes(self, request):
+        query = json.loads(request.decode('utf-8'))
+        if not self.library.ready:
+            return json.dumps({'id': query.get('id'), 'ready': False}).encode('utf-8')
+        response = self.library.delta(query.get('snapshot'), query.get('version'), query.get('types'),
+                                      query.get('after'), query.get('limit', library.DEFAULT_LIMIT))
+        response.update({'id': query.get('id'), 'ready': True})
+        self.metrics.count('library_full' if response['full'] else 'library_deltas')
+        return json.dumps(response, separators=(',', ':')).encode('utf-8')
+
+    def on_notification(self, method, data):
+        """Called on Kodi's thread for every notification it broadcasts."""
+        namespace = method.split('.')[0]
+        responses = self.cache
+        if responses is not None and method in cache.INVALIDATING_NOTIFICATIONS:
+            responses.invalidate(namespace)
+        # read once, a settings change may drop either on the link's thread meanwhile
+        index = self.titles
+        snapshot = self.library
+        indexed = index is not None and namespace in titles.LIBRARY_TYPES
+        synced = snapshot is not None and namespace in library.LIBRARY_TYPES
+        pushed = self.events_enabled and namespace in events.NAMESPACES
+        if not indexed and not synced and not pushed:
+            return
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return  # not JSON, nothing to index or push
+        if indexed:
+            index.on_notification(method, data)
+        if synced:
+            snapshot.on_notification(method, data)
+        if pushed:
+            self.loop.call_soon_threadsafe(self.on_event, method, data)
+
+    def wait_for_network(self):
+        """Connects once there is a route towards the server, Kodi starts services before the network is up."""
+        self.retry_timer = None
+        current = eventloop.now()
+        if self.network_wait is None:
+            self.network_wait = current
+        if resolver.network_ready(self.host) or current - self.network_wait >= NETWORK_WAIT_SECONDS:
+            if current > self.network_wait:
+                self.log.notice('link', "network up after %.1f seconds", current - self.network_wait)
+            self.connect()
+            return
+        if current == self.network_wait:
+            self.log.notice('link', "waiting for the network")
+        self.retry_timer = self.loop.call_later(NETWORK_POLL_SECONDS, self.wait_for_network)
+
+    def connect(self):
+        self.retry_timer = None
+        uuid = self.settings.getSetting('uuid')
+        if not (len(uuid) == 32 and uuid.isalnum()):
+            self.state = 'uuid'
+            self.notify(983031, NOTIFY_ERROR)  # "Please acquire valid UUID."
+            return
+        self.state = 'connect'
+        # create a new socket
+        # set both ways on every connect, the setting can change while the service runs
+        if self.settings.getSetting('ssl-validation') == 'false':
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        else:
+            self.context.verify_mode = ssl.CERT_REQUIRED
+            self.context.check_hostname = True
+        self.log.notice('link', "connecting to %s", self.host)
+        self.connect_started = eventloop.now()
+        try:
+            addresses = self.addresses.resolve(self.host, self.port)
+            resolved = eventloop.now()
+            # connecting and the handshake block this thread for at most the timeouts, everything after is non-blocking
+            self.conn, address = resolver.connect(addresses, ADDRESS_TIMEOUT_SECONDS)
+            connected = eventloop.now()
+            self.addresses.connected(self.host, self.port, address)
+            self.conn.settimeout(CONNECT_TIMEOUT_SECONDS)
+            if self.tls_session is not None:
+                self.conn = self.context.wrap_socket(self.conn, server_hostname=self.host, session=self.tls_session)
+            else:
+                self.conn = self.context.wrap_socket(self.conn, server_hostname=self.host)
+            self.connect_timings = (resolved - self.connect_started, connected - resolved, eventloop.now() - connected,
+                                    getattr(self.conn, 'session_reused', False))
+        except ssl.CertificateError as err:
+            self.log.error('link', "cert error: %s", err)
+            # only the first failure of an outage is shown, the retries are frequent at first
+            notify = self.backoff.attempts == 0 and self.settings.getSetting('hide-connection') == 'false'
+            self.soft_close()
+            if notify:
+                self.notify(str(err), NOTIFY_ERROR)
+        except ssl.SSLError as err:
+            self.log.error('link', "ssl error: %s", err)
+            notify = self.backoff.attempts == 0 and self.settings.getSetting('hide-connection') == 'false'
+            self.soft_close()
+            if notify:
+                self.notify(str(err), NOTIFY_ERROR)
+        except socket.error as err:
+            # on failed connection
+            self.log.notice('link', "connection failed: %s", err)
+            notify = self.backoff.attempts == 0 and self.settings.getSetting('hide-connection') == 'false'
+            # the addresses may have moved, look them up again next time
+            self.addresses.forget(self.host, self.port)
+            # start a new connection just in case the existing socket is bad
+            self.hard_close()
+            if notify:
+                wait = str(max(1, int(math.ceil(self.retry_delay / 60))))
+                self.notify(983030, NOTIFY_WARNING, host=self.host, wait=wait)
+        else:
+            self.on_connected()
+
+    def on_connected(self):
+        """Starts the exchange on the newly connected self.conn with the announcement."""
+        self.log.notice('link', "connected to %s", self.host)
+        self.trace_dumped = False
+        self.metrics.count('connects')
+        self.conn.setblocking(False)
+        # frames are written whole, so there is nothing for Nagle's algorithm to coalesce
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.loop.add_reader(self.conn, self.on_readable)
+        self.expect('idle', memoryview(self.header))
+        if self.capture is not None:
+            self.record(capture.META, {'event': 'connected', 'host': self.host, 'version': self.version})
+        uuid = self.settings.getSetting('uuid')
+        self.send(json.dumps(self.announcement(uuid)).encode('utf-8'), message_id=msgs.MSG_ID_ANNOUNCE)
+
+    def send(self, message, message_id=0, correlation_id=None, method=None, done=None):
+        """
+        Compresses and queues a message, method names the request it answers for the metrics and its priority. done
+        is called once the last byte of it has been written.
+        """
+        self.metrics.count('bytes_out_uncompressed', len(message))
+        self.log.frame('out', msgs.CONTROL_NAMES.get(message_id, 'response'), len(message), message)
+        level = frames.compression_level(len(message), method, self.zdict)
+        if message_id >= 0 and (self.chunked or self.streams and len(message) > frames.PACKET_BYTES):
+            # packets are compressed one at a time as the socket drains, see on_writable
+            packets = frames.compress_packets(message, level=level, zdict=self.zdict)
+            if method is not None:
+                packets = metrics.Stopwatch(packets, lambda seconds: self.metrics.observe(method, 'compress', seconds))
+            if self.streams and len(message) > frames.PACKET_BYTES:
+                self.send_stream(packets, correlation_id, method, done)
+            else:
+                self.send_chunked(packets, correlation_id, method, done)
+        else:
+            begin = eventloop.now()
+            compressed = frames.compress(message, level, self.zdict)
+            if method is not None:
+                self.metrics.observe(method, 'compress', eventloop.now() - begin)
+            self.send_compressed(compressed, message_id, correlation_id, method, done)
+
+    def queue(self, parts, message_id=0, method=None, done=None, interleaved=False):
+        """Queues the parts of a message by its priority and writes what the socket takes."""
+        if done is not None:
+            parts.append(done)
+        self.outbound.push(parts, sendqueue.priority(message_id, method, self.correlation), interleaved)
+        self.write()
+
+    def send_chunked(self, packets, correlation_id=None, method=None, done=None):
+        header = struct.pack('>l', msgs.PACKETS_CHUNKED)
+        if correlation_id is not None:
+            header += struct.pack('>l', correlation_id)
+        self.queue([header, frames.chunked_frame(packets)], method=method, done=done)
+
+    def send_stream(self, packets, correlation_id, method=None, done=None):
+        """Queues a response as stream packets, other messages may be written between them."""
+        self.queue([frames.stream_packets(correlation_id, packets)], method=method, done=done, interleaved=True)
+
+    def send_listing(self, listing, correlation_id=None, done=None):
+        """Queues a paged listing as a stream or a multi-packet frame, its packets follow as the pages finish."""
+        method = listing.call['method']
+        if self.streams:
+            self.send_stream(listing, correlation_id, method, done)
+            return
+        header = struct.pack('>l', listing.packets)
+        if correlation_id is not None:
+            header += struct.pack('>l', correlation_id)
+        self.queue([header, frames.sized_packets(listing)], method=method, done=done)
+
+    def send_compressed(self, compressed_message, message_id=0, correlation_id=None, method=None, done=None):
+        if message_id >= 0 and self.streams and len(compressed_message) > frames.PACKET_BYTES:
+            self.send_stream(frames.split_packets(compressed_message), correlation_id, method, done)
+            return
+        if message_id >= 0 and self.chunked:
+            self.send_chunked(frames.split_packets(compressed_message), correlation_id, method, done)
+            return
+
+        if message_id < 0:
+            num_packets = 1
+            header = struct.pack('>l', message_id)
+        else:
+            num_packets = max(int(math.ceil(float(len(compressed_message)) / float(msgs.MAX_MESSAGE_SIZE))), 1)
+            header = struct.pack('>l', num_packets)
+            if correlation_id is not None:
+                header += struct.pack('>l', correlation_id)
+        parts = []
+        view = memoryview(compressed_message)
+        for pkt in range(num_packets):
+            packet = view[pkt * msgs.MAX_MESSAGE_SIZE:(pkt + 1) * msgs.MAX_MESSAGE_SIZE]
+            header += struct.pack('>l', len(packet))
+            if len(packet) <= SEND_CHUNK_BYTES:
+                # small packets go out in the same write as their header
+                parts.append(header + packet.tobytes())
+            else:
+                parts.append(header)
+                for first in range(0, len(packet), SEND_CHUNK_BYTES):
+                    parts.append(packet[first:first + SEND_CHUNK_BYTES])
+            header = b''
+        self.queue(parts, message_id, method, done)
+
+    def on_writable(self):
+        self.send_blocked = False
+        self.write()
+
+    def write(self):
+        """Writes queued messages until the socket takes no more, then waits for on_writable."""
+        while self.conn is not None and not self.send_blocked:
+            message = self.outbound.next()
+            if message is None:
+                break
+            chunk = message.parts[0]
+            if callable(chunk):
+                # everything queued before it has been written
+                message.parts.popleft()
+                chunk()
+                continue
+            if not isinstance(chunk, (bytes, bytearray, memoryview)):
+                # a packet producer, take its next packet
+                try:
+                    packet = next(chunk)
+                except StopIteration:
+                    message.parts.popleft()
+                    continue
+                if packet is None:
+                    # it waits for a worker, on_jobs_done resumes writing
+                    if self.outbound.wait():
+                        continue  # a stream, others may go meanwhile
+                    break
+                message.parts.appendleft(packet)
+                continue
+            try:
+                sent = self.conn.send(chunk)
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                sent = 0
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    sent = 0
+                else:
+                    self.log.notice('link', "exception 'sending': %s, disconnecting", err)
+                    self.dump_trace('sending failed')
+                    self.soft_close()
+                    return
+            if sent == 0:
+                # nothing is tried again until the socket can take more, TLS wants the same bytes then
+                self.outbound.hold()
+                self.send_blocked = True
+                self.loop.add_writer(self.conn, self.on_writable)
+                return
+            self.metrics.count('bytes_out', sent)
+            if self.capture is not None:
+                self.record(capture.OUT, memoryview(chunk)[:sent], self.outbound.starting())
+            if sent < len(chunk):
+                message.parts[0] = memoryview(chunk)[sent:]
+                self.outbound.wrote(False)
+            else:
+                message.parts.popleft()
+                self.outbound.wrote(True)
+        if self.conn is not None and not self.send_blocked:
+            self.loop.remove_writer(self.conn)
+
+    def expect(self, state, view):
+        """Sets the reader state and the buffer the next bytes are received into."""
+        self.state = state
+        self.view = view
+        self.bytes_remaining = len(view)
+
+    def on_readable(self):
+        # read until the ssl layer runs dry, bytes it has already decrypted would not wake the loop again
+        while self.conn is not None and not self.waiting:
+            offset = len(self.view) - self.bytes_remaining
+            try:
+                received = self.conn.recv_into(self.view[offset:])
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except ssl.SSLError as err:
+                self.log.notice('link', "SSL exception in '%s': %s, disconnecting", self.state, err)
+                self.dump_trace('receiving failed')
+                self.soft_close()
+                return
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # no bytes to receive now
+                    return
+                # failed receive
+                self.log.notice('link', "exception in '%s': %s, disconnecting", self.state, err)
+                self.dump_trace('receiving failed')
+                self.soft_close()
+                return
+            if received == 0:
+                # disconnect signal from the other end
+                self.log.notice('link', "disconnecting gracefully")
+                self.soft_close()
+                return
+            self.bytes_remaining -= received
+            self.received = True
+            self.metrics.count('bytes_in', received)
+            if self.capture is not None:
+                self.record(capture.IN, self.view[offset:offset + received], self.state == 'idle' and offset == 0)
+            if self.state == 'message':
+                self.data.advance(received)
+            if self.bytes_remaining == 0:
+                self.on_field()
+
+    def on_field(self):
+        if self.state == 'idle':
+            self.frame_started = eventloop.now()
+            self.inflate_seconds = 0.0
+            self.packets_remaining = struct.unpack_from('>l', self.header)[0]
+            self.log.debug('frames', "received number of packets %d", self.packets_remaining)
+            if self.packets_remaining in self.controls:
+                # this is a control message
+                self.message_id = self.packets_remaining
+                self.packets_remaining = 1
+                self.expect('sizing', memoryview(self.header))
+            elif self.packets_remaining == msgs.PACKETS_CHUNKED and self.chunked:
+                # request message of unknown length, packets follow until one of size zero
+                self.packets_remaining = None
+                self.message_id = 0
+                self.expect('correlation' if self.correlation else 'sizing', memoryview(self.header))
+            elif self.packets_remaining > msgs.MAX_NUMBER_OF_PACKETS or self.packets_remaining < 1:
+                # this should not happen, something has gone wrong
+                self.soft_close()
+            else:
+                # request message
+                self.message_id = 0
+                self.expect('correlation' if self.correlation else 'sizing', memoryview(self.header))
+        elif self.state == 'correlation':
+            # the response is tagged with this id
+            self.correlation_id = struct.unpack_from('>l', self.header)[0]
+            self.expect('instance' if self.gateway else 'sizing', memoryview(self.header))
+        elif self.state == 'instance':
+            # the Kodi to run the request on
+            self.instance = struct.unpack_from('>l', self.header)[0]
+            self.expect('sizing', memoryview(self.header))
+        elif self.state == 'sizing':
+            size = struct.unpack_from('>l', self.header)[0]
+            self.log.debug('frames', "received number of bytes %d", size)
+            if size == 0 and self.packets_remaining is None:
+                # end of a chunked frame
+                self.state = 'processing'
+                self.process()
+            elif size < 1 or size > msgs.MAX_MESSAGE_SIZE:
+                self.soft_close()
+            elif self.oversized or size > self.inbound_memory // 2:
+                # too large to hold, read past it and answer the frame with an error
+                self.oversized = True
+                self.discard(size)
+            else:
+                # room for the whole packet is set aside once, the reads fill it in place
+                self.expect('message', self.data.reserve(size))
+        elif self.state == 'discarding':
+            self.discarding -= len(self.view)
+            if self.discarding:
+                self.discard(self.discarding)
+            else:
+                self.end_packet()
+        elif self.state == 'message':
+            self.log.debug('frames', "received message")
+            begin = eventloop.now()
+            try:
+                # inflate each packet as it arrives so only one compressed packet is held at a time
+                self.inflater.decompress(self.data.data())
+                self.inflate_seconds += eventloop.now() - begin
+            except zlib.error as err:
+                self.log.notice('link', "exception 'inflating': %s, disconnecting", err)
+                self.dump_trace('inflating failed')
+                self.soft_close()
+                return
+            self.data.release()
+            if self.inflater.exceeded:
+                self.oversized = True
+            self.end_packet()
+
+    def discard(self, size):
+        """Reads past size bytes of a packet, a chunk at a time."""
+        self.discarding = size
+        self.expect('discarding', self.scratch[:min(size, len(self.scratch))])
+
+    def end_packet(self):
+        if self.packets_remaining is not None:
+            self.packets_remaining -= 1
+        if self.packets_remaining is not None and self.packets_remaining <= 0:
+            self.state = 'processing'
+            self.process()
+        else:
+            self.expect('sizing', memoryview(self.header))
+
+    def take_message(self):
+        """Returns the inflated message, None if it was too large, and readies the inflater for the next one."""
+        if self.oversized:
+            self.inflater.close()
+            message = None
+        else:
+            message = self.inflater.message()
+        self.new_inflater()
+        self.oversized = False
+        if message is not None:
+            self.metrics.count('bytes_in_inflated', len(message))
+        return message
+
+    def process(self):
+        message = self.take_message()
+        if message is None:
+            self.reject()
+            return
+        self.log.frame('in', msgs.CONTROL_NAMES.get(self.message_id, 'request'), len(message), message)
+        if self.message_id == msgs.MSG_ID_VERIFICATION:
+            response = json.loads(message.decode('utf-8'))
+            self.log.notice('link', "received verification %s", response)
+            if 'retry-after' in response:
+                # the server asks to be left alone for a while, for a restart or when overloaded
+                try:
+                    self.backoff.retry_after(float(response['retry-after']))
+                except (TypeError, ValueError):
+                    pass
+            if 'valid-version' not in response or not response['valid-version']:
+                self.log.error('link', "disconnecting due to invalid version")
+                self.notify(983032, NOTIFY_ERROR)  # "Outdated addon version. Please update."
+                self.soft_close()
+                self.loop.stop()  # ends the service, user must upgrade and restart
+            elif 'valid-uuid' not in response or not response['valid-uuid']:
+                self.log.error('link', "disconnecting due to invalid uuid")
+                self.notify(983033, NOTIFY_ERROR)  # "Invalid UUID. Please change settings."
+                self.soft_close()
+                self.cancel_retry()
+                self.state = 'uuid'
+            else:
+                capabilities = response.get('capabilities', [])
+                self.correlation = msgs.CAPABILITY_CORRELATION in capabilities
+                self.chunked = msgs.CAPABILITY_CHUNKED in capabilities
+                self.streams = msgs.CAPABILITY_STREAMS in capabilities and self.correlation
+                self.gateway = msgs.CAPABILITY_GATEWAY in capabilities and self.correlation
+                if msgs.CAPABILITY_SEARCH in capabilities and self.titles is not None:
+                    self.controls.add(msgs.MSG_ID_SEARCH)
+                if msgs.CAPABILITY_METRICS in capabilities:
+                    self.controls.add(msgs.MSG_ID_METRICS)
+                if msgs.CAPABILITY_LIBRARY in capabilities and self.library is not None:
+                    self.controls.add(msgs.MSG_ID_LIBRARY)
+                    self.start_library()
+                if msgs.CAPABILITY_DICTIONARY in capabilities:
+                    version = response.get('dictionary')
+                    # only a version the announce offered, which it does only where zdict works
+                    if dictionaries.SUPPORTED and type(version) is int and version in dictionaries.PRESETS:
+                        # frames after the verification may be compressed with it, in either direction
+                        self.zdict = dictionaries.PRESETS[version]
+                        self.new_inflater()
+                    else:
+                        self.log.error('link', "ignoring dictionary %r the link did not offer", version)
+                self.events_enabled = msgs.CAPABILITY_EVENTS in capabilities
+                if msgs.CAPABILITY_HEARTBEAT in capabilities:
+                    self.controls.update([msgs.MSG_ID_PING, msgs.MSG_ID_PONG])
+                    self.heartbeat_interval = HEARTBEAT_MIN_SECONDS
+                    self.schedule_ping(self.heartbeat_interval)
+                self.expect('idle', memoryview(self.header))
+                self.verification = response
+                if self.capture is not None:
+                    self.record(capture.META, {'event': 'verified', 'verification': response})
+                # TLS 1.3 session tickets follow the handshake, they are in by the time the verification is
+                self.tls_session = getattr(self.conn, 'session', None)
+                self.backoff.succeeded()
+                self.log_ready()
+        elif self.message_id == msgs.MSG_ID_PING:
+            # answered right away on this thread, a pong must not wait behind requests
+            self.send(message, message_id=msgs.MSG_ID_PONG)
+            self.expect('idle', memoryview(self.header))
+        elif self.message_id == msgs.MSG_ID_METRICS:
+            try:
+                query = json.loads(message.decode('utf-8'))
+            except ValueError:
+                query = None
+            if isinstance(query, dict):
+                self.send(json.dumps({'id': query.get('id'), 'metrics': self.stats()}).encode('utf-8'),
+                          message_id=msgs.MSG_ID_METRICS)
+            else:
+                self.log.error('link', "ignoring malformed metrics query %r", message[:linklog.PREVIEW_BYTES])
+            self.expect('idle', memoryview(self.header))
+        elif self.message_id == msgs.MSG_ID_PONG:
+            self.on_pong(json.loads(message.decode('utf-8')))
+            self.expect('idle', memoryview(self.header))
+        elif self.message_id in (msgs.MSG_ID_SEARCH, msgs.MSG_ID_LIBRARY):
+            # answered by the worker pool, outside the request ordering
+            job = workers.Job(None, None, self.epoch, message, self.message_id)
+            job.method = msgs.CONTROL_NAMES[self.message_id]
+            self.submit(job)
+        else:
+            job = workers.Job(self.sequence, self.correlation_id, self.epoch, message, instance=self.instance)
+            job.method = metrics.request_method(job.request)
+            job.received = self.frame_started
+            self.metrics.observe(job.method, 'read', eventloop.now() - self.frame_started - self.inflate_seconds)
+            self.metrics.observe(job.method, 'inflate', self.inflate_seconds)
+            self.sequence += 1
+            self.correlation_id = None
+            self.instance = 0
+            calls = workers.batch_calls(job.request)
+            listing = workers.listing_call(job.request) if calls is None and self.progressive else None
+            if calls is not None:
+                # one response frame for the whole batch, its calls run on the pool
+                self.expect('idle', memoryview(self.header))
+                self.submit_jobs(workers.Batch(job, calls).next_group())
+            elif listing is not None:
+                # one packet per page, sent as each is ready
+                self.expect('idle', memoryview(self.header))
+                job.listing = workers.Listing(job, listing, self.submit_jobs, frames.LEVEL_BULK, self.zdict)
+                self.submit_jobs([job.listing.next_job()])
+            else:
+                self.submit(job)
+
+    def reject(self):
+        """Answers a request too large to take with an error in its place, a control message is dropped."""
+        kind = msgs.CONTROL_NAMES.get(self.message_id, 'request')
+        self.log.notice('link', "%s too large, over %d bytes inflated or %d compressed per packet", kind,
+                        self.max_request, self.inbound_memory // 2)
+        self.log.frame('in', kind + ' too large', 0)
+        self.metrics.count('oversized')
+        self.expect('idle', memoryview(self.header))
+        if self.message_id:
+            return
+        job = workers.Job(self.sequence, self.correlation_id, self.epoch, None)
+        job.method = 'oversized'
+        job.received = self.frame_started
+        error = {'code': -32600, 'message': "Request too large", 'data': {'max-request-bytes': self.max_request}}
+        job.response = json.dumps({'jsonrpc': '2.0', 'id': None, 'error': error}).encode('utf-8')
+        self.sequence += 1
+        self.correlation_id = None
+        self.instance = 0
+        self.finished[job.sequence] = job
+        self.flush_responses()
+
+    def submit(self, job):
+        self.expect('idle', memoryview(self.header))
+        self.submit_jobs([job])
+
+    def submit_jobs(self, jobs):
+        submitted = eventloop.now()
+        for job in jobs:
+            if job.method is None:
+                job.method = metrics.request_method(job.request)
+            job.submitted = submitted
+        # jobs the full backlog cannot take wait in order, reading stops until a worker frees up
+        self.waiting.extend(jobs)
+        while self.waiting and self.pool.submit(self.waiting[0]):
+            self.waiting.popleft()
+        self.metrics.gauge('backlog', self.pool.backlog())
+        self.metrics.gauge('waiting', len(self.waiting))
+        if self.waiting and not self.reading_paused and self.conn is not None:
+            # a readable socket left unread would wake the loop over and over
+            self.reading_paused = True
+            self.loop.remove_reader(self.conn)
+
+    def resume_reading(self):
+        self.reading_paused = False
+        if self.conn is None:
+            return
+        self.loop.add_reader(self.conn, self.on_readable)
+        if self.conn.pending():
+            # bytes already decrypted by the ssl layer would not wake the loop
+            self.loop.call_later(0, self.on_readable)
+
+    def on_jobs_done(self):
+        paged = False
+        for job in self.pool.completed():
+            if job.epoch != self.epoch:
+                continue
+            if job.listing is not None:
+                self.metrics.count('bytes_out_uncompressed', job.listing.written)
+                self.log.frame('out', 'listing page', len(job.compressed or b''))
+                if job.listing.add(job):
+                    self.finished[job.sequence] = job.listing.job
+                paged = True
+            elif job.batch is not None:
+                if job.batch.finish():
+                    group = job.batch.next_group()
+                    if group:
+                        self.submit_jobs(group)
+                    else:
+                        job.batch.respond()
+                        self.finished[job.sequence] = job.batch.job
+            elif job.message_id:
+                if job.error is not None:
+                    self.log.error('link', "exception answering control message: %s", job.error)
+                    self.dump_trace('control message failed')
+                    job.response = json.dumps({'id': None, 'error': str(job.error)}).encode('utf-8')
+                self.send(job.response, message_id=job.message_id)
+            else:
+                self.finished[job.sequence] = job
+        self.submit_jobs([])
+        if self.reading_paused and not self.waiting:
+            self.resume_reading()
+        self.flush_responses()
+        if paged:
+            # a listing may be waiting for its next page
+            self.outbound.resume()
+            self.write()
+
+    def flush_responses(self):
+        # without correlation ids the server matches responses by order, so hold back any that finished early
+        while self.conn is not None and self.finished and (self.correlation or self.next_sequence in self.finished):
+            if self.next_sequence in self.finished:
+                job = self.finished.pop(self.next_sequence)
+            else:
+                job = self.finished.pop(min(self.finished))
+            self.next_sequence = max(self.next_sequence, job.sequence + 1)
+            started = eventloop.now()
+            # runs once the last byte of the response has been written
+            done = functools.partial(self.on_sent, job, started)
+            if job.error is not None:
+                self.log.error('link', "exception executing request: %s", job.error)
+                self.dump_trace('request failed')
+                self.metrics.count('errors')
+                response = json.dumps({'jsonrpc': '2.0', 'id': None,
+                                       'error': {'code': -32603, 'message': str(job.error)}}).encode('utf-8')
+                self.send(response, correlation_id=job.correlation_id, method=job.method, done=done)
+            elif job.listing is not None:
+                self.send_listing(job.listing, correlation_id=job.correlation_id, done=done)
+            elif job.compressed is not None:
+                if job.response is None:
+                    self.log.debug('frames', "sending cached response")
+                    self.metrics.count('cached_responses')
+                    self.log.frame('out', 'cached response', len(job.compressed))
+                else:
+                    self.log.debug('payloads', "sending %s", linklog.Payload(job.response))
+                    self.log.frame('out', 'response', len(job.response), job.response)
+                self.send_compressed(job.compressed, correlation_id=job.correlation_id, method=job.method, done=done)
+            else:
+                self.log.debug('payloads', "sending %s", linklog.Payload(job.response))
+                self.send(job.response, correlation_id=job.correlation_id, method=job.method, done=done)
+
+    def on_sent(self, job, started):
+        finished = eventloop.now()
+        self.metrics.observe(job.method, 'send', finished - started)
+        self.metrics.observe(job.method, 'total', finished - job.received)
+        self.metrics.count('requests')
+
+    def schedule_ping(self, delay):
+        if self.heartbeat_timer is not None:
+            self.heartbeat_timer.cancel()
+        self.heartbeat_timer = self.loop.call_later(delay, self.ping)
+
+    def ping(self):
+        self.heartbeat_timer = None
+        if self.conn is None:
+            return
+        if self.outbound:
+            # still writing, a ping now would time the queue rather than the network
+            self.schedule_ping(PONG_TIMEOUT_SECONDS)
+            return
+        self.ping_seq += 1
+        self.ping_sent = eventloop.now()
+        self.received = False
+        rtt = None if self.rtt is None else round(self.rtt * 1000, 1)
+        self.send(json.dumps({'seq': self.ping_seq, 'rtt': rtt}).encode('utf-8'), message_id=msgs.MSG_ID_PING)
+        timeout = PONG_TIMEOUT_SECONDS if self.rtt is None else max(PONG_TIMEOUT_SECONDS, 4 * self.rtt)
+        self.heartbeat_timer = self.loop.call_later(timeout, self.on_pong_timeout)
+
+    def on_pong(self, pong):
+        if self.ping_sent is None or pong.get('seq') != self.ping_seq:
+            return  # late answer to a ping already given up on
+        sample = eventloop.now() - self.ping_sent
+        self.ping_sent = None
+        # smoothed as TCP does, RFC 6298
+        if self.rtt is None:
+            self.rtt = sample
+            self.rtt_variance = sample / 2
+        else:
+            self.rtt_variance = 0.75 * self.rtt_variance + 0.25 * abs(self.rtt - sample)
+            self.rtt = 0.875 * self.rtt + 0.125 * sample
+        self.log.debug('link', "round trip %.1f ms, smoothed %.1f ms", sample * 1000, self.rtt * 1000)
+        self.missed_pongs = 0
+        self.heartbeat_interval = min(HEARTBEAT_MAX_SECONDS, self.heartbeat_interval * 2)
+        self.schedule_ping(self.heartbeat_interval)
+
+    def on_pong_timeout(self):
+        self.heartbeat_timer = None
+        if self.received:
+            # the pong may be queued behind a large frame, bytes arriving prove the link alive
+            self.ping_sent = None
+            self.schedule_ping(PONG_TIMEOUT_SECONDS)
+            return
+        self.missed_pongs += 1
+        if self.missed_pongs >= MISSED_PONGS:
+            self.log.notice('link', "missed %d pongs, disconnecting", self.missed_pongs)
+            self.dump_trace('missed pongs')
+            self.soft_close()
+        else:
+            # probe again straight away, and keep pinging often until pongs return
+            self.heartbeat_interval = HEARTBEAT_MIN_SECONDS
+            self.ping()
+
+    def on_event(self, method, data):
+        if not self.events_enabled:
+            return  # disconnected since Kodi's thread queued it
+        current = eventloop.now()
+        self.events.add(method, data, current)
+        # push once the burst settles, but not later than the longest delay after it began
+        if self.events_timer is not None:
+            self.events_timer.cancel()
+        due = min(current + events.DEBOUNCE_SECONDS, self.events.started + events.MAX_DELAY_SECONDS)
+        self.events_timer = self.loop.call_later(max(0.0, due - current), self.push_events)
+
+    def push_events(self):
+        self.events_timer = None
+        pushed = self.events.take()
+        if not pushed or self.conn is None:
+            return
+        self.events_seq += 1
+        self.metrics.count('events', len(pushed))
+        self.send(json.dumps({'seq': self.events_seq, 'events': pushed}).encode('utf-8'),
+                  message_id=msgs.MSG_ID_EVENTS)
+
+    def on_settings_changed(self):
+        """Called from any thread when the settings change, such as Kodi's when they do in its dialog or script.py."""
+        self.loop.call_soon_threadsafe(self.reload_settings)
+
+    def reload_settings(self):
+        snapshot = self.read_settings()
+        changed = snapshot.changed(self.settings)
+        self.settings = snapshot
+        # log levels apply straight away, without reconnecting
+        self.log.configure(snapshot)
+        if snapshot.getSetting('dump-trace') == 'true':
+            # clearing it reports another change, which finds nothing to do
+            self.write_setting('dump-trace', 'false')
+            snapshot.values['dump-trace'] = 'false'
+            self.log.dump("requested")
+        if changed & set(['capture', 'capture-size']):
+            self.start_capture()
+        requested = snapshot.getSetting('reconnect') == 'true'
+        if requested:
+            self.write_setting('reconnect', 'false')
+            snapshot.values['reconnect'] = 'false'
+        if requested or changed - settings.LIVE:
+            self.log.notice('link', "reconnecting for settings change")
+            if snapshot.getSetting('hide-connection') == 'false':
+                self.notify(983034)  # "Reconnecting..."
+            self.soft_close()  # does nothing if disconnected already
+            self.cancel_retry()
+            if 'ssl-validation' in changed:
+                # a session resumed would skip validating the server again
+                self.tls_session = None
+            self.start_cache()
+            self.start_inbound()
+            self.start_pool()
+            self.start_profiler()
+            # the capabilities announced follow them
+            self.start_indexes()
+            self.connect()
+
+    def log_stats(self):
+        self.loop.call_later(STATS_SECONDS, self.log_stats)
+        self.log.debug('metrics', "event loop woke %d times in %d seconds", self.loop.wakeups - self.last_wakeups,
+                       STATS_SECONDS)
+        self.last_wakeups = self.loop.wakeups
+        if not self.log.enabled('metrics', linklog.LOGNOTICE):
+            return
+        if self.cache is not None:
+            self.log.debug('metrics', "response cache %s", self.cache.stats())
+        if self.titles is not None:
+            self.log.debug('metrics', "title index %s", self.titles.stats())
+        if self.library is not None:
+            self.log.debug('metrics', "library snapshot %s", self.library.stats())
+        if self.rtt is not None:
+            self.log.debug('metrics', "round trip %.1f ms (variance %.1f ms)", self.rtt * 1000,
+                           self.rtt_variance * 1000)
+        self.log.notice('metrics', "metrics %s", json.dumps(self.stats(), sort_keys=True, separators=(',', ':')))
+
+    def stats(self):
+        """Returns the metrics summary with the state of the link at this moment."""
+        self.metrics.gauge('outbound', len(self.outbound))
+        self.metrics.gauge('unsent', len(self.finished))
+        summary = self.metrics.summary()
+        if self.rtt is not None:
+            summary['rtt_ms'] = round(self.rtt * 1000, 1)
+        summary['wakeups'] = self.loop.wakeups
+        if self.cache is not None:
+            summary['cache'] = self.cache.stats()
+        return summary
+
+    def log_ready(self):
+        ready = eventloop.now()
+        dns, tcp, tls, reused = self.connect_timings
+        text = "ready in %.0f ms (dns %.0f ms, tcp %.0f ms, tls %.0f ms%s)" % (
+            (ready - self.connect_started) * 1000, dns * 1000, tcp * 1000, tls * 1000,
+            ", session resumed" if reused else "")
+        if self.disconnected_at is not None:
+            text += ", %.1f seconds after disconnecting" % (ready - self.disconnected_at)
+            self.disconnected_at = None
+        self.log.notice('link', text)
+        if self.titles is not None:
+            self.titles.start()
+
+    def on_callback_error(self, err):
+        """Called by the loop when a callback raised, drops the connection so one bad frame cannot end the service."""
+        self.log.error('link', "unexpected error, reconnecting: %s\n%s", err, traceback.format_exc())
+        self.dump_trace('exception')
+        self.soft_close()  # retries after the backoff
+
+    def dump_trace(self, reason):
+        """Writes the recent frames to the log on an error, once per connection."""
+        if not self.trace_dumped:
+            self.trace_dumped = True
+            self.log.dump(reason)
+
+    def cancel_retry(self):
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+            self.retry_timer = None
+
+    def soft_close(self):
+        if self.conn is not None:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except Exception as e:
+                self.log.debug('link', "shutdown failed: %s", e)
+        self.hard_close()
+
+    def hard_close(self):
+        if self.conn is not None:
+            self.log.notice('link', "disconnecting")
+            self.metrics.count('disconnects')
+            if self.disconnected_at is None and self.state != 'connect':
+                self.disconnected_at = eventloop.now()
+            self.loop.remove_reader(self.conn)
+            self.loop.remove_writer(self.conn)
+            self.conn.close()
+            self.conn = None
+            if self.capture is not None:
+                self.record(capture.META, {'event': 'closed'})
+        self.verification = None
+        # drop any partially received frame and unsent output
+        self.view = memoryview(self.header)
+        self.data.release()
+        self.zdict = None
+        self.new_inflater()
+        self.oversized = False
+        self.discarding = 0
+        self.outbound.clear()
+        self.send_blocked = False
+        self.waiting.clear()
+        self.reading_paused = False
+        # requests still running belong to the old connection, their responses are dropped
+        self.epoch += 1
+        self.finished.clear()
+        self.sequence = 0
+        self.next_sequence = 0
+        self.correlation = False
+        self.chunked = False
+        self.streams = False
+        self.gateway = False
+        self.instance = 0
+        self.controls = set([msgs.MSG_ID_VERIFICATION])
+        if self.heartbeat_timer is not None:
+            self.heartbeat_timer.cancel()
+            self.heartbeat_timer = None
+        self.ping_sent = None
+        self.missed_pongs = 0
+        self.events_enabled = False
+        if self.events_timer is not None:
+            self.events_timer.cancel()
+            self.events_timer = None
+        self.events.reset()
+        if self.state != 'disconnected':
+            self.state = 'disconnected'
+            self.cancel_retry()
+            self.retry_delay = self.backoff.next_delay()
+            self.log.notice('link', "reconnecting in %.1f seconds", self.retry_delay)
+            self.retry_timer = self.loop.call_later(self.retry_delay, self.connect)
+
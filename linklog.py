@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import time
+from collections import deque
+
+# Kodi's log levels, as xbmc.log takes them
+LOGDEBUG, LOGINFO, LOGNOTICE, LOGWARNING, LOGERROR = range(5)
+
+CATEGORIES = ('link', 'frames', 'payloads', 'metrics')
+# settings values: quiet, normal, verbose
+THRESHOLDS = (LOGWARNING, LOGNOTICE, LOGDEBUG)
+DEFAULT_SETTINGS = {'link': 1, 'frames': 0, 'payloads': 0, 'metrics': 0}
+RING_FRAMES = 64
+PREVIEW_BYTES = 160
+
+
+class Payload(object):
+    """A message to log, only measured, hashed and cut down to a preview if the line is actually written."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return preview(self.data, PREVIEW_BYTES, digest=True)
+
+
+def preview(data, size=PREVIEW_BYTES, digest=False):
+    text = bytes(data[:size]).decode('utf-8', 'replace')
+    if digest:
+        text = u"%d bytes sha1:%s %s" % (len(data), hashlib.sha1(data).hexdigest()[:12], text)
+    text += u'...' if len(data) > size else u''
+    # Python 2 log lines are byte strings
+    return text if str is not bytes else text.encode('utf-8')
+
+
+class LinkLog(object):
+    """
+    Logging for the link by category, each with its own level from the settings. Messages are formatted only when
+    their category lets them through, so disabled lines cost a comparison. The last frames in either direction are
+    kept in a ring buffer with a short preview, to be written out when something goes wrong or on request.
+
+    Lines go to write(line, level=...), xbmc.log inside Kodi.
+    """
+
+    def __init__(self, write, ring_frames=RING_FRAMES):
+        self.write = write
+        self.thresholds = dict((c, THRESHOLDS[DEFAULT_SETTINGS[c]]) for c in CATEGORIES)
+        self.frames = deque(maxlen=ring_frames)
+
+    def configure(self, addon):
+        for category in CATEGORIES:
+            try:
+                setting = int(addon.getSetting('log-' + category))
+            except ValueError:
+                setting = DEFAULT_SETTINGS[category]
+            self.thresholds[category] = THRESHOLDS[max(0, min(setting, len(THRESHOLDS) - 1))]
+
+    def enabled(self, category, level):
+        return level >= self.thresholds[category]
+
+    def debug(self, category, message, *args):
+        if LOGDEBUG >= self.thresholds[category]:
+            self._write(LOGDEBUG, message, args)
+
+    def notice(self, category, message, *args):
+        if LOGNOTICE >= self.thresholds[category]:
+            self._write(LOGNOTICE, message, args)
+
+    def error(self, category, message, *args):
+        self._write(LOGERROR, message, args)
+
+    def frame(self, direction, kind, size, message=None):
+        """Remembers a frame, message its content when at hand, otherwise size is of the compressed frame."""
+        self.frames.append((time.time(), direction, kind, size, None if message is None else message[:PREVIEW_BYTES]))
+
+    def dump(self, reason):
+        """Writes the remembered frames to the log, oldest first."""
+        self.write("Media Steward last %d frames (%s):" % (len(self.frames), reason), level=LOGNOTICE)
+        for when, direction, kind, size, message in self.frames:
+            self.write("Media Steward   %s.%03d %s %s %d bytes%s" % (
+                time.strftime('%H:%M:%S', time.localtime(when)), int(when * 1000) % 1000, direction, kind, size,
+                '' if message is None else ': ' + preview(message)), level=LOGNOTICE)
+
+    def _write(self, level, message, args):
+        if args:
+            message = message % args
+        # a category switched to verbose is written at notice level, so it shows without Kodi's debug logging
+        self.write("Media Steward " + message, level=max(level, LOGNOTICE))
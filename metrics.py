@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import re
+import threading
+import time
+
+from eventloop import now
+
+# histogram bucket upper bounds in seconds, doubling from 50 microseconds to about 100 seconds
+BUCKETS = [0.00005 * 2 ** i for i in range(22)]
+MAX_METHODS = 64  # methods tracked by name, the rest are counted as 'other'
+STAGES = ('read', 'inflate', 'queue', 'execute', 'cache', 'compress', 'send', 'total')
+
+_METHOD = re.compile(br'"method"\s*:\s*"([A-Za-z0-9_.]{1,64})"')
+
+
+def request_method(request):
+    """Returns the method of a JSON-RPC request without decoding it, 'batch' for a batch."""
+    if request.lstrip()[:1] == b'[':
+        return 'batch'
+    match = _METHOD.search(request)
+    return match.group(1).decode('ascii') if match else 'unknown'
+
+
+class Histogram(object):
+    """Counts of durations in fixed doubling buckets, precise enough for percentiles at a fixed cost."""
+
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, fraction):
+        """Estimate of the duration below which the given fraction falls, interpolated within its bucket."""
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[bucket - 1] if bucket else 0.0
+                upper = min(BUCKETS[bucket], self.maximum) if bucket < len(BUCKETS) else self.maximum
+                return lower + (upper - lower) * max(0.0, rank - seen) / count
+            seen += count
+        return self.maximum
+
+
+class Metrics(object):
+    """
+    Request timings by method and stage, byte and event counters, and gauges. Recorded from the service loop and the
+    worker threads, so every access holds the lock.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._histograms = {}  # (method, stage) -> Histogram
+        self._methods = set()
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, stage, seconds):
+        with self._lock:
+            if method not in self._methods:
+                if len(self._methods) >= MAX_METHODS:
+                    method = 'other'
+                self._methods.add(method)
+            histogram = self._histograms.get((method, stage))
+            if histogram is None:
+                histogram = self._histograms[(method, stage)] = Histogram()
+            histogram.add(seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        """Records the current value of name and keeps the highest seen."""
+        with self._lock:
+            self._gauges[name] = value
+            self._gauges[name + '_peak'] = max(self._gauges.get(name + '_peak', 0), value)
+
+    def summary(self):
+        """Returns everything recorded as a compact JSON-ready dict, durations in milliseconds."""
+        with self._lock:
+            counters = dict(self._counters)
+            methods = {}
+            for (method, stage), histogram in self._histograms.items():
+                methods.setdefault(method, {})[stage] = [
+                    histogram.count, round(histogram.percentile(0.5) * 1000, 2),
+                    round(histogram.percentile(0.99) * 1000, 2), round(histogram.maximum * 1000, 2)]
+            gauges = dict(self._gauges)
+        summary = {'uptime': int(time.time() - self.started), 'counters': counters, 'gauges': gauges,
+                   'methods': methods, 'format': {'stage': ['count', 'p50', 'p99', 'max']}}
+        for direction, wire, plain in (('in', 'bytes_in', 'bytes_in_inflated'),
+                                       ('out', 'bytes_out', 'bytes_out_uncompressed')):
+            if counters.get(wire):
+                summary['compression_' + direction] = round(float(counters.get(plain, 0)) / counters[wire], 2)
+        return summary
+
+
+class Stopwatch(object):
+    """Time spent inside a packet generator, reported once it is exhausted."""
+
+    def __init__(self, packets, done):
+        self._packets = packets
+        self._done = done  # called with the seconds spent
+        self._seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        begin = now()
+        try:
+            packet = next(self._packets)
+        except StopIteration:
+            self._seconds += now() - begin
+            self._done(self._seconds)
+            raise
+        self._seconds += now() - begin
+        return packet
+
+    next = __next__
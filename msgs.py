@@ -5,3 +5,80 @@ MAX_MESSAGE_SIZE = 2100000000
 
 MSG_ID_ANNOUNCE = -2122149101
 MSG_ID_VERIFICATION = -1969212102
+# title lookup, in both directions. The server sends {"id", "query", "types", "limit", "fuzzy"} and the link answers
+# {"id", "ready", "results": [{"type", "id", "label", "score"}]} from its local index of library titles.
+MSG_ID_SEARCH = -1784322103
+# heartbeat, in either direction. A ping carries {"seq"} and, from the link, its smoothed round trip in "rtt"
+# (milliseconds, null until measured). It is answered with a pong echoing the ping.
+MSG_ID_PING = -1652431104
+MSG_ID_PONG = -1521540105
+# performance metrics, the server sends {"id"} and the link answers {"id", "metrics"} with request timings by method
+# and stage, byte counters and queue depths
+MSG_ID_METRICS = -1390649106
+# Kodi notifications, from the link: {"seq", "events": [{"key", "method", "data"}]}. Notifications are coalesced by
+# key over a short burst, one per library item for item updates and one per namespace otherwise. data holds only the
+# members that changed since the last event of the same key on this connection, null for removed ones, and is merged
+# into it. A key's first event, or data that is not an object, is whole.
+MSG_ID_EVENTS = -1259758107
+# One packet of an interleaved response, from the link: '>l' stream id, the correlation id of the request, then a
+# '>l' size and that many bytes of the response's zlib stream. A size of zero ends the stream. Packets of different
+# streams and whole frames of any kind may come between those of one stream.
+MSG_ID_STREAM = -1128867108
+# library changes, the server sends {"id", "snapshot", "version", "types", "after", "limit"} and the link answers
+# {"id", "ready", "snapshot", "version", "full", "more", "types": {type: {"added", "changed", "removed"}}} from its
+# versioned snapshot of the library: [id, hash] of the items added and changed since version, ids of those removed.
+# A version of another snapshot, or too old to answer, is answered with every item as added and "full" set, the
+# types listed are then complete, otherwise only types with changes are listed. At most "limit" items are listed,
+# ordered by type and id. With "more" set the answer holds "after" as well, the server asks again with it for the
+# rest and keeps the version of the first answer.
+MSG_ID_LIBRARY = -997976109
+
+# for logging
+CONTROL_NAMES = {
+    MSG_ID_ANNOUNCE: 'announce',
+    MSG_ID_VERIFICATION: 'verification',
+    MSG_ID_SEARCH: 'search',
+    MSG_ID_PING: 'ping',
+    MSG_ID_PONG: 'pong',
+    MSG_ID_METRICS: 'metrics',
+    MSG_ID_EVENTS: 'events',
+    MSG_ID_STREAM: 'stream',
+    MSG_ID_LIBRARY: 'library',
+}
+
+# Optional protocol features, offered in the announce and enabled by the server listing them under 'capabilities'
+# in its verification response.
+#
+# correlation: request and response frames carry a '>l' correlation id right after the number of packets, so
+# responses may be sent in any order
+# chunked: a frame may give PACKETS_CHUNKED as its number of packets and end with a zero size packet instead, so it
+# can be compressed and sent while the packet count is still unknown
+# search: the link answers MSG_ID_SEARCH control messages
+# heartbeat: both ends answer MSG_ID_PING with MSG_ID_PONG, the link pings when the connection is quiet
+# metrics: the link answers MSG_ID_METRICS control messages
+# events: the link pushes MSG_ID_EVENTS messages
+# streams: with correlation, responses larger than one packet are sent as MSG_ID_STREAM packets, so control messages
+# and small responses go out between the packets of a large one instead of waiting for all of it
+# dictionary: the announce lists the versions of the preset zlib dictionaries the link has under 'dictionaries' and
+# the verification picks one as 'dictionary'. Frames after the verification may be compressed with it, in either
+# direction, zlib flags those streams so both ends inflate with the dictionary whether a frame used it or not.
+# gateway: offered by gateway.py only. The announce lists the UUIDs of all the Kodi instances it serves under
+# 'instances', its 'uuid' being the first. With correlation, request frames carry a '>l' instance number right after
+# the correlation id, the index in that list of the Kodi to run the request on. Responses are matched by correlation
+# id as before. Without the capability every request runs on the first instance.
+# library: the link answers MSG_ID_LIBRARY control messages
+CAPABILITY_CORRELATION = 'correlation'
+CAPABILITY_CHUNKED = 'chunked'
+CAPABILITY_SEARCH = 'search'
+CAPABILITY_HEARTBEAT = 'heartbeat'
+CAPABILITY_METRICS = 'metrics'
+CAPABILITY_DICTIONARY = 'dictionary'
+CAPABILITY_EVENTS = 'events'
+CAPABILITY_STREAMS = 'streams'
+CAPABILITY_GATEWAY = 'gateway'
+CAPABILITY_LIBRARY = 'library'
+CAPABILITIES = [CAPABILITY_CORRELATION, CAPABILITY_CHUNKED, CAPABILITY_SEARCH, CAPABILITY_HEARTBEAT,
+                CAPABILITY_METRICS, CAPABILITY_DICTIONARY, CAPABILITY_EVENTS, CAPABILITY_STREAMS,
+                CAPABILITY_LIBRARY]
+
+PACKETS_CHUNKED = 0
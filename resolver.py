@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import threading
+
+from eventloop import now
+
+DEFAULT_TTL_SECONDS = 300.0
+# documentation addresses, RFC 5737 and RFC 3849, a route to them is a route off this machine
+PROBE_ADDRESSES = ((socket.AF_INET, ('192.0.2.1', 9)), (socket.AF_INET6, ('2001:db8::1', 9)))
+
+
+class AddressCache(object):
+    """
+    Resolved addresses of the server, kept for a fixed time since getaddrinfo does not report the record TTL. The
+    address that last connected is tried first. When a lookup fails, expired addresses are used rather than none.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS):
+        self.ttl = ttl
+        self.lookups = 0
+        self._entries = {}  # (host, port) -> (expiry, [(family, socktype, proto, sockaddr)])
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is not None and entry[0] > now():
+            return list(entry[1])
+        try:
+            self.lookups += 1
+            infos = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+        except socket.gaierror:
+            if entry is None:
+                raise
+            return list(entry[1])
+        addresses = []
+        for family, socktype, proto, _, sockaddr in infos:
+            if (family, socktype, proto, sockaddr) not in addresses:
+                addresses.append((family, socktype, proto, sockaddr))
+        with self._lock:
+            self._entries[(host, port)] = (now() + self.ttl, addresses)
+        return list(addresses)
+
+    def connected(self, host, port, address):
+        """Moves an address that worked to the front, so the next connect tries it first."""
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and address in entry[1]:
+                addresses = [address] + [a for a in entry[1] if a != address]
+                self._entries[(host, port)] = (entry[0], addresses)
+
+    def forget(self, host, port):
+        """Drops the addresses of a host that none of them reached, the next connect looks it up again."""
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+def connect(addresses, timeout):
+    """
+    Connects to the first address that answers, each tried for at most timeout seconds. Returns the socket and the
+    address, or raises the error of the last address tried.
+    """
+    error = socket.error("no addresses to connect to")
+    for address in addresses:
+        family, socktype, proto, sockaddr = address
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(sockaddr)
+        except socket.error as err:
+            sock.close()
+            error = err
+            continue
+        return sock, address
+    raise error
+
+
+def network_ready(host):
+    """
+    Whether there is a route towards host, found by pointing a UDP socket at it, which sends nothing. A host name is
+    not looked up, as that would block while the network is down, a route to the documentation addresses stands in.
+    """
+    try:
+        infos = socket.getaddrinfo(host, 9, socket.AF_UNSPEC, socket.SOCK_DGRAM, 0, socket.AI_NUMERICHOST)
+        probes = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+    except socket.gaierror:
+        probes = PROBE_ADDRESSES
+    for family, sockaddr in probes:
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        except socket.error:
+            continue  # no support for the address family
+        try:
+            sock.connect(sockaddr)
+            return True
+        except socket.error:
+            continue
+        finally:
+            sock.close()
+    return False
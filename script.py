@@ -17,82 +17,89 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import requests
+import time
 from string import Template
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import xbmc
 import xbmcgui
 import xbmcaddon
 
+import activation
+
 CANCEL_CHECK_LOOP_PERIOD = 0.2
-CODE_CHECK_LOOP_ITERATIONS = 25
-BASE_URL = "https://mediasteward.net"
 
 toaster = xbmcgui.Dialog()
 addon = xbmcaddon.Addon()
+client = activation.Client()
+
 
+def report(err, notice=toaster.ok):
+    notice("Media Steward", Template(addon.getLocalizedString(err.reason)).safe_substitute(**err.values))
+    xbmc.log(str(err.detail), level=xbmc.LOGNOTICE)
 
-def json_request(url, notice=toaster.ok):
+
+def json_request(path, notice=toaster.ok):
     try:
-        r = requests.get(url)
-    except Exception as e:
-        notice("Media Steward", addon.getLocalizedString(983010))  # "Unable to connect to Media Steward"
-        xbmc.log(e, level=xbmc.LOGNOTICE)
+        return client.get_json(path)[1]
+    except activation.RequestFailed as err:
+        report(err, notice)
         return None
-    else:
-        if r.status_code == 200 and r.headers['content-type'] == 'application/json':
-            try:
-                j = r.json()
-            except Exception as e:
-                notice("Media Steward", addon.getLocalizedString(983011))  # "Invalid response from Media Steward"
-                xbmc.log(e, level=xbmc.LOGNOTICE)
-                return None
-            else:
-                return j
-        else:
-            # "Server returned ${<status>} error"
-            notice("Media Steward", Template(addon.getLocalizedString(983012)).safe_substitute(status=r.status_code))
-            xbmc.log(str(r.headers), level=xbmc.LOGNOTICE)
-            return None
 
 
 def register_new():
     restart = False
-    j = json_request(BASE_URL + "/register/new")
+    j = json_request("/register/new")
     if j is not None:
         monitor = xbmc.Monitor()
-        count = 0
         code = j['code']
         uuid = j['uuid']
         expiration_seconds = j['expiration_seconds']
         dialog = xbmcgui.DialogProgress()
         dialog.create(addon.getLocalizedString(983013),  # "Activating Media Steward..."
                       addon.getLocalizedString(983014),  # "Please enter your activation code at the activation site."
-                      Template(addon.getLocalizedString(983015)).safe_substitute(site=BASE_URL+"/activate"),
+                      Template(addon.getLocalizedString(983015)).safe_substitute(site=client.base_url + "/activate"),
                       Template(addon.getLocalizedString(983016)).safe_substitute(code=code))
         dialog.update(100)
+        # the checks run on their own thread, this loop only looks at their results and the dialog
+        check = activation.ActivationCheck(client, code)
+        check.start()
+        seconds_remaining = expiration_seconds
+        checked = time.time()
+        progress = 100
         closed = dialog.iscanceled()
         activated = False
         invalid = False
         status = ''
         while not monitor.abortRequested() and not closed:
-            count += 1
-            if count % CODE_CHECK_LOOP_ITERATIONS == 0:
-                j = json_request(BASE_URL + "/register/check/" + code)
-                if j is not None:
-                    status = j['status']
-                    if status == 'activated':
-                        addon.setSetting('uuid', uuid)
-                        activated = True
-                        restart = True
-                    elif status == 'valid':
-                        seconds_remaining = j['seconds_remaining']
-                        dialog.update(max(int(round(100 * seconds_remaining / expiration_seconds)), 0))
-                    else:
-                        invalid = True
+            # waits for a result instead of sleeping, so one is seen the moment it arrives
+            try:
+                j = check.results.get(timeout=CANCEL_CHECK_LOOP_PERIOD)
+            except queue.Empty:
+                j = None
+            if isinstance(j, activation.RequestFailed):
+                report(j)
+            elif j is not None:
+                status = j['status']
+                if status == 'activated':
+                    addon.setSetting('uuid', uuid)
+                    activated = True
+                    restart = True
+                elif status == 'valid':
+                    seconds_remaining = j['seconds_remaining']
+                    checked = time.time()
+                else:
+                    invalid = True
+            # counts down between checks, the server may hold them until the status changes
+            remaining = max(int(round(100 * (seconds_remaining - (time.time() - checked)) / expiration_seconds)), 0)
+            if remaining != progress:
+                progress = remaining
+                dialog.update(progress)
             closed = dialog.iscanceled() or activated or invalid
-            if not closed:
-                monitor.waitForAbort(CANCEL_CHECK_LOOP_PERIOD)
+        check.stop()
         dialog.close()
         if invalid:
             if status == 'invalid':
@@ -103,7 +110,11 @@ def register_new():
 
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == 'dumptrace':
+        # the running service is told of the change and picks it up straight away
+        addon.setSetting('dump-trace', 'true')
+        restart_now = False
+    elif len(sys.argv) > 1:
         choice = toaster.select(addon.getLocalizedString(983019),  # "Set UUID for Media Steward"
                                 [addon.getLocalizedString(983020),  # "Retrieve new activation code"
                                  addon.getLocalizedString(983021)])  # "Manually enter UUID"
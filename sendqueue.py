@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+import frames
+
+# priority classes, highest first
+PRIORITY_CONTROL = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BULK = 2
+
+
+def priority(message_id, method=None, reorder=True):
+    """
+    Returns the class of an outgoing message: control messages first, then interactive calls such as Player and
+    Input, then library listings. Without reorder responses are matched by their order and all share one class.
+    """
+    if message_id < 0:
+        return PRIORITY_CONTROL
+    if reorder and method is not None and method.partition('.')[0] in frames.BULK_NAMESPACES:
+        return PRIORITY_BULK
+    return PRIORITY_INTERACTIVE
+
+
+class Message(object):
+    __slots__ = ('parts', 'priority', 'interleaved')
+
+    def __init__(self, parts, priority, interleaved):
+        self.parts = deque(parts)
+        self.priority = priority
+        self.interleaved = interleaved
+
+
+class SendQueue(object):
+    """
+    Outgoing messages of the link by priority class. Each is a deque of parts written in order: bytes, producers
+    yielding further parts (None while they wait for data), and callables run once everything before them is written.
+
+    A message is written whole once its first byte is out, unless it is interleaved: its parts are then complete
+    frames, stream packets, and messages of a higher class go out between them. Within a class messages are written
+    in the order they were queued, finishing each one sooner than taking turns would. Used on the link's thread
+    only.
+    """
+
+    def __init__(self):
+        self._classes = (deque(), deque(), deque())
+        self._waiting = []  # interleaved messages set aside while their producer waits
+        self._current = None  # the message whose head part goes next
+        self._locked = False  # the current message must be written on before any other
+        self._started = False  # bytes of the current message's frame have been written
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, parts, priority=PRIORITY_INTERACTIVE, interleaved=False):
+        self._classes[priority].append(Message(parts, priority, interleaved))
+        self._count += 1
+
+    def next(self):
+        """Returns the message to write the head part of, None when there is none that can go now."""
+        current = self._current
+        if current is not None:
+            if not current.parts:
+                self._count -= 1
+                self._locked = False
+                self._started = False
+            elif self._locked:
+                return current
+            else:
+                # between parts, a higher class may go first
+                self._classes[current.priority].appendleft(current)
+            self._current = None
+        for messages in self._classes:
+            if messages:
+                self._current = messages.popleft()
+                return self._current
+        return None
+
+    def wrote(self, complete):
+        """Records that bytes of the current message's head part went out, all of it when complete."""
+        self._locked = not (complete and self._current.interleaved)
+        self._started = self._locked
+
+    def starting(self):
+        """Returns whether the current message's head part begins a frame, for the capture."""
+        return not self._started
+
+    def hold(self):
+        """Keeps the current message next, a write of its head part must be retried as it was."""
+        self._locked = True
+
+    def wait(self):
+        """Sets the current message aside while its producer waits, returns False when it has to be waited for."""
+        if self._locked or not self._current.interleaved:
+            return False
+        self._waiting.append(self._current)
+        self._current = None
+        return True
+
+    def resume(self):
+        """Returns the messages set aside to their classes, their producers may have data again."""
+        for message in self._waiting:
+            self._classes[message.priority].append(message)
+        del self._waiting[:]
+
+    def clear(self):
+        for messages in self._classes:
+            messages.clear()
+        del self._waiting[:]
+        self._current = None
+        self._locked = False
+        self._started = False
+        self._count = 0
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import xml.etree.ElementTree as ElementTree
+
+# settings the link applies as they change, any other change reconnects it
+LIVE = frozenset(['hide-connection', 'log-link', 'log-frames', 'log-payloads', 'log-metrics', 'dump-trace',
+                  'reconnect', 'capture', 'capture-size'])
+# set by script.py and the settings actions, never shown
+HIDDEN = ('reconnect', 'dump-trace')
+
+
+def setting_defaults(directory):
+    """Returns (id, default) of each setting in the addon at directory, from its resources/settings.xml."""
+    path = os.path.join(directory, 'resources', 'settings.xml')
+    return [(setting.get('id'), setting.get('default', '')) for setting in ElementTree.parse(path).iter('setting')
+            if setting.get('id')]
+
+
+def setting_ids(addon):
+    """Returns the ids of the addon's settings."""
+    ids = [i for i, _ in setting_defaults(addon.getAddonInfo('path'))]
+    return ids + [i for i in HIDDEN if i not in ids]
+
+
+class Snapshot(object):
+    """
+    The addon's settings read once. Every getSetting of Kodi's Addon object calls into Kodi, a snapshot is taken
+    when Kodi reports a change instead and read freely in between. It stands in for the Addon where settings are read.
+    """
+
+    def __init__(self, addon, ids):
+        self.ids = ids
+        self.values = dict((i, addon.getSetting(i)) for i in ids)
+
+    def getSetting(self, id):
+        return self.values.get(id, '')
+
+    def changed(self, other):
+        """Returns the ids whose values differ from those of the snapshot other."""
+        return set(i for i in self.ids if self.values.get(i) != other.values.get(i))
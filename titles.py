@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import re
+import threading
+import unicodedata
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+PAGE_SIZE = 5000
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+PREFIX_TOKENS = 50  # vocabulary words tried for a partial query word
+
+# media type: (list method, result key, id field, details method, details key)
+MEDIA_TYPES = {
+    'movie': ('VideoLibrary.GetMovies', 'movies', 'movieid', 'VideoLibrary.GetMovieDetails', 'moviedetails'),
+    'tvshow': ('VideoLibrary.GetTVShows', 'tvshows', 'tvshowid', 'VideoLibrary.GetTVShowDetails', 'tvshowdetails'),
+    'musicvideo': ('VideoLibrary.GetMusicVideos', 'musicvideos', 'musicvideoid', 'VideoLibrary.GetMusicVideoDetails',
+                   'musicvideodetails'),
+    'artist': ('AudioLibrary.GetArtists', 'artists', 'artistid', 'AudioLibrary.GetArtistDetails', 'artistdetails'),
+    'album': ('AudioLibrary.GetAlbums', 'albums', 'albumid', 'AudioLibrary.GetAlbumDetails', 'albumdetails'),
+    'song': ('AudioLibrary.GetSongs', 'songs', 'songid', 'AudioLibrary.GetSongDetails', 'songdetails'),
+}
+LIBRARY_TYPES = {
+    'VideoLibrary': ('movie', 'tvshow', 'musicvideo'),
+    'AudioLibrary': ('artist', 'album', 'song'),
+}
+STOP_WORDS = frozenset([u'a', u'an', u'and', u'of', u'the'])
+
+_PUNCTUATION = re.compile(r'[^\w\s]', re.UNICODE)
+_SPACE = re.compile(r'\s+', re.UNICODE)
+
+
+def normalize(text):
+    """Lower case, accents and punctuation removed, single spaces."""
+    if not isinstance(text, type(u'')):
+        text = text.decode('utf-8', 'replace')
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = u''.join(c for c in text if not unicodedata.combining(c))
+    return _SPACE.sub(u' ', _PUNCTUATION.sub(u' ', text)).strip()
+
+
+def tokenize(normalized):
+    words = normalized.split()
+    tokens = [w for w in words if w not in STOP_WORDS]
+    # a title made only of stop words still has to be findable
+    return tokens or words
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 as soon as it is certain to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class TitleIndex(object):
+    """
+    Compact in-memory index of library titles for answering "play X" lookups on the box. Items are loaded once in
+    pages, then kept current from Kodi's library notifications on a background thread. Searches match whole titles
+    by prefix, words exactly or by prefix, and misheard words within a small edit distance.
+    """
+
+    def __init__(self, execute):
+        self.ready = False
+        self.errors = 0
+        self._execute = execute  # (method, params) -> JSON-RPC result
+        self._lock = threading.Lock()
+        self._items = {}  # (type, id) -> (label, normalized title, tokens)
+        self._tokens = {}  # token -> set of (type, id)
+        self._titles = []  # sorted (normalized title, type, id), for title prefix search
+        self._vocabulary = []  # sorted tokens, for word prefix search
+        self._tasks = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Loads the library and starts following its changes, only the first call does anything."""
+        if self._thread is not None:
+            return
+        for media_type in MEDIA_TYPES:
+            self._tasks.put(('reload', media_type, None))
+        self._tasks.put(('ready', None, None))
+        self._thread = threading.Thread(target=self._run, name="Media Steward title index")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._tasks.put(None)
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def on_notification(self, method, data):
+        """Queues the index changes a Kodi notification implies, data is its decoded payload."""
+        library, _, event = method.partition('.')
+        if library not in LIBRARY_TYPES:
+            return
+        if event in ('OnScanFinished', 'OnCleanFinished'):
+            for media_type in LIBRARY_TYPES[library]:
+                self._tasks.put(('reload', media_type, None))
+        elif event in ('OnUpdate', 'OnRemove') and isinstance(data, dict):
+            # VideoLibrary nests the item, AudioLibrary does not
+            item = data.get('item', data)
+            if isinstance(item, dict) and item.get('type') in MEDIA_TYPES and 'id' in item:
+                self._tasks.put(('update' if event == 'OnUpdate' else 'remove', item['type'], item['id']))
+
+    def search(self, query, types=None, limit=DEFAULT_LIMIT, fuzzy=True):
+        """Returns up to limit [type, id, label, score] matches for query, best first."""
+        normalized = normalize(query)
+        words = tokenize(normalized)
+        if not words:
+            return []
+        types = set(types) if types else None
+        scores = {}
+        with self._lock:
+            # whole title starting with the query
+            position = bisect.bisect_left(self._titles, (normalized,))
+            while position < len(self._titles) and self._titles[position][0].startswith(normalized):
+                title, media_type, item_id = self._titles[position]
+                scores[(media_type, item_id)] = 100 if title == normalized else 50
+                position += 1
+            for word in words:
+                for key, points in self._word_matches(word, fuzzy):
+                    scores[key] = scores.get(key, 0) + points
+            matches = [[key[0], key[1], self._items[key][0], points] for key, points in scores.items()
+                       if types is None or key[0] in types]
+        matches.sort(key=lambda m: (-m[3], len(m[2])))
+        return matches[:max(1, min(limit, MAX_LIMIT))]
+
+    def stats(self):
+        with self._lock:
+            return {'items': len(self._items), 'tokens': len(self._tokens), 'ready': self.ready, 'errors': self.errors}
+
+    def _word_matches(self, word, fuzzy):
+        if word in self._tokens:
+            return [(key, 10) for key in self._tokens[word]]
+        found = []
+        start = bisect.bisect_left(self._vocabulary, word)
+        for token in self._vocabulary[start:start + PREFIX_TOKENS]:
+            if not token.startswith(word):
+                break
+            found.extend((key, 6) for key in self._tokens[token])
+        if found or not fuzzy:
+            return found
+        limit = 1 if len(word) < 6 else 2
+        for token in self._vocabulary:
+            distance = edit_distance(word, token, limit)
+            if distance <= limit:
+                found.extend((key, 5 - 2 * distance) for key in self._tokens[token])
+        return found
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            action, media_type, item_id = task
+            try:
+                if action == 'reload':
+                    self._reload(media_type)
+                elif action == 'update':
+                    self._update(media_type, item_id)
+                elif action == 'remove':
+                    with self._lock:
+                        self._remove((media_type, item_id))
+                elif action == 'ready':
+                    self.ready = True
+            except Exception:
+                # the library may be busy scanning, the next scan finished notification reloads it
+                self.errors += 1
+
+    def _reload(self, media_type):
+        method, result_key, id_field = MEDIA_TYPES[media_type][:3]
+        items = []
+        start = 0
+        while True:
+            result = self._execute(method, {'limits': {'start': start, 'end': start + PAGE_SIZE}})
+            page = result.get(result_key, [])
+            items.extend((item[id_field], item['label']) for item in page)
+            start += PAGE_SIZE
+            if len(page) < PAGE_SIZE or start >= result.get('limits', {}).get('total', 0):
+                break
+        with self._lock:
+            # drop the old items of this type in bulk, one by one removal from the sorted lists would be quadratic
+            self._items = dict((k, v) for k, v in self._items.items() if k[0] != media_type)
+            self._titles = [t for t in self._titles if t[1] != media_type]
+            for token in list(self._tokens):
+                keys = set(k for k in self._tokens[token] if k[0] != media_type)
+                if keys:
+                    self._tokens[token] = keys
+                else:
+                    del self._tokens[token]
+            for item_id, label in items:
+                self._add((media_type, item_id), label, sort=False)
+            self._titles.sort()
+            self._vocabulary = sorted(self._tokens)
+
+    def _update(self, media_type, item_id):
+        details_method, details_key = MEDIA_TYPES[media_type][3:]
+        id_field = MEDIA_TYPES[media_type][2]
+        result = self._execute(details_method, {id_field: item_id})
+        label = result.get(details_key, {}).get('label')
+        if label is not None:
+            with self._lock:
+                self._remove((media_type, item_id))
+                self._add((media_type, item_id), label)
+
+    def _add(self, key, label, sort=True):
+        normalized = normalize(label)
+        tokens = tokenize(normalized)
+        self._items[key] = (label, normalized, tokens)
+        entry = (normalized,) + key
+        if sort:
+            bisect.insort(self._titles, entry)
+        else:
+            self._titles.append(entry)
+        for token in tokens:
+            if token not in self._tokens:
+                self._tokens[token] = set()
+                if sort:
+                    bisect.insort(self._vocabulary, token)
+            self._tokens[token].add(key)
+
+    def _remove(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        entry = (item[1],) + key
+        position = bisect.bisect_left(self._titles, entry)
+        if position < len(self._titles) and self._titles[position] == entry:
+            del self._titles[position]
+        for token in item[2]:
+            keys = self._tokens.get(token)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._tokens[token]
+                position = bisect.bisect_left(self._vocabulary, token)
+                if position < len(self._vocabulary) and self._vocabulary[position] == token:
+                    del self._vocabulary[position]
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the activation dialog of script.py against a FakeActivation site: how long after a code is activated
+the dialog notices, the requests and connections that took, and how long cancelling takes while the site hangs.
+
+    python tools/bench_activation.py [--trials 3] [--activate-after 3]
+
+Modes: per-call checks every activation.CHECK_SECONDS with a bare requests.get each, as script.py made them before,
+then register_new with the pooled client against a site answering at once, and against one holding checks until
+the status changes. Each trial activates the code at a random point of the check interval after --activate-after
+seconds.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(TOOLS, os.pardir)
+STUBS = os.path.join(TOOLS, 'kodistub')
+os.environ.setdefault('MEDIASTEWARD_STUB_LOG_LEVEL', '4')  # dialogs would fill the output
+sys.path[:0] = [STUBS, ROOT]
+
+import requests  # noqa: E402
+
+import activation  # noqa: E402
+import script  # noqa: E402
+import xbmcgui  # noqa: E402
+from fakeactivation import FakeActivation  # noqa: E402
+
+now = getattr(time, 'monotonic', time.time)
+
+# the dialog blocked on a hung check for good, it is given up on after this long
+BLOCKED_SECONDS = 10.0
+
+
+def percentile(ordered, fraction):
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def per_call_activation(site):
+    """The dialog as it was: a check with a new connection every CHECK_SECONDS, without timeouts, on its loop."""
+    code = requests.get(site.url + '/register/new').json()['code']
+    dialog = xbmcgui.DialogProgress()
+    dialog.create("Media Steward")
+    iterations = int(round(activation.CHECK_SECONDS / script.CANCEL_CHECK_LOOP_PERIOD))
+    count = 0
+    while not dialog.iscanceled():
+        count += 1
+        if count % iterations == 0:
+            try:
+                status = requests.get(site.url + '/register/check/' + code).json()['status']
+            except requests.RequestException:
+                return False  # the site closed under a hung check
+            if status != 'valid':
+                return True
+        time.sleep(script.CANCEL_CHECK_LOOP_PERIOD)
+    return False
+
+
+def pooled_activation(site):
+    script.client = activation.Client(site.url)
+    try:
+        return script.register_new()
+    finally:
+        script.client.close()
+
+
+def activate_later(site, delay, activated):
+    time.sleep(delay)
+    for code in list(site.codes):
+        site.activate(code)
+    activated.append(now())
+
+
+def measure(args, mode):
+    register = per_call_activation if mode == 'per-call' else pooled_activation
+    delays = []
+    requests_made = []
+    connections = []
+    for _ in range(args.trials):
+        site = FakeActivation(long_poll=mode == 'long-poll')
+        activated = []
+        delay = args.activate_after + random.uniform(0, activation.CHECK_SECONDS)
+        activator = threading.Thread(target=activate_later, args=(site, delay, activated))
+        activator.start()
+        if not register(site):
+            raise RuntimeError("%s did not activate" % mode)
+        noticed = now()
+        activator.join()
+        delays.append(noticed - activated[0])
+        requests_made.append(site.counters['requests'])
+        connections.append(site.counters['connections'])
+        site.close()
+    delays.sort()
+    return {
+        'mode': mode,
+        'trials': args.trials,
+        'notice_p50_ms': percentile(delays, 0.5) * 1000,
+        'notice_max_ms': delays[-1] * 1000,
+        'requests': sum(requests_made) / float(args.trials),
+        'connections': sum(connections) / float(args.trials),
+        'cancel_ms': measure_cancel(args, register),
+    }
+
+
+def measure_cancel(args, register):
+    """Milliseconds from cancelling the dialog to it closing while the site never answers checks, None if blocked."""
+    site = FakeActivation(hang=True)
+    finished = []
+    dialog = threading.Thread(target=lambda: finished.append((register(site), now())))
+    dialog.daemon = True
+    dialog.start()
+    time.sleep(activation.CHECK_SECONDS + 1.0)  # a check is under way
+    xbmcgui.cancel_dialogs()
+    canceled = now()
+    dialog.join(BLOCKED_SECONDS)
+    blocked = not finished
+    site.close()
+    return None if blocked else (finished[0][1] - canceled) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='per-call,pooled,long-poll')
+    parser.add_argument('--trials', type=int, default=3)
+    parser.add_argument('--activate-after', type=float, default=3.0, help="seconds before the code is activated")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per mode")
+    args = parser.parse_args()
+
+    if not args.json:
+        print("%10s %13s %13s %9s %12s %10s" % ("mode", "notice p50 ms", "notice max ms", "requests", "connections",
+                                                 "cancel ms"))
+    for mode in args.modes.split(','):
+        result = measure(args, mode)
+        if args.json:
+            print(json.dumps(result, sort_keys=True))
+        else:
+            print("%10s %13.1f %13.1f %9.1f %12.1f %10s" % (
+                mode, result['notice_p50_ms'], result['notice_max_ms'], result['requests'], result['connections'],
+                'blocked' if result['cancel_ms'] is None else '%.0f' % result['cancel_ms']))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
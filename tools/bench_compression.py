@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compression ratio and CPU time per message class: default level zlib, as every frame was compressed before, against
+the adaptive levels of frames.compression_level with and without the preset dictionary.
+
+    python tools/bench_compression.py [--repeat 200] [--dictionary 1]
+
+Messages are synthetic but laid out as Kodi writes them, compact JSON with sorted keys. CPU time is per message,
+compressing and inflating, with a fresh compressor for each as the link uses.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import dictionaries  # noqa: E402
+import frames  # noqa: E402
+
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+WORDS = ['the', 'last', 'night', 'river', 'star', 'king', 'shadow', 'house', 'city', 'love', 'war', 'dark', 'blue',
+         'summer', 'road', 'island', 'secret', 'ghost', 'iron', 'heart', 'winter', 'empire', 'lost', 'wild']
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Horror', 'Science Fiction', 'Thriller', 'Animation']
+
+
+def kodi(result, request_id=1):
+    return json.dumps({'id': request_id, 'jsonrpc': '2.0', 'result': result}, sort_keys=True,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def title(rand):
+    return ' '.join(rand.choice(WORDS) for _ in range(rand.randint(1, 4))).title()
+
+
+def movie(rand, movie_id, detailed):
+    label = title(rand)
+    item = {'label': label, 'movieid': movie_id, 'year': rand.randint(1950, 2019),
+            'thumbnail': 'image://smb%%3a%%2f%%2fnas%%2fmovies%%2f%s%%2fposter.jpg/' % label.replace(' ', '%20')}
+    if detailed:
+        item.update({
+            'title': label, 'genre': rand.sample(GENRES, 2), 'rating': round(rand.uniform(3, 9), 6),
+            'runtime': rand.randint(4000, 9000), 'playcount': rand.randint(0, 3),
+            'file': 'smb://nas/movies/%s (%d)/%s.mkv' % (label, item['year'], label),
+            'art': {'fanart': 'image://fanart/%d/' % movie_id, 'poster': 'image://poster/%d/' % movie_id},
+        })
+    return item
+
+
+def episode(rand, episode_id):
+    return {'episodeid': episode_id, 'label': '%dx%02d. %s' % (episode_id // 20 + 1, episode_id % 20 + 1, title(rand)),
+            'season': episode_id // 20 + 1, 'episode': episode_id % 20 + 1, 'showtitle': 'Iron Empire',
+            'tvshowid': 7, 'playcount': rand.randint(0, 1), 'firstaired': '2015-%02d-%02d' % (
+                rand.randint(1, 12), rand.randint(1, 28)),
+            'file': 'nfs://nas/tv/Iron Empire/S%02dE%02d.mkv' % (episode_id // 20 + 1, episode_id % 20 + 1)}
+
+
+def message_classes():
+    rand = random.Random(1)
+    time_value = {'hours': 0, 'milliseconds': 412, 'minutes': 37, 'seconds': 5}
+    total_time = {'hours': 1, 'milliseconds': 0, 'minutes': 52, 'seconds': 41}
+    return [
+        ('pong', json.dumps({'seq': 17, 'rtt': 0.8}).encode('utf-8')),
+        ('input request', json.dumps({'jsonrpc': '2.0', 'method': 'Input.ExecuteAction',
+                                      'params': {'action': 'pause'}, 'id': 42}).encode('utf-8')),
+        ('input response', kodi('OK', 42)),
+        ('active players', kodi([{'playerid': 1, 'playertype': 'internal', 'type': 'video'}])),
+        ('player properties', kodi({'percentage': 33.25, 'position': 0, 'repeat': 'off', 'shuffled': False,
+                                    'speed': 1, 'time': time_value, 'totaltime': total_time})),
+        ('player item', kodi({'item': dict(movie(rand, 12, True), type='movie', id=12)})),
+        ('search', json.dumps({'id': 3, 'ready': True, 'results': [
+            {'type': 'movie', 'id': i, 'label': title(rand), 'score': 10 - i} for i in range(5)]}).encode('utf-8')),
+        ('movies page 25', kodi({'limits': {'end': 25, 'start': 0, 'total': 2000},
+                                 'movies': [movie(rand, i, False) for i in range(25)]})),
+        ('episodes 500', kodi({'limits': {'end': 500, 'start': 0, 'total': 500},
+                               'episodes': [episode(rand, i) for i in range(500)]})),
+        ('movies 2000', kodi({'limits': {'end': 2000, 'start': 0, 'total': 2000},
+                              'movies': [movie(rand, i, True) for i in range(2000)]})),
+    ]
+
+
+def measure(message, level, zdict, repeat):
+    """Returns (compressed bytes, compress seconds, inflate seconds) per message."""
+    begin = cpu_time()
+    for _ in range(repeat):
+        compressed = frames.compress(message, level, zdict)
+    compress_seconds = (cpu_time() - begin) / repeat
+    begin = cpu_time()
+    for _ in range(repeat):
+        inflater = frames.decompressor(zdict)
+        if inflater.decompress(compressed) + inflater.flush() != message:
+            raise AssertionError("round trip failed")
+    inflate_seconds = (cpu_time() - begin) / repeat
+    return len(compressed), compress_seconds, inflate_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200, help="runs per message, fewer are used for big ones")
+    parser.add_argument('--dictionary', type=int, default=max(dictionaries.PRESETS))
+    args = parser.parse_args()
+
+    policies = [('default', lambda message: (zlib.Z_DEFAULT_COMPRESSION, None)),
+                ('adaptive', lambda message: (frames.compression_level(len(message), method(message)), None))]
+    if dictionaries.SUPPORTED:
+        zdict = dictionaries.PRESETS[args.dictionary]
+        policies.append(('adaptive+dict', lambda message: (frames.compression_level(len(message), method(message),
+                                                                                    zdict), zdict)))
+    else:
+        print("preset dictionaries need Python 3.3, not measured")
+
+    print("%-18s %-14s %9s %9s %7s %12s %12s" % ("class", "policy", "bytes", "wire", "ratio", "deflate us",
+                                                  "inflate us"))
+    for name, message in message_classes():
+        repeat = max(1, args.repeat * 1024 // max(len(message), 1024))
+        for policy, choose in policies:
+            level, preset = choose(message)
+            size, compress_seconds, inflate_seconds = measure(message, level, preset, repeat)
+            print("%-18s %-14s %9d %9d %7.2f %12.1f %12.1f" % (name, policy, len(message), size,
+                                                               float(len(message)) / size, compress_seconds * 1e6,
+                                                               inflate_seconds * 1e6))
+
+
+def method(message):
+    # the request a response answers is not in it, listings are told apart by their result keys
+    return 'VideoLibrary.Get' if b'"limits":' in message else None
+
+
+if __name__ == '__main__':
+    main()
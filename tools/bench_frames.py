@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Microbenchmark of the frame receive path: the old concatenating loop against frames.FrameBuffer.
+
+    python tools/bench_frames.py [--sizes 1024,1048576,16777216] [--repeat 5] [--chunk 16384]
+
+Frames are pushed through a local socket pair by a sender thread. Peak memory is measured with tracemalloc where
+available (Python 3), otherwise it is not reported.
+"""
+
+import argparse
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import frames  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def sender(sock, frame, count, chunk):
+    for _ in range(count):
+        for i in range(0, len(frame), chunk):
+            sock.sendall(frame[i:i + chunk])
+
+
+def recv_exact_concat(sock, size, chunk):
+    # the receive loop main.py used before FrameBuffer
+    data = b''
+    while size > 0:
+        data_buffer = sock.recv(min(size, chunk))
+        if not data_buffer:
+            raise RuntimeError("socket closed")
+        size -= len(data_buffer)
+        data = data + data_buffer
+    return data
+
+
+def read_concat(sock, count, chunk):
+    for _ in range(count):
+        recv_exact_concat(sock, 4, chunk)
+        size = struct.unpack('>l', recv_exact_concat(sock, 4, chunk))[0]
+        recv_exact_concat(sock, size, chunk)
+
+
+def read_frame_buffer(sock, count, chunk):
+    header = bytearray(4)
+    header_view = memoryview(header)
+    data = frames.FrameBuffer()
+    for _ in range(count):
+        for _ in range(2):
+            remaining = 4
+            while remaining:
+                remaining -= sock.recv_into(header_view[4 - remaining:])
+        size = struct.unpack_from('>l', header)[0]
+        view = data.reserve(size)
+        while size:
+            received = sock.recv_into(view[len(view) - size:], min(size, chunk))
+            if not received:
+                raise RuntimeError("socket closed")
+            data.advance(received)
+            size -= received
+        view = None
+        data.release()
+
+
+def run(reader, size, count, chunk):
+    # the frame is built before tracing starts so only the receive side is measured
+    frame = struct.pack('>l', 1) + struct.pack('>l', size) + os.urandom(size)
+    a, b = socket.socketpair()
+    thread = threading.Thread(target=sender, args=(a, frame, count, chunk))
+    if tracemalloc is not None:
+        tracemalloc.start()
+    begin = time.time()
+    thread.start()
+    reader(b, count, chunk)
+    elapsed = time.time() - begin
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    thread.join()
+    a.close()
+    b.close()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='1024,65536,1048576,16777216')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunk', type=int, default=16384)
+    args = parser.parse_args()
+
+    print("%-12s %-12s %14s %14s" % ("frame bytes", "reader", "MB/s", "peak KiB"))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for name, reader in (('concat', read_concat), ('framebuffer', read_frame_buffer)):
+            elapsed, peak = run(reader, size, args.repeat, args.chunk)
+            rate = size * args.repeat / elapsed / 1e6 if elapsed > 0 else float('inf')
+            print("%-12d %-12s %14.1f %14s" % (size, name, rate, '-' if peak is None else '%d' % (peak // 1024)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of gateway.py: the gateway runs in a child process for a number of FakeKodi instances and connects to a
+StandInServer, which sends requests to the instances in turn with a bounded number in flight.
+
+    python tools/bench_gateway.py [--instances 1,8,32] [--idle-connections 0,4] [--concurrency 16]
+                                  [--requests 400] [--latency 0.002] [--python python2]
+
+For every number of instances and idle connections per instance it reports requests per second, p50/p99 round trip,
+the HTTP connections the gateway opened to the instances, and the upstream connections it made. Every response is
+checked to come from the instance the request named. With --idle-connections 0 every request opens a connection of
+its own, as without the pool.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(TOOLS, os.pardir)
+sys.path.insert(0, ROOT)
+
+from fakekodi import FakeKodi  # noqa: E402
+from standin import StandInServer  # noqa: E402
+
+now = getattr(time, 'monotonic', time.time)
+
+
+def percentile(ordered, fraction):
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def measure(args, instances, idle):
+    kodis = [FakeKodi("kodi-%d" % i, latency=args.latency) for i in range(instances)]
+    server = StandInServer()
+    directory = tempfile.mkdtemp(prefix='bench_gateway')
+    config = os.path.join(directory, 'gateway.json')
+    with open(config, 'w') as config_file:
+        json.dump({'instances': [{'uuid': '%032x' % (i + 1), 'url': kodi.url} for i, kodi in enumerate(kodis)],
+                   'idle-connections': idle, 'settings': {'ssl-validation': False, 'log-link': 0}}, config_file)
+    child = subprocess.Popen([args.python, os.path.join(ROOT, 'gateway.py'), config, '--data', directory,
+                              '--server', '127.0.0.1:%d' % server.port])
+    rtts = []
+    errors = []
+    misrouted = []
+    try:
+        server.accept(timeout=args.timeout)
+        server.conn.settimeout(args.timeout)
+        window = threading.Semaphore(args.concurrency)
+        sent_at = {}
+
+        def read_responses():
+            try:
+                for _ in range(args.requests):
+                    response = server.read()[2]
+                    number = response['id']
+                    rtts.append(now() - sent_at.pop(number))
+                    if response['result']['name'] != kodis[number % instances].name:
+                        misrouted.append(number)
+                    window.release()
+            except Exception as err:
+                errors.append(err)
+                for _ in range(args.concurrency):
+                    window.release()
+
+        reader = threading.Thread(target=read_responses)
+        reader.start()
+        begin = now()
+        for number in range(args.requests):
+            window.acquire()
+            if errors:
+                break
+            sent_at[number] = now()
+            request = {'jsonrpc': '2.0', 'id': number, 'method': 'Application.GetProperties',
+                       'params': {'properties': ['name', 'version']}}
+            server.request(request, correlation_id=number, instance=number % instances)
+        reader.join()
+        elapsed = now() - begin
+    finally:
+        server.close()
+        child.terminate()
+        child.wait()
+        for kodi in kodis:
+            kodi.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    if errors:
+        raise errors[0]
+    rtts.sort()
+    return {
+        'instances': instances,
+        'idle_connections': idle,
+        'requests': len(rtts),
+        'requests_per_second': len(rtts) / elapsed,
+        'p50_ms': percentile(rtts, 0.5) * 1000,
+        'p99_ms': percentile(rtts, 0.99) * 1000,
+        'kodi_connections': sum(kodi.counters['connections'] for kodi in kodis),
+        'upstream_connections': 1,  # accepted once, a reconnect would have failed the reads
+        'misrouted': len(misrouted),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--instances', default='1,8,32', help="Kodi instances behind the gateway")
+    parser.add_argument('--idle-connections', default='0,4', help="connections the gateway keeps per instance")
+    parser.add_argument('--concurrency', type=int, default=16, help="requests in flight")
+    parser.add_argument('--requests', type=int, default=400, help="requests per measurement")
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds every Kodi request takes")
+    parser.add_argument('--python', default=sys.executable, help="interpreter running the gateway")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--json', action='store_true', help="print one JSON object per measurement")
+    args = parser.parse_args()
+
+    if not args.json:
+        print("%9s %5s %10s %9s %9s %10s %9s %10s" % ("instances", "idle", "req/s", "p50 ms", "p99 ms", "kodi conns",
+                                                      "upstream", "misrouted"))
+    for instances in [int(n) for n in args.instances.split(',')]:
+        for idle in [int(n) for n in args.idle_connections.split(',')]:
+            result = measure(args, instances, idle)
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print("%9d %5d %10.1f %9.2f %9.2f %10d %9d %10d" % (
+                    instances, idle, result['requests_per_second'], result['p50_ms'], result['p99_ms'],
+                    result['kodi_connections'], result['upstream_connections'], result['misrouted']))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Library sync traffic and Kodi database load: full re-listings of every media type, as the server refreshed its view
+of the library before, against the changes answered by library.LibrarySnapshot.
+
+    python tools/bench_library_sync.py [--movies 2000] [--episodes 20000] [--songs 30000] [--changes 0,10,100,1000]
+
+The library is synthetic but laid out as Kodi writes it. After each round of changes, made as Kodi would and
+announced with its notifications, the server's view is refreshed both ways. Bytes are compressed as the link sends
+them, items read count what Kodi loads from its database for the refresh. Re-listings ask for the properties the
+snapshot hashes, fewer than the server needs, so their cost here is a lower bound.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import frames  # noqa: E402
+import library  # noqa: E402
+
+now = getattr(time, 'perf_counter', time.time)
+
+WORDS = ['the', 'last', 'night', 'river', 'star', 'king', 'shadow', 'house', 'city', 'love', 'war', 'dark', 'blue',
+         'summer', 'road', 'island', 'secret', 'ghost', 'iron', 'heart', 'winter', 'empire', 'lost', 'wild']
+GENRES = ['Action', 'Adventure', 'Comedy', 'Drama', 'Horror', 'Science Fiction', 'Thriller', 'Animation']
+NAMESPACES = dict((media_type, namespace) for namespace, types in library.LIBRARY_TYPES.items()
+                  for media_type in types)
+
+
+def title(rand):
+    return ' '.join(rand.choice(WORDS) for _ in range(rand.randint(1, 4))).title()
+
+
+def new_item(rand, media_type, item_id):
+    label = title(rand)
+    item = {'label': label, 'title': label, 'year': rand.randint(1950, 2019), 'genre': rand.sample(GENRES, 2),
+            'rating': round(rand.uniform(3, 9), 6), 'runtime': rand.randint(1200, 9000), 'playcount': 0,
+            'lastplayed': '', 'dateadded': '2018-%02d-%02d 20:15:00' % (rand.randint(1, 12), rand.randint(1, 28)),
+            'resume': {'position': 0, 'total': 0}, 'file': 'smb://nas/%s/%s.mkv' % (media_type, label),
+            'tvshowid': item_id // 20, 'season': item_id % 20 // 10 + 1, 'episode': item_id % 10 + 1,
+            'watchedepisodes': 0, 'artist': [title(rand)], 'album': title(rand), 'albumid': item_id // 12,
+            'track': item_id % 12 + 1, 'duration': rand.randint(120, 400)}
+    return item
+
+
+class FakeLibrary(object):
+    """Kodi's library methods over synthetic items, counting the items each call reads."""
+
+    def __init__(self, counts, seed=1):
+        self.rand = random.Random(seed)
+        self.items = {}  # type -> {id: item}
+        for media_type, count in counts.items():
+            self.items[media_type] = dict((i, new_item(self.rand, media_type, i)) for i in range(1, count + 1))
+        self.read = 0
+
+    def execute(self, method, params):
+        for media_type, (list_method, key, id_field, details_method, details_key, _) in library.MEDIA_TYPES.items():
+            if method == list_method:
+                return self.listing(media_type, key, id_field, params)
+            if method == details_method:
+                item = self.items.get(media_type, {}).get(params[id_field])
+                if item is None:
+                    raise RuntimeError("%s failed: Invalid params." % method)
+                self.read += 1
+                return {details_key: self.shape(item, id_field, params[id_field], params.get('properties', []))}
+        raise RuntimeError("%s failed: Method not found." % method)
+
+    def listing(self, media_type, key, id_field, params):
+        ids = sorted(self.items.get(media_type, {}))
+        limits = params.get('limits', {})
+        start = limits.get('start', 0)
+        end = len(ids) if limits.get('end', -1) < 0 else min(limits['end'], len(ids))
+        page = [self.shape(self.items[media_type][i], id_field, i, params.get('properties', []))
+                for i in ids[start:end]]
+        self.read += len(page)
+        return {key: page, 'limits': {'start': start, 'end': max(start, end), 'total': len(ids)}}
+
+    def shape(self, item, id_field, item_id, properties):
+        shaped = dict((name, item[name]) for name in properties if name in item)
+        shaped.update({id_field: item_id, 'label': item['label']})
+        return shaped
+
+    def change(self, count, snapshot):
+        """Makes count changes as Kodi would and hands its notifications to snapshot."""
+        types = [t for t in self.items if self.items[t]]
+        for _ in range(count):
+            media_type = self.rand.choice(types)
+            items = self.items[media_type]
+            roll = self.rand.random()
+            if roll < 0.7:
+                item_id = self.rand.choice(list(items))
+                items[item_id]['playcount'] += 1
+                items[item_id]['lastplayed'] = '2019-01-%02d 21:00:00' % self.rand.randint(1, 28)
+                event = 'OnUpdate'
+            elif roll < 0.9:
+                item_id = max(items) + 1
+                items[item_id] = new_item(self.rand, media_type, item_id)
+                event = 'OnUpdate'
+            else:
+                item_id = self.rand.choice(list(items))
+                del items[item_id]
+                event = 'OnRemove'
+            item = {'type': media_type, 'id': item_id}
+            # VideoLibrary nests the item, AudioLibrary does not
+            data = {'item': item} if NAMESPACES[media_type] == 'VideoLibrary' else item
+            snapshot.on_notification('%s.%s' % (NAMESPACES[media_type], event), data)
+
+
+def wait_settled(snapshot):
+    while snapshot.stats()['queued']:
+        time.sleep(0.01)
+
+
+def relist(kodi):
+    """Returns (compressed bytes, items read) of listing every media type in pages, as the server did."""
+    sent = 0
+    read = kodi.read
+    for media_type, (method, _, _, _, _, properties) in sorted(library.MEDIA_TYPES.items()):
+        start = 0
+        while True:
+            result = kodi.execute(method, {'properties': properties, 'limits': {'start': start, 'end': start + 500}})
+            response = json.dumps({'id': 1, 'jsonrpc': '2.0', 'result': result}, sort_keys=True,
+                                  separators=(',', ':')).encode('utf-8')
+            sent += len(frames.compress(response, frames.compression_level(len(response), method)))
+            start += 500
+            if start >= result['limits']['total']:
+                break
+    return sent, kodi.read - read
+
+
+def sync(snapshot, kodi, since):
+    """Returns (compressed bytes, items read, answers, full, version) of asking snapshot for the changes since."""
+    sent = 0
+    read = kodi.read
+    answers = 0
+    query = {'snapshot': since[0], 'version': since[1]}
+    first = None
+    while True:
+        response = snapshot.delta(**query)
+        answers += 1
+        message = json.dumps(response, separators=(',', ':')).encode('utf-8')
+        sent += len(frames.compress(message, frames.compression_level(len(message))))
+        first = first or response
+        if not response['more']:
+            break
+        query['after'] = response['after']
+    return sent, kodi.read - read, answers, first['full'], (first['snapshot'], first['version'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--episodes', type=int, default=20000)
+    parser.add_argument('--songs', type=int, default=30000)
+    parser.add_argument('--changes', default='0,10,100,1000', help="rounds of changes, between refreshes")
+    args = parser.parse_args()
+
+    library.RECONCILE_PAUSE_SECONDS = 0.0
+    counts = {'movie': args.movies, 'tvshow': args.episodes // 20, 'episode': args.episodes,
+              'artist': args.songs // 60, 'album': args.songs // 12, 'song': args.songs}
+    kodi = FakeLibrary(counts)
+    snapshot = library.LibrarySnapshot(kodi.execute)
+    begin = now()
+    snapshot.start()
+    wait_settled(snapshot)
+    print("snapshot of %d items loaded in %.0f ms, reading %d items" % (
+        snapshot.stats()['items'], (now() - begin) * 1000, kodi.read))
+    sent, read, answers, full, since = sync(snapshot, kodi, (None, None))
+    print("first sync (full): %d bytes in %d answers" % (sent, answers))
+
+    print("%8s %14s %12s %12s %12s %8s %10s" % ("changes", "relist bytes", "relist read", "delta bytes",
+                                                "delta read", "answers", "delta ms"))
+    for count in [int(c) for c in args.changes.split(',') if c]:
+        read = kodi.read
+        kodi.change(count, snapshot)
+        wait_settled(snapshot)
+        notified = kodi.read - read
+        relist_bytes, relist_read = relist(kodi)
+        begin = now()
+        sent, read, answers, full, since = sync(snapshot, kodi, since)
+        elapsed = now() - begin
+        if full:
+            raise RuntimeError("the changes did not reach back to the last sync")
+        print("%8d %14d %12d %12d %12d %8d %10.1f" % (count, relist_bytes, relist_read, sent, notified + read,
+                                                      answers, elapsed * 1000))
+    snapshot.stop()
+    snapshot.join()
+
+
+if __name__ == '__main__':
+    main()
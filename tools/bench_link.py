@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+End-to-end benchmark of the link: main.py runs in a child process against the stubs in tools/kodistub and connects
+to a StandInServer, which sends JSON-RPC requests with a bounded number in flight.
+
+    python tools/bench_link.py [--sizes 256,16384,1048576] [--concurrency 1,4,16] [--requests 200]
+                               [--latency 0.002] [--batch 3] [--capabilities correlation,chunked]
+                               [--python python2] [--json]
+
+For every response size and concurrency it reports requests per second, p50/p99 round trip, frame bytes on the wire
+per request (both directions, without TLS overhead) and the peak RSS of the link process. With --batch every request
+is a JSON-RPC batch and the figures are per batch. --stages adds the link's own p50/p99 milliseconds for each stage
+of a request, from its metrics.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(TOOLS, os.pardir)
+STUBS = os.path.join(TOOLS, 'kodistub')
+
+sys.path.insert(0, ROOT)
+
+from standin import StandInServer, SUPPORTED_CAPABILITIES  # noqa: E402
+
+now = getattr(time, 'monotonic', time.time)
+
+
+def run_link(port):
+    """Child process: runs the service the way Kodi does, pointed at the stand-in server."""
+    sys.path[:0] = [STUBS, ROOT]
+    import main
+    link = main.Link()
+    link.host = '127.0.0.1'
+    link.port = port
+    monitor = main.Monitor(link)
+    thread = threading.Thread(target=link.run, name="Media Steward link")
+    thread.start()
+    monitor.waitForAbort()
+    link.stop()
+    thread.join()
+
+
+def percentile(ordered, fraction):
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def peak_rss_bytes(usage):
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def measure(args, size, concurrency):
+    server = StandInServer(capabilities=args.capabilities)
+    env = dict(os.environ)
+    env['MEDIASTEWARD_STUB_LATENCY'] = str(args.latency)
+    env['MEDIASTEWARD_STUB_RESPONSE_BYTES'] = str(size)
+    env['MEDIASTEWARD_STUB_SETTINGS'] = json.dumps(args.settings)
+    child = subprocess.Popen([args.python, os.path.abspath(__file__), '--child', str(server.port)], env=env)
+    rtts = []
+    errors = []
+    try:
+        server.accept(timeout=args.timeout)
+        server.conn.settimeout(args.timeout)
+        window = threading.Semaphore(concurrency)
+        sent_at = {}
+
+        def read_responses():
+            try:
+                for _ in range(args.requests):
+                    response = server.read()[2]
+                    if args.batch:
+                        response = response[0]
+                    rtts.append(now() - sent_at.pop(response['id'] // max(args.batch, 1)))
+                    window.release()
+            except Exception as err:
+                errors.append(err)
+                for _ in range(concurrency):
+                    window.release()
+
+        reader = threading.Thread(target=read_responses)
+        reader.start()
+        padding = 'x' * args.request_bytes
+        begin = now()
+        for number in range(args.requests):
+            window.acquire()
+            if errors:
+                break
+            sent_at[number] = now()
+            if args.batch:
+                request = [{'jsonrpc': '2.0', 'id': number * args.batch + call, 'method': args.method,
+                            'params': {'padding': padding}} for call in range(args.batch)]
+            else:
+                request = {'jsonrpc': '2.0', 'id': number, 'method': args.method, 'params': {'padding': padding}}
+            server.request(request, correlation_id=number, packet_bytes=args.packet_bytes,
+                           chunked=args.chunked_requests)
+        reader.join()
+        elapsed = now() - begin
+        link_metrics = server.metrics() if args.stages and not errors else None
+    finally:
+        server.close()
+        if child.poll() is None:
+            child.terminate()
+            usage = os.wait4(child.pid, 0)[2]
+            child.returncode = 0  # reaped above
+        else:
+            usage = None  # the link exited early, its error is on stderr
+    if errors:
+        raise errors[0]
+    rtts.sort()
+    return {
+        'response_bytes': size,
+        'concurrency': concurrency,
+        'requests': len(rtts),
+        'requests_per_second': len(rtts) / elapsed,
+        'p50_ms': percentile(rtts, 0.5) * 1000,
+        'p99_ms': percentile(rtts, 0.99) * 1000,
+        'wire_bytes_per_request': (server.bytes_sent + server.bytes_received) / float(len(rtts)),
+        'peak_rss_bytes': peak_rss_bytes(usage),
+        'link_metrics': link_metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='256,16384,1048576', help="JSON-RPC response sizes in bytes")
+    parser.add_argument('--concurrency', default='1,4,16', help="requests in flight")
+    parser.add_argument('--requests', type=int, default=200, help="requests per measurement")
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds executeJSONRPC takes")
+    parser.add_argument('--method', default='Player.GetProperties')
+    parser.add_argument('--batch', type=int, default=0, help="send JSON-RPC batches of this many calls")
+    parser.add_argument('--request-bytes', type=int, default=0, help="padding added to every request")
+    parser.add_argument('--packet-bytes', type=int, help="split requests into packets of this many bytes")
+    parser.add_argument('--chunked-requests', action='store_true', help="send requests as chunked frames")
+    parser.add_argument('--capabilities', default=','.join(SUPPORTED_CAPABILITIES),
+                        help="capabilities the server accepts, empty for the original protocol")
+    parser.add_argument('--settings', default='{}', help="JSON object of addon settings for the link")
+    parser.add_argument('--python', default=sys.executable, help="interpreter running the link")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--stages', action='store_true', help="also print the link's own timings by stage")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per measurement")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_link(args.child)
+        return
+    args.capabilities = [c for c in args.capabilities.split(',') if c]
+    args.settings = json.loads(args.settings)
+
+    if not args.json:
+        print("%10s %5s %10s %9s %9s %12s %10s" % ("resp bytes", "conc", "req/s", "p50 ms", "p99 ms", "wire B/req",
+                                                    "peak MiB"))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for concurrency in [int(c) for c in args.concurrency.split(',')]:
+            result = measure(args, size, concurrency)
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print("%10d %5d %10.1f %9.2f %9.2f %12.0f %10.1f" % (
+                    size, concurrency, result['requests_per_second'], result['p50_ms'], result['p99_ms'],
+                    result['wire_bytes_per_request'], result['peak_rss_bytes'] / 1048576.0))
+                if result['link_metrics']:
+                    for method, stages in sorted(result['link_metrics']['methods'].items()):
+                        print("%17s %s" % (method, "  ".join("%s %.2f/%.2f" % (stage, timing[1], timing[2])
+                                                             for stage, timing in sorted(stages.items()))))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Service startup and idle cost: the time from starting the service to its first answered command, and the CPU time
+and event loop wakeups it uses while connected and idle afterwards.
+
+    python tools/bench_startup.py [--runs 5] [--idle 30] [--library-items 20000] [--python python2]
+
+The service runs in a child process as in bench_link.py, against a StandInServer. Boot time counts from spawning the
+child, so it includes starting the interpreter and the imports. Idle CPU is read from /proc and needs Linux.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, os.pardir))
+
+import msgs  # noqa: E402
+from standin import StandInServer  # noqa: E402
+
+now = getattr(time, 'monotonic', time.time)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def cpu_seconds(pid):
+    """User and system CPU seconds of a process so far, from /proc."""
+    with open('/proc/%d/stat' % pid) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+
+
+def measure(args):
+    server = StandInServer()
+    env = dict(os.environ)
+    env['MEDIASTEWARD_STUB_LIBRARY_ITEMS'] = str(args.library_items)
+    env['MEDIASTEWARD_STUB_SETTINGS'] = json.dumps(args.settings)
+    begin = now()
+    child = subprocess.Popen([args.python, os.path.join(TOOLS, 'bench_link.py'), '--child', str(server.port)], env=env)
+    try:
+        server.accept(timeout=args.timeout)
+        server.conn.settimeout(args.timeout)
+        server.request({'jsonrpc': '2.0', 'id': 1, 'method': 'Player.GetActivePlayers'}, correlation_id=1)
+        server.read()
+        boot = now() - begin
+        wakeups = server.metrics()['wakeups']
+        used = cpu_seconds(child.pid)
+        # pings are answered while idle, reading waits for the metrics asked for afterwards
+        reply = []
+        reader = threading.Thread(target=lambda: reply.append(server.read()))
+        reader.start()
+        time.sleep(args.idle)
+        idle = cpu_seconds(child.pid) - used
+        server.send_control(msgs.MSG_ID_METRICS, {'id': 2})
+        reader.join()
+        wakeups = reply[0][2]['metrics']['wakeups'] - wakeups
+    finally:
+        server.close()
+        child.terminate()
+        child.wait()
+    return boot, idle / args.idle, wakeups * 60.0 / args.idle
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--idle', type=float, default=30.0, help="seconds to measure idle CPU over")
+    parser.add_argument('--library-items', type=int, default=20000, help="movies, albums and so on in the library")
+    parser.add_argument('--settings', default='{}', help="JSON object of addon settings for the link")
+    parser.add_argument('--python', default=sys.executable, help="interpreter running the link")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+    args.settings = json.loads(args.settings)
+
+    results = []
+    for run in range(args.runs):
+        results.append(measure(args))
+        print("run %d: first command after %.0f ms, idle CPU %.2f ms/s, %.1f wakeups/min" % (
+            run + 1, results[-1][0] * 1000, results[-1][1] * 1000, results[-1][2]))
+        sys.stdout.flush()
+    boots, idles, wakeups = [sorted(column)[len(results) // 2] for column in zip(*results)]
+    print("median: first command after %.0f ms, idle CPU %.2f ms/s, %.1f wakeups/min" % (boots * 1000, idles * 1000,
+                                                                                          wakeups))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local fake of the Media Steward site's activation API, for script.py and activation.py.
+
+    python tools/fakeactivation.py [--port 8000] [--expiration 600] [--no-long-poll]
+
+GET /register/new hands out a code, GET /register/check/<code> reports its status, and POST /activate/<code>
+activates it as the activation site would. Checks are held until the status differs from the ETag named in
+If-None-Match, for at most their wait parameter, unless --no-long-poll has them answered at once without an ETag as
+a server without long polling would. With --hang checks are never answered. The benchmarks drive FakeActivation
+directly.
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately, they must not wait for each other's acknowledgement
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.site.count('connections')
+
+    def do_GET(self):
+        site = self.server.site
+        site.count('requests')
+        url = urlparse(self.path)
+        if url.path == '/register/new':
+            self._reply(200, site.register())
+        elif url.path.startswith('/register/check/'):
+            wait = float(parse_qs(url.query).get('wait', ['0'])[0])
+            status, etag = site.check(url.path.rpartition('/')[2], self.headers.get('If-None-Match'), wait)
+            if status is None:
+                self._reply(304, None, etag)
+            else:
+                self._reply(200, status, etag)
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply(200, {'activated': self.server.site.activate(self.path.rpartition('/')[2])})
+
+    def _reply(self, status, response, etag=None):
+        body = b'' if response is None else json.dumps(response, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        if response is not None:
+            self.send_header('Content-Type', 'application/json')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeActivation(object):
+    """The activation API on a local port, served from its own thread until close."""
+
+    def __init__(self, port=0, expiration_seconds=600, long_poll=True, hang=False):
+        self.expiration_seconds = expiration_seconds
+        self.long_poll = long_poll
+        self.hang = hang
+        self.codes = {}  # code -> [status, expires at]
+        self.counters = {'connections': 0, 'requests': 0}
+        self._changed = threading.Condition()
+        self._closed = False
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.site = self
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d' % self.port
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake activation")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def count(self, counter):
+        with self._changed:
+            self.counters[counter] += 1
+
+    def register(self):
+        with self._changed:
+            code = '%06d' % (len(self.codes) + 1)
+            self.codes[code] = ['valid', time.time() + self.expiration_seconds]
+        return {'code': code, 'uuid': '%032X' % (len(self.codes)), 'expiration_seconds': self.expiration_seconds}
+
+    def activate(self, code):
+        with self._changed:
+            entry = self.codes.get(code)
+            if entry is None or entry[0] != 'valid':
+                return False
+            entry[0] = 'activated'
+            self._changed.notify_all()
+        return True
+
+    def check(self, code, etag, wait):
+        """Returns (status, ETag) of code, status None when it is still that of etag after waiting."""
+        deadline = time.time() + (wait if self.long_poll else 0)
+        with self._changed:
+            while True:
+                if self.hang and not self._closed:
+                    self._changed.wait(1.0)
+                    continue
+                status = self._status(code)
+                current = '"%s"' % status['status']
+                if not self.long_poll:
+                    return status, None
+                remaining = deadline - time.time()
+                if current != etag or remaining <= 0 or self._closed:
+                    return (None if current == etag else status), current
+                self._changed.wait(min(remaining, 1.0))  # wakes to notice expiry
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _status(self, code):
+        entry = self.codes.get(code)
+        if entry is None:
+            return {'status': 'invalid'}
+        remaining = entry[1] - time.time()
+        if entry[0] == 'valid' and remaining <= 0:
+            entry[0] = 'expired'
+        status = {'status': entry[0]}
+        if entry[0] == 'valid':
+            status['seconds_remaining'] = int(remaining)
+        return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--expiration', type=int, default=600, help="seconds a code stays valid")
+    parser.add_argument('--no-long-poll', action='store_true', help="answer checks at once, without an ETag")
+    parser.add_argument('--hang', action='store_true', help="never answer checks")
+    args = parser.parse_args()
+
+    site = FakeActivation(args.port, args.expiration, not args.no_long_poll, args.hang)
+    print("activation API at %s, activate a code with: curl -X POST %s/activate/<code>" % (site.url, site.url))
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("served %s" % json.dumps(site.counters, sort_keys=True))
+        site.close()
+
+
+if __name__ == '__main__':
+    main()
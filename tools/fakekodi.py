@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local fake of Kodi's HTTP JSON-RPC interface, for gateway.py.
+
+    python tools/fakekodi.py [--instances 3] [--port 8080] [--latency 0.01] [--username kodi --password secret]
+
+Each instance listens on its own port, counting up from --port, and keeps connections alive as Kodi's web server
+does. Application.GetProperties answers with the instance's name, so responses show which Kodi ran a request, and
+every other method with a result of about --response-bytes. The benchmarks drive FakeKodi directly.
+"""
+
+import argparse
+import base64
+import json
+import socket
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        # headers and body are written separately, they must not wait for each other's acknowledgement
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.kodi.count('connections')
+
+    def do_POST(self):
+        kodi = self.server.kodi
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if kodi.authorization is not None and self.headers.get('Authorization') != kodi.authorization:
+            self._reply(401, b'')
+            return
+        kodi.count('requests')
+        if kodi.latency:
+            time.sleep(kodi.latency)
+        self._reply(200, kodi.answer(body))
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeKodi(object):
+    """One fake Kodi on a local port, served from its own thread until close."""
+
+    def __init__(self, name, port=0, latency=0.0, response_bytes=256, username=None, password=None):
+        self.name = name
+        self.latency = latency
+        self.response_bytes = response_bytes
+        self.authorization = None
+        if username is not None:
+            credentials = ('%s:%s' % (username, password or '')).encode('utf-8')
+            self.authorization = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+        self.counters = {'connections': 0, 'requests': 0}
+        self._lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.kodi = self
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d/jsonrpc' % self.port
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake Kodi %s" % name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def answer(self, body):
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self._encode({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': "Parse error."}})
+        if isinstance(request, list):
+            return b'[' + b','.join(self._encode(self._call(call)) for call in request) + b']'
+        return self._encode(self._call(request))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _call(self, call):
+        if not isinstance(call, dict) or 'method' not in call:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': "Invalid request."}}
+        if call['method'] == 'Application.GetProperties':
+            result = {'name': self.name, 'version': {'major': 19, 'minor': 4}}
+        else:
+            items = []
+            size = 0
+            while size < self.response_bytes:
+                item = {'id': len(items), 'label': "%s item %d" % (call['method'], len(items))}
+                items.append(item)
+                size += len(json.dumps(item)) + 2
+            result = {'items': items, 'limits': {'start': 0, 'end': len(items), 'total': len(items)}}
+        return {'jsonrpc': '2.0', 'id': call.get('id'), 'result': result}
+
+    @staticmethod
+    def _encode(response):
+        return json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--instances', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8080, help="port of the first instance")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every request takes")
+    parser.add_argument('--response-bytes', type=int, default=256)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    args = parser.parse_args()
+
+    kodis = [FakeKodi("kodi-%d" % i, args.port + i, args.latency, args.response_bytes, args.username, args.password)
+             for i in range(args.instances)]
+    for kodi in kodis:
+        print("%s at %s" % (kodi.name, kodi.url))
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for kodi in kodis:
+            print("%s served %s" % (kodi.name, json.dumps(kodi.counters, sort_keys=True)))
+            kodi.close()
+
+
+if __name__ == '__main__':
+    main()
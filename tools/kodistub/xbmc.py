@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stand-in for Kodi's xbmc module, enough to run main.py outside Kodi. Behaviour is set from the environment:
+
+    MEDIASTEWARD_STUB_LATENCY         seconds executeJSONRPC sleeps before answering (default 0)
+    MEDIASTEWARD_STUB_RESPONSE_BYTES  approximate size of every JSON-RPC result (default 256)
+    MEDIASTEWARD_STUB_LOG_LEVEL       lowest level written to stderr (default LOGWARNING)
+    MEDIASTEWARD_STUB_LIBRARY_ITEMS   items in every library listing, VideoLibrary.GetMovies and the like, which then
+                                      honour limits and are written as Kodi does (default 0, answered as any method)
+    MEDIASTEWARD_STUB_ITEM_SECONDS    extra seconds a listing takes per item it returns (default 0)
+
+The service ends when the process receives SIGTERM or SIGINT, as it would when Kodi asks it to abort.
+"""
+
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+LOGDEBUG, LOGINFO, LOGNOTICE, LOGWARNING, LOGERROR, LOGSEVERE, LOGFATAL, LOGNONE = range(8)
+
+LATENCY = float(os.environ.get('MEDIASTEWARD_STUB_LATENCY', '0'))
+RESPONSE_BYTES = int(os.environ.get('MEDIASTEWARD_STUB_RESPONSE_BYTES', '256'))
+LOG_LEVEL = int(os.environ.get('MEDIASTEWARD_STUB_LOG_LEVEL', str(LOGWARNING)))
+LIBRARY_ITEMS = int(os.environ.get('MEDIASTEWARD_STUB_LIBRARY_ITEMS', '0'))
+ITEM_SECONDS = float(os.environ.get('MEDIASTEWARD_STUB_ITEM_SECONDS', '0'))
+
+# listing method: (result key, id field)
+LISTINGS = {
+    'AudioLibrary.GetAlbums': ('albums', 'albumid'),
+    'AudioLibrary.GetArtists': ('artists', 'artistid'),
+    'AudioLibrary.GetSongs': ('songs', 'songid'),
+    'VideoLibrary.GetEpisodes': ('episodes', 'episodeid'),
+    'VideoLibrary.GetMovies': ('movies', 'movieid'),
+    'VideoLibrary.GetMusicVideos': ('musicvideos', 'musicvideoid'),
+    'VideoLibrary.GetTVShows': ('tvshows', 'tvshowid'),
+}
+
+_abort = threading.Event()
+
+
+def _request_abort(signum, frame):
+    _abort.set()
+
+
+if threading.current_thread().name == 'MainThread':
+    signal.signal(signal.SIGTERM, _request_abort)
+    signal.signal(signal.SIGINT, _request_abort)
+
+
+def log(msg, level=LOGDEBUG):
+    if level >= LOG_LEVEL:
+        sys.stderr.write("%.3f T:%s %d: %s\n" % (time.time(), threading.current_thread().name, level, msg))
+
+
+def sleep(milliseconds):
+    time.sleep(milliseconds / 1000.0)
+
+
+def translatePath(path):
+    return path.replace('special://', os.path.join(os.environ.get('TMPDIR', '/tmp'), 'kodistub') + os.sep)
+
+
+def _result(method, params):
+    # library style items, so the payload compresses about as well as a real listing
+    items = []
+    size = 0
+    while size < RESPONSE_BYTES:
+        item = {'id': len(items), 'label': "%s item %d" % (method, len(items)), 'year': 1950 + len(items) % 70}
+        items.append(item)
+        size += len(json.dumps(item)) + 2
+    return {'items': items, 'limits': {'start': 0, 'end': len(items), 'total': len(items)}}
+
+
+def _listing(method, params):
+    key, id_field = LISTINGS[method]
+    limits = (params or {}).get('limits', {})
+    start = min(limits.get('start', 0), LIBRARY_ITEMS)
+    end = LIBRARY_ITEMS if limits.get('end', -1) < 0 else min(limits['end'], LIBRARY_ITEMS)
+    end = max(start, end)
+    if ITEM_SECONDS:
+        time.sleep(ITEM_SECONDS * (end - start))
+    items = [{id_field: i, 'label': "%s %d" % (key, i), 'year': 1950 + i % 70} for i in range(start, end)]
+    return {key: items, 'limits': {'start': start, 'end': end, 'total': LIBRARY_ITEMS}}
+
+
+def _answer(request):
+    if not isinstance(request, dict) or 'method' not in request:
+        return {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': "Invalid request."}}
+    if LIBRARY_ITEMS and request['method'] in LISTINGS:
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': _listing(request['method'], request.get('params'))}
+    return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': _result(request['method'], request.get('params'))}
+
+
+def executeJSONRPC(request):
+    if not isinstance(request, str):
+        request = request.decode('utf-8')
+    if LATENCY:
+        time.sleep(LATENCY)
+    try:
+        parsed = json.loads(request)
+    except ValueError:
+        response = {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': "Parse error."}}
+    else:
+        if isinstance(parsed, list):
+            response = [_answer(r) for r in parsed]
+        else:
+            response = _answer(parsed)
+            if isinstance(parsed, dict) and LIBRARY_ITEMS and parsed.get('method') in LISTINGS:
+                # compact with sorted keys, as Kodi writes
+                return json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    # Kodi hands back a byte string on Python 2, the link expects bytes on Python 3 as well
+    return json.dumps(response).encode('utf-8')
+
+
+class Monitor(object):
+
+    def __init__(self):
+        pass
+
+    def abortRequested(self):
+        return _abort.is_set()
+
+    def waitForAbort(self, timeout=None):
+        # wait in slices, a bare Event.wait() cannot be interrupted by signals on Python 2
+        end = None if timeout is None else time.time() + timeout
+        while not _abort.is_set():
+            remaining = 0.2 if end is None else min(0.2, end - time.time())
+            if remaining <= 0:
+                return False
+            _abort.wait(remaining)
+        return True
+
+    def onNotification(self, sender, method, data):
+        pass
+
+    def onSettingsChanged(self):
+        pass
+
+
+class Player(object):
+
+    def __init__(self):
+        pass
+
+    def isPlaying(self):
+        return False
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stand-in for Kodi's xbmcaddon module. Settings start from the defaults in resources/settings.xml, with a uuid filled
+in and certificate validation off so the link accepts the stand-in server's self-signed certificate. Further
+overrides are read as a JSON object from MEDIASTEWARD_STUB_SETTINGS.
+"""
+
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir)
+
+
+def _load_settings():
+    settings = {}
+    for setting in ElementTree.parse(os.path.join(_ROOT, 'resources', 'settings.xml')).iter('setting'):
+        if setting.get('id'):
+            settings[setting.get('id')] = setting.get('default', '')
+    settings['uuid'] = '0' * 32
+    settings['ssl-validation'] = 'false'
+    settings['hide-connection'] = 'true'
+    settings.update(json.loads(os.environ.get('MEDIASTEWARD_STUB_SETTINGS', '{}')))
+    return settings
+
+
+def _load_strings():
+    strings = {}
+    msgctxt = None
+    path = os.path.join(_ROOT, 'resources', 'language', 'resource.language.en_gb', 'strings.po')
+    with open(path) as po:
+        for line in po:
+            if line.startswith('msgctxt "#'):
+                msgctxt = int(line[10:line.index('"', 10)])
+            elif line.startswith('msgid "') and msgctxt is not None:
+                strings[msgctxt] = line[7:line.rindex('"')]
+                msgctxt = None
+    return strings
+
+
+_settings = _load_settings()
+_strings = _load_strings()
+
+
+def _addon_info():
+    addon = ElementTree.parse(os.path.join(_ROOT, 'addon.xml')).getroot()
+    return {'id': addon.get('id'), 'name': addon.get('name'), 'version': addon.get('version'),
+            'path': os.path.abspath(_ROOT), 'profile': 'special://profile/addon_data/%s/' % addon.get('id')}
+
+
+_info = _addon_info()
+
+
+class Addon(object):
+
+    def __init__(self, id=None):
+        pass
+
+    def getSetting(self, id):
+        return _settings.get(id, '')
+
+    def setSetting(self, id, value):
+        _settings[id] = value
+
+    def getAddonInfo(self, id):
+        return _info.get(id, '')
+
+    def getLocalizedString(self, id):
+        return _strings.get(id, '')
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stand-in for Kodi's xbmcgui module, notifications and dialogs go to the log. cancel_dialogs() presses Cancel on every
+progress dialog, as the user would.
+"""
+
+import threading
+
+import xbmc
+
+NOTIFICATION_INFO = 'info'
+NOTIFICATION_WARNING = 'warning'
+NOTIFICATION_ERROR = 'error'
+
+_canceled = threading.Event()
+
+
+def cancel_dialogs():
+    _canceled.set()
+
+
+class Dialog(object):
+
+    def notification(self, heading, message, icon=NOTIFICATION_INFO, time=5000, sound=True):
+        xbmc.log("notification (%s) %s: %s" % (icon, heading, message), level=xbmc.LOGWARNING)
+
+    def ok(self, heading, line1, line2='', line3=''):
+        xbmc.log("dialog %s: %s %s %s" % (heading, line1, line2, line3), level=xbmc.LOGWARNING)
+        return True
+
+
+class DialogProgress(object):
+
+    def create(self, heading, line1='', line2='', line3=''):
+        _canceled.clear()
+        xbmc.log("progress %s: %s %s %s" % (heading, line1, line2, line3), level=xbmc.LOGWARNING)
+
+    def update(self, percent, line1='', line2='', line3=''):
+        xbmc.log("progress %d%%" % percent, level=xbmc.LOGDEBUG)
+
+    def iscanceled(self):
+        return _canceled.is_set()
+
+    def close(self):
+        xbmc.log("progress closed", level=xbmc.LOGDEBUG)
@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Replays captures of the link's traffic, recorded with the capture setting, through the link in this process.
+
+    python tools/replay_capture.py captures/capture.msl.1 captures/capture.msl [--max | --speed 2]
+                                   [--latency 0.002] [--window 64] [--set id=value] [--list]
+
+Files are read in the order given, oldest first. Every recorded connection is replayed over a connection of its own
+to a StandInServer: its verification without the heartbeat, then its request frames byte for byte at the pace they
+arrived, or back to back with --max, with at most --window requests unanswered. The requests run against a stub of
+executeJSONRPC answering after --latency seconds with the responses recorded for them: a page of a listing with its
+part of the recorded listing, anything unrecorded with an empty result. Searches are not replayed, the replaying link
+has no title index.
+
+For every connection it reports requests per second and the p50/p99 time from the last byte of a request to the last
+byte of its response, as recorded and as replayed, then the link's own timings by method and stage. --list prints
+the frames of the capture instead.
+"""
+
+import argparse
+import bisect
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(TOOLS, os.pardir)
+sys.path.insert(0, ROOT)
+
+import capture  # noqa: E402
+import dictionaries  # noqa: E402
+import frames  # noqa: E402
+import link  # noqa: E402
+import linklog  # noqa: E402
+import msgs  # noqa: E402
+import settings  # noqa: E402
+import workers  # noqa: E402
+from standin import StandInServer  # noqa: E402
+
+now = getattr(time, 'monotonic', time.time)
+
+# not replayed: pings would interleave with the recorded frames, searches need the title index
+SKIPPED_CAPABILITIES = (msgs.CAPABILITY_HEARTBEAT, msgs.CAPABILITY_SEARCH)
+
+
+def percentile(ordered, fraction):
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+class Stream(object):
+    """One direction of a recorded connection from its first frame on, with the time each piece was recorded."""
+
+    def __init__(self):
+        self.pieces = []
+        self.ends = []
+        self.times = []
+        self.size = 0
+
+    def add(self, when, data, frame_start):
+        if not self.pieces and not frame_start:
+            return  # the capture began inside a frame
+        self.pieces.append(data)
+        self.size += len(data)
+        self.ends.append(self.size)
+        self.times.append(when)
+
+    def data(self):
+        return b''.join(self.pieces)
+
+    def time_at(self, offset):
+        """Returns when the byte at offset was recorded."""
+        return self.times[bisect.bisect_right(self.ends, offset)]
+
+
+class Frame(object):
+    """A recorded frame: its header, correlation id and instance where it has them, compressed body and bytes."""
+
+    def __init__(self, header, correlation_id, instance, body, raw, began, ended):
+        self.header = header
+        self.correlation_id = correlation_id
+        self.instance = instance
+        self.body = body
+        self.raw = raw
+        self.began = began  # when its first byte was recorded
+        self.ended = ended  # and its last
+        self.message = None  # inflated, for requests and responses
+        self.response = None  # of a request, the Frame answering it
+
+    def name(self, inbound):
+        return msgs.CONTROL_NAMES.get(self.header, 'request' if inbound else 'response')
+
+
+def split_frames(stream, inbound, capabilities):
+    """Returns the frames of a stream, a frame cut short at its end is left out."""
+    data = stream.data()
+    correlation = msgs.CAPABILITY_CORRELATION in capabilities
+    gateway = msgs.CAPABILITY_GATEWAY in capabilities and correlation
+    offset = [0]
+
+    def field():
+        if offset[0] + 4 > len(data):
+            raise EOFError
+        offset[0] += 4
+        return struct.unpack_from('>l', data, offset[0] - 4)[0]
+
+    def packet(size):
+        if size < 0 or offset[0] + size > len(data):
+            raise EOFError
+        offset[0] += size
+        return data[offset[0] - size:offset[0]]
+
+    found = []
+    while offset[0] < len(data):
+        start = offset[0]
+        correlation_id = instance = None
+        try:
+            header = field()
+            if header == msgs.MSG_ID_STREAM and not inbound:
+                correlation_id = field()
+                packets = [packet(field())]
+            elif header < 0:
+                packets = [packet(field())]
+            else:
+                if correlation:
+                    correlation_id = field()
+                    if inbound and gateway:
+                        instance = field()
+                packets = []
+                while header == msgs.PACKETS_CHUNKED or len(packets) < header:
+                    size = field()
+                    if size == 0 and header == msgs.PACKETS_CHUNKED:
+                        break
+                    packets.append(packet(size))
+        except EOFError:
+            break
+        found.append(Frame(header, correlation_id, instance, b''.join(packets), data[start:offset[0]],
+                           stream.time_at(start), stream.time_at(offset[0] - 1)))
+    return found
+
+
+def inflate(body, zdict):
+    try:
+        inflater = frames.decompressor(zdict)
+        return inflater.decompress(body) + inflater.flush()
+    except zlib.error:
+        return None
+
+
+class Connection(object):
+    """A recorded connection: the link's META records, then its frames in either direction."""
+
+    def __init__(self, connected, when):
+        self.connected = connected
+        self.when = when
+        self.verification = None
+        self.inbound = Stream()
+        self.outbound = Stream()
+        self.received = []  # frames from the server
+        self.sent = []  # frames from the link
+        self.requests = []
+
+    def capabilities(self):
+        return self.verification.get('capabilities', []) if self.verification is not None else []
+
+    def parse(self):
+        """Splits the streams into frames and pairs each request with its response."""
+        capabilities = self.capabilities()
+        zdict = None
+        if msgs.CAPABILITY_DICTIONARY in capabilities:
+            if not dictionaries.SUPPORTED:
+                raise ValueError("the capture uses a preset dictionary, which needs Python 3.3 or later")
+            zdict = dictionaries.PRESETS.get(self.verification.get('dictionary'))
+        self.received = split_frames(self.inbound, True, capabilities)
+        self.sent = split_frames(self.outbound, False, capabilities)
+        self.requests = [f for f in self.received if f.header >= 0]
+        for request in self.requests:
+            request.message = inflate(request.body, zdict)
+        responses = []
+        streams = {}
+        for frame in self.sent:
+            if frame.header == msgs.MSG_ID_STREAM:
+                pieces = streams.setdefault(frame.correlation_id, [])
+                if frame.body:
+                    pieces.append(frame)
+                    continue
+                # the stream ends, answered by its packets as one frame
+                del streams[frame.correlation_id]
+                frame = Frame(frame.header, frame.correlation_id, None, b''.join(p.body for p in pieces),
+                              b''.join(p.raw for p in pieces), pieces[0].began if pieces else frame.began,
+                              frame.ended)
+            elif frame.header < 0:
+                continue
+            frame.message = inflate(frame.body, zdict)
+            responses.append(frame)
+        if msgs.CAPABILITY_CORRELATION in capabilities:
+            by_id = {}
+            for response in responses:
+                by_id.setdefault(response.correlation_id, []).append(response)
+            for request in self.requests:
+                waiting = by_id.get(request.correlation_id)
+                if waiting:
+                    request.response = waiting.pop(0)
+        else:
+            for request, response in zip(self.requests, responses):
+                request.response = response
+
+
+def read_connections(paths):
+    """Returns the connections recorded in the capture files, oldest first."""
+    connections = []
+    current = None
+    for path in paths:
+        for kind, when, data, frame_start in capture.read_records(path):
+            if kind == capture.META:
+                meta = json.loads(data.decode('utf-8'))
+                if meta['event'] == 'connected':
+                    if current is not None and current.when == when:
+                        continue  # repeated at the top of a rotated file
+                    current = Connection(meta, when)
+                    connections.append(current)
+                elif meta['event'] == 'verified' and current is not None:
+                    current.verification = meta['verification']
+                elif meta['event'] == 'closed':
+                    current = None
+            elif current is not None:
+                (current.inbound if kind == capture.IN else current.outbound).add(when, data, frame_start)
+    for connection in connections:
+        connection.parse()
+    return connections
+
+
+def encode(response):
+    return json.dumps(response, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class Answers(object):
+    """
+    The recorded responses by request, and by method and id for the pages of listings and the calls of batches the
+    link runs on their own. Called from the workers.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.calls = {}
+        self.counts = {'recorded': 0, 'paged': 0, 'unrecorded': 0}
+        self._lock = threading.Lock()
+
+    def add(self, request, response):
+        self.exact[request] = response
+        try:
+            call = json.loads(request.decode('utf-8'))
+            result = json.loads(response.decode('utf-8'))
+        except ValueError:
+            return
+        if isinstance(call, dict):
+            call, result = [call], [result]
+        if not isinstance(call, list) or not isinstance(result, list):
+            return
+        by_id = dict((json.dumps(r.get('id')), r) for r in result if isinstance(r, dict))
+        for c in call:
+            if isinstance(c, dict) and json.dumps(c.get('id')) in by_id:
+                self.calls[(c.get('method'), json.dumps(c.get('id')))] = by_id[json.dumps(c.get('id'))]
+
+    def answer(self, request):
+        if not isinstance(request, bytes):
+            request = request.encode('utf-8')
+        response = self.exact.get(request)
+        if response is not None:
+            self._count('recorded')
+            return response
+        try:
+            call = json.loads(request.decode('utf-8'))
+        except ValueError:
+            self._count('unrecorded')
+            return encode({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': "Parse error."}})
+        if isinstance(call, list):
+            return b'[' + b','.join(self._call(c) for c in call) + b']'
+        return self._call(call)
+
+    def _call(self, call):
+        if not isinstance(call, dict):
+            self._count('unrecorded')
+            return encode({'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': "Invalid request."}})
+        recorded = self.calls.get((call.get('method'), json.dumps(call.get('id'))))
+        if recorded is None:
+            self._count('unrecorded')
+            return encode({'jsonrpc': '2.0', 'id': call.get('id'), 'result': {}})
+        key = workers.LISTING_METHODS.get(call.get('method'))
+        result = recorded.get('result')
+        params = call.get('params')
+        limits = params.get('limits') if isinstance(params, dict) else None
+        if key is not None and isinstance(result, dict) and isinstance(limits, dict) and 'limits' in result:
+            # a page of a listing the link split, cut from the whole one
+            first = result['limits'].get('start', 0)
+            total = result['limits'].get('total', 0)
+            start = limits.get('start', 0)
+            end = limits.get('end', -1)
+            items = result.get(key, [])[max(0, start - first):max(0, (total if end < 0 else end) - first)]
+            self._count('paged')
+            return encode({'jsonrpc': '2.0', 'id': call.get('id'),
+                           'result': {key: items, 'limits': {'start': start, 'end': start + len(items),
+                                                             'total': total}}})
+        self._count('recorded')
+        return encode(dict(recorded, id=call.get('id')))
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+
+class Settings(object):
+    """The addon's default settings with overrides, read as the addon's are."""
+
+    def __init__(self, values):
+        self.values = values
+
+    def getSetting(self, id):
+        return self.values.get(id, '')
+
+
+def write_log(line, level=linklog.LOGNOTICE):
+    if level >= linklog.LOGERROR:
+        sys.stderr.write(line + '\n')
+
+
+class ReplayLink(link.Link):
+    """The link with executeJSONRPC stubbed by the answers recorded on each connection, in turn as it connects."""
+
+    def __init__(self, version, values, directory, answers, latency):
+        link.Link.__init__(self, version, Settings(values), linklog.LinkLog(write_log), directory)
+        self.pending = list(answers)
+        self.answers = self.pending[0]
+        self.latency = latency
+
+    def on_connected(self):
+        if self.pending:
+            self.answers = self.pending.pop(0)
+        link.Link.on_connected(self)
+
+    def capabilities(self):
+        # the stand-in accepts those of the recorded verification
+        return link.Link.capabilities(self) + [msgs.CAPABILITY_GATEWAY]
+
+    def execute_jsonrpc(self, request, instance):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.answers.answer(request)
+
+
+def replay(args, server, connection):
+    """
+    Replays the requests of a connection, returns the seconds it took, the round trips, the number of responses not
+    as recorded and the link's metrics.
+    """
+    recorded = connection.capabilities()
+    server.capabilities = [c for c in recorded if c not in SKIPPED_CAPABILITIES] + [msgs.CAPABILITY_METRICS]
+    verification = dict((k, v) for k, v in connection.verification.items()
+                        if k not in ('capabilities', 'retry-after'))
+    server.accept(timeout=args.timeout, **verification)
+    server.conn.settimeout(args.timeout)
+    requests = connection.requests
+    correlation = msgs.CAPABILITY_CORRELATION in server.accepted
+    window = threading.Semaphore(args.window)
+    sent_at = {}
+    rtts = []
+    differing = []
+    errors = []
+
+    def read_responses():
+        try:
+            for number in range(len(requests)):
+                _, correlation_id, message = server.read()
+                sent, request = sent_at[correlation_id if correlation else number].pop(0)
+                rtts.append(now() - sent)
+                if request.response is not None and request.response.message is not None and \
+                        message != json.loads(request.response.message.decode('utf-8')):
+                    differing.append(request)
+                window.release()
+        except Exception as err:
+            errors.append(err)
+            for _ in range(args.window):
+                window.release()
+
+    reader = threading.Thread(target=read_responses)
+    reader.start()
+    origin = requests[0].began if requests else 0.0
+    begin = now()
+    for number, request in enumerate(requests):
+        if not args.max:
+            delay = (request.began - origin) / args.speed - (now() - begin)
+            if delay > 0:
+                time.sleep(delay)
+        window.acquire()
+        if errors:
+            break
+        sent_at.setdefault(request.correlation_id if correlation else number, []).append((now(), request))
+        server.send_frame(request.raw)
+    reader.join()
+    elapsed = now() - begin
+    if errors:
+        raise errors[0]
+    return elapsed, rtts, len(differing), server.metrics()
+
+
+def list_frames(connections):
+    for number, connection in enumerate(connections, 1):
+        print("connection %d to %s, version %s, at %s" % (
+            number, connection.connected.get('host'), connection.connected.get('version'),
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(connection.when))))
+        if connection.verification is not None:
+            print("  verification %s" % json.dumps(connection.verification, sort_keys=True))
+        frames_ = [(f.began, 'in ', f.name(True), f) for f in connection.received]
+        frames_ += [(f.began, 'out', f.name(False), f) for f in connection.sent]
+        for began, direction, name, frame in sorted(frames_, key=lambda entry: entry[0]):
+            detail = ''
+            if frame.correlation_id is not None:
+                detail += ' #%d' % frame.correlation_id
+            if frame.instance:
+                detail += ' instance %d' % frame.instance
+            if frame.message is not None:
+                detail += ' %s %d bytes' % (frame.message[:60].decode('utf-8', 'replace'), len(frame.message))
+            print("  %10.3f %s %-12s %7d wire bytes%s" % (began - connection.when, direction, name,
+                                                          len(frame.raw), detail))
+
+
+def run_link(args, connections):
+    """Child process: runs the link against the stand-in until its input closes, then prints the answer counts."""
+    answers = []
+    for connection in connections:
+        # the same request may have been answered differently on another connection
+        answers.append(Answers())
+        for request in connection.requests:
+            if request.message is not None and request.response is not None and request.response.message is not None:
+                answers[-1].add(request.message, request.response.message)
+    values = dict(settings.setting_defaults(ROOT))
+    values.update({'uuid': '%032x' % 1, 'ssl-validation': 'false', 'title-index': 'false', 'library-snapshot': 'false',
+                   'capture': 'false'})
+    values.update(entry.split('=', 1) for entry in args.set)
+    directory = tempfile.mkdtemp(prefix='replay_capture')
+    replay_link = ReplayLink(connections[0].connected.get('version', 'replay'), values, directory, answers,
+                             args.latency)
+    replay_link.host = '127.0.0.1'
+    replay_link.port = args.child
+    thread = threading.Thread(target=replay_link.run, name="Media Steward link")
+    thread.start()
+    sys.stdin.read()
+    replay_link.stop()
+    thread.join()
+    shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(dict((name, sum(a.counts[name] for a in answers)) for name in answers[0].counts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('captures', nargs='+', help="capture files, oldest first")
+    parser.add_argument('--speed', type=float, default=1.0, help="times the recorded pace")
+    parser.add_argument('--max', action='store_true', help="send the requests back to back")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds every executeJSONRPC call takes")
+    parser.add_argument('--window', type=int, default=64, help="requests unanswered at most")
+    parser.add_argument('--set', action='append', default=[], metavar='ID=VALUE', help="addon setting")
+    parser.add_argument('--python', default=sys.executable, help="interpreter running the link")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--list', action='store_true', help="print the frames of the capture")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per connection")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    try:
+        connections = read_connections(args.captures)
+    except (IOError, ValueError) as err:
+        sys.exit(str(err))
+    if args.list:
+        list_frames(connections)
+        return
+    connections = [c for c in connections if c.verification is not None and c.requests]
+    if not connections:
+        sys.exit("no verified connection with requests in %s" % ', '.join(args.captures))
+    if args.child is not None:
+        run_link(args, connections)
+        return
+
+    server = StandInServer()
+    # the link runs in a process of its own, as it would in Kodi, not competing with the stand-in for the GIL
+    command = [args.python, os.path.abspath(__file__)] + args.captures + ['--latency', str(args.latency),
+                                                                          '--child', str(server.port)]
+    for entry in args.set:
+        command += ['--set', entry]
+    child = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    link_metrics = None
+    try:
+        if not args.json:
+            print("%10s %8s %10s %10s %10s %10s %10s %10s %10s" % (
+                "connection", "requests", "seconds", "req/s", "rec p50", "rec p99", "p50 ms", "p99 ms", "differing"))
+        for number, connection in enumerate(connections, 1):
+            elapsed, rtts, differing, link_metrics = replay(args, server, connection)
+            server.disconnect()
+            recorded = sorted(r.response.ended - r.ended for r in connection.requests if r.response is not None)
+            rtts.sort()
+            result = {
+                'connection': number,
+                'requests': len(rtts),
+                'recorded_seconds': connection.requests[-1].ended - connection.requests[0].began,
+                'seconds': elapsed,
+                'requests_per_second': len(rtts) / elapsed if elapsed else 0.0,
+                'recorded_p50_ms': percentile(recorded, 0.5) * 1000 if recorded else None,
+                'recorded_p99_ms': percentile(recorded, 0.99) * 1000 if recorded else None,
+                'p50_ms': percentile(rtts, 0.5) * 1000,
+                'p99_ms': percentile(rtts, 0.99) * 1000,
+                'differing': differing,
+            }
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print("%10d %8d %10.2f %10.1f %10s %10s %10.2f %10.2f %10d" % (
+                    number, result['requests'], elapsed, result['requests_per_second'],
+                    '-' if not recorded else '%.2f' % result['recorded_p50_ms'],
+                    '-' if not recorded else '%.2f' % result['recorded_p99_ms'], result['p50_ms'], result['p99_ms'],
+                    differing))
+            sys.stdout.flush()
+    finally:
+        server.close()
+        counts = json.loads(child.communicate()[0].decode('utf-8') or 'null')
+    if args.json:
+        print(json.dumps({'answers': counts, 'link_metrics': link_metrics}, sort_keys=True))
+        return
+    print("answers: %d recorded, %d listing pages, %d unrecorded" % (counts['recorded'], counts['paged'],
+                                                                    counts['unrecorded']))
+    print("link stages, p50/p99 ms:")
+    for method, stages in sorted(link_metrics['methods'].items()):
+        print("%30s %s" % (method, "  ".join("%s %.2f/%.2f" % (stage, timing[1], timing[2])
+                                             for stage, timing in sorted(stages.items()))))
+
+
+if __name__ == '__main__':
+    main()
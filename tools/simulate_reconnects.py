@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Simulation of a fleet of links reconnecting after the server goes away, comparing reconnect policies.
+
+    python tools/simulate_reconnects.py [--clients 10000] [--outage 60] [--capacity 500] [--seed 1]
+
+Every client is connected when the server goes down at t=0. It comes back after --outage seconds and can then accept
+--capacity connections per second, attempts beyond that fail as they would against an overloaded server. Printed
+per policy: connect attempts per 10 second bucket, the peak attempts in any second, and when the last client got
+back. The 'fixed' policy is the one main.py used before backoff.py, 20 seconds and then 120 seconds every time.
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import backoff  # noqa: E402
+
+
+class FixedDelays(object):
+
+    def __init__(self):
+        self.failed = False
+
+    def succeeded(self):
+        self.failed = False
+
+    def next_delay(self):
+        delay = 120.0 if self.failed else 20.0
+        self.failed = True
+        return delay
+
+
+def simulate(policies, outage, capacity, horizon):
+    """Returns ({second: attempts}, seconds until every client reconnected or None)."""
+    attempts = {}
+    accepted = {}
+    # every client noticed the server going away at t=0
+    pending = [(policy.next_delay(), number) for number, policy in enumerate(policies)]
+    heapq.heapify(pending)
+    last = 0.0
+    while pending:
+        when, number = heapq.heappop(pending)
+        if when > horizon:
+            return attempts, None
+        second = int(when)
+        attempts[second] = attempts.get(second, 0) + 1
+        if when >= outage and accepted.get(second, 0) < capacity:
+            accepted[second] = accepted.get(second, 0) + 1
+            policies[number].succeeded()
+            last = when
+        else:
+            heapq.heappush(pending, (when + policies[number].next_delay(), number))
+    return attempts, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--outage', type=float, default=60.0, help="seconds the server is away")
+    parser.add_argument('--capacity', type=int, default=500, help="connections the server accepts per second")
+    parser.add_argument('--horizon', type=float, default=3600.0, help="seconds simulated at most")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rand = random.Random(args.seed)
+    fleets = (
+        ('fixed', [FixedDelays() for _ in range(args.clients)]),
+        ('backoff', [backoff.Backoff(rand=rand.random) for _ in range(args.clients)]),
+    )
+    for name, policies in fleets:
+        for policy in policies:
+            policy.succeeded()  # all were connected before the outage
+        attempts, last = simulate(policies, args.outage, args.capacity, args.horizon)
+        buckets = {}
+        for second, count in attempts.items():
+            buckets[second // 10 * 10] = buckets.get(second // 10 * 10, 0) + count
+        print("%s: %d attempts, peak %d/s, all reconnected %s" % (
+            name, sum(attempts.values()), max(attempts.values()),
+            "after %.1f s" % last if last is not None else "not within %d s" % args.horizon))
+        for start in sorted(buckets):
+            print("  %5d-%-5d %7d %s" % (start, start + 10, buckets[start],
+                                        '#' * int(60.0 * buckets[start] / max(buckets.values()) + 0.5)))
+
+
+if __name__ == '__main__':
+    main()
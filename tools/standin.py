@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local stand-in for the Media Steward server, speaking the link protocol of main.py and msgs.py over TLS.
+
+    python tools/standin.py [--port 59348] [--capabilities correlation,chunked]
+
+Standalone it accepts one link, then sends each JSON-RPC request read from stdin (one per line) and prints the
+response. The benchmarks drive StandInServer directly.
+"""
+
+import argparse
+import json
+import os
+import select
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import dictionaries  # noqa: E402
+import frames  # noqa: E402
+import msgs  # noqa: E402
+
+# capabilities the stand-in understands
+SUPPORTED_CAPABILITIES = [msgs.CAPABILITY_CORRELATION, msgs.CAPABILITY_CHUNKED, msgs.CAPABILITY_HEARTBEAT,
+                          msgs.CAPABILITY_METRICS, msgs.CAPABILITY_EVENTS, msgs.CAPABILITY_STREAMS,
+                          msgs.CAPABILITY_GATEWAY, msgs.CAPABILITY_LIBRARY]
+if dictionaries.SUPPORTED:
+    SUPPORTED_CAPABILITIES.append(msgs.CAPABILITY_DICTIONARY)
+
+
+def self_signed_certificate(directory):
+    """Writes a throwaway certificate and key for localhost with the openssl tool, returns their paths."""
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                               '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+                              stdout=devnull, stderr=devnull)
+    return cert, key
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class StandInServer(object):
+    """
+    Accepts links on a local TLS port and plays the server side of the protocol: it answers the announce with a
+    verification, sends requests as legacy multi-packet or chunked frames, and reads the link's response frames.
+    Bytes of frames sent and received are counted, excluding TLS overhead.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, capabilities=None, cert=None, key=None):
+        self.capabilities = SUPPORTED_CAPABILITIES if capabilities is None else capabilities
+        self._tempdir = None
+        if cert is None:
+            self._tempdir = tempfile.mkdtemp(prefix='standin')
+            cert, key = self_signed_certificate(self._tempdir)
+        self.context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        self.context.load_cert_chain(cert, key)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.conn = None
+        self.announce = None
+        self.accepted = []
+        self.zdict = None  # preset dictionary picked in the verification
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.pings = []  # heartbeats received from the link, answered by read
+        self.events = []  # events pushed by the link, collected by read
+        self._streams = {}  # stream id -> (inflater, pieces) of responses arriving as stream packets
+        # an SSL connection is not safe to read and write from two threads at once, the benchmarks do both
+        self._ssl_lock = threading.Lock()
+
+    def accept(self, timeout=None, **verification):
+        """
+        Waits for a link, completes the announce and verification, returns the announce. Keyword arguments are added
+        to the verification, such as retry_after=30 for the 'retry-after' hint.
+        """
+        self.listener.settimeout(timeout)
+        raw = self.listener.accept()[0]
+        raw.settimeout(None)
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.conn = self.context.wrap_socket(raw, server_side=True)
+        self.zdict = None
+        self._streams.clear()
+        message_id, _, self.announce = self.read()
+        if message_id != msgs.MSG_ID_ANNOUNCE:
+            raise ValueError("expected an announce, got %d" % message_id)
+        offered = self.announce.get('capabilities', [])
+        self.accepted = [c for c in offered if c in self.capabilities]
+        response = {'valid-version': True, 'valid-uuid': True, 'capabilities': self.accepted}
+        versions = [v for v in self.announce.get('dictionaries', []) if v in dictionaries.PRESETS]
+        if msgs.CAPABILITY_DICTIONARY in self.accepted and versions:
+            response['dictionary'] = max(versions)
+        response.update((key.replace('_', '-'), value) for key, value in verification.items())
+        self.verify(response)
+        if msgs.CAPABILITY_DICTIONARY in self.accepted:
+            self.zdict = dictionaries.PRESETS.get(response.get('dictionary'))
+        return self.announce
+
+    def verify(self, verification):
+        self.send_control(msgs.MSG_ID_VERIFICATION, verification)
+
+    def send_control(self, message_id, message):
+        body = frames.compress(json.dumps(message).encode('utf-8'), zlib.Z_DEFAULT_COMPRESSION, self.zdict)
+        self._send(struct.pack('>ll', message_id, len(body)) + body)
+
+    def request(self, request, correlation_id=None, packet_bytes=None, chunked=False, instance=0):
+        """
+        Sends a JSON-RPC request (any JSON value, or bytes as is). The compressed body is cut into packets of
+        packet_bytes, sent as a chunked frame when chunked is set and the link accepted it. instance is the number of
+        the Kodi to run it on, when the link is a gateway.
+        """
+        if not isinstance(request, bytes):
+            request = json.dumps(request).encode('utf-8')
+        body = frames.compress(request, zlib.Z_DEFAULT_COMPRESSION, self.zdict)
+        size = packet_bytes or len(body)
+        packets = [body[i:i + size] for i in range(0, len(body), size)]
+        chunked = chunked and msgs.CAPABILITY_CHUNKED in self.accepted
+        frame = [struct.pack('>l', msgs.PACKETS_CHUNKED if chunked else len(packets))]
+        if msgs.CAPABILITY_CORRELATION in self.accepted:
+            frame.append(struct.pack('>l', correlation_id or 0))
+            if msgs.CAPABILITY_GATEWAY in self.accepted:
+                frame.append(struct.pack('>l', instance))
+        for packet in packets:
+            frame.append(struct.pack('>l', len(packet)) + packet)
+        if chunked:
+            frame.append(struct.pack('>l', 0))
+        self._send(b''.join(frame))
+
+    def send_frame(self, frame):
+        """Sends a frame as it is, such as one taken from a capture."""
+        self._send(frame)
+
+    def metrics(self):
+        """Asks the link for its metrics summary, call it with no responses outstanding."""
+        self.send_control(msgs.MSG_ID_METRICS, {'id': 1})
+        header, _, message = self.read()
+        if header != msgs.MSG_ID_METRICS:
+            raise ValueError("expected metrics, got %d" % header)
+        return message['metrics']
+
+    def library(self, **query):
+        """Asks the link for the library changes described by query, call it with no responses outstanding."""
+        query.setdefault('id', 1)
+        self.send_control(msgs.MSG_ID_LIBRARY, query)
+        header, _, message = self.read()
+        if header != msgs.MSG_ID_LIBRARY:
+            raise ValueError("expected library changes, got %d" % header)
+        return message
+
+    def read(self):
+        """
+        Reads one frame from the link, returns (message id or packet count, correlation id, decoded JSON). Pings are
+        answered and skipped, events are collected and skipped. A response sent as stream packets is returned once
+        its last packet arrives, as (MSG_ID_STREAM, stream id, decoded JSON).
+        """
+        while True:
+            header, correlation_id, message = self._read_frame()
+            if header == msgs.MSG_ID_STREAM:
+                if message is not None:
+                    return header, correlation_id, message
+            elif header == msgs.MSG_ID_PING:
+                self.pings.append(message)
+                self.send_control(msgs.MSG_ID_PONG, message)
+            elif header == msgs.MSG_ID_EVENTS:
+                self.events.append(message)
+            else:
+                return header, correlation_id, message
+
+    def _read_frame(self):
+        header = struct.unpack('>l', self._recv(4))[0]
+        if header == msgs.MSG_ID_STREAM:
+            return self._read_stream_packet()
+        correlation_id = None
+        if header >= 0 and msgs.CAPABILITY_CORRELATION in self.accepted:
+            correlation_id = struct.unpack('>l', self._recv(4))[0]
+        if header < 0:
+            packets = 1  # control message
+        elif header == msgs.PACKETS_CHUNKED:
+            packets = None  # until a zero size packet
+        else:
+            packets = header
+        inflater = frames.decompressor(self.zdict)
+        pieces = []
+        while packets is None or packets > 0:
+            size = struct.unpack('>l', self._recv(4))[0]
+            if size == 0 and packets is None:
+                break
+            pieces.append(inflater.decompress(self._recv(size)))
+            if packets is not None:
+                packets -= 1
+        pieces.append(inflater.flush())
+        return header, correlation_id, json.loads(b''.join(pieces).decode('utf-8'))
+
+    def _read_stream_packet(self):
+        """Reads one stream packet, returns (MSG_ID_STREAM, stream id, decoded JSON or None until the stream ends)."""
+        stream_id, size = struct.unpack('>ll', self._recv(8))
+        inflater, pieces = self._streams.setdefault(stream_id, (frames.decompressor(self.zdict), []))
+        if size:
+            pieces.append(inflater.decompress(self._recv(size)))
+            return msgs.MSG_ID_STREAM, stream_id, None
+        del self._streams[stream_id]
+        pieces.append(inflater.flush())
+        return msgs.MSG_ID_STREAM, stream_id, json.loads(b''.join(pieces).decode('utf-8'))
+
+    def disconnect(self):
+        """Closes the connection of the link, which may connect again."""
+        if self.conn is not None:
+            try:
+                self.conn.shutdown(socket.SHUT_RDWR)
+            except (socket.error, ValueError):
+                pass
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        self.disconnect()
+        self.listener.close()
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+            self._tempdir = None
+
+    def _send(self, data):
+        with self._ssl_lock:
+            self.conn.sendall(data)
+            self.bytes_sent += len(data)
+
+    def _recv(self, size):
+        data = bytearray(size)
+        view = memoryview(data)
+        received = 0
+        while received < size:
+            if not self.conn.pending():
+                # wait outside the lock so requests can be sent meanwhile
+                if not select.select([self.conn], [], [], self.conn.gettimeout())[0]:
+                    raise socket.timeout("timed out")
+            with self._ssl_lock:
+                count = self.conn.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionClosed("link closed the connection")
+            received += count
+        self.bytes_received += size
+        return bytes(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=59348)
+    parser.add_argument('--capabilities', default=','.join(SUPPORTED_CAPABILITIES))
+    parser.add_argument('--cert')
+    parser.add_argument('--key')
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, [c for c in args.capabilities.split(',') if c], args.cert, args.key)
+    print("listening on %s:%d" % (args.host, server.port))
+    try:
+        print("announce %s, accepted %s" % (json.dumps(server.accept()), server.accepted))
+        for number, line in enumerate(sys.stdin):
+            if line.strip():
+                server.request(line.strip().encode('utf-8'), correlation_id=number)
+                print(json.dumps(server.read()[2]))
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+#
+# Media Steward Link
+# Copyright (C) 2018  Matthew C. Ruschmann <https://matthew.ruschmann.net>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import re
+import socket
+import threading
+import zlib
+from collections import deque
+from eventloop import wakeup_pair
+import frames
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DEFAULT_WORKERS = 4
+BACKLOG_PER_WORKER = 4
+
+# methods that only read state, besides the Get* ones
+READ_ONLY_METHODS = frozenset(['JSONRPC.Introspect', 'JSONRPC.Permission', 'JSONRPC.Ping', 'JSONRPC.Version'])
+
+# library listings that can run in pages: method -> key of the items in its result
+LISTING_METHODS = {
+    'AudioLibrary.GetAlbums': 'albums',
+    'AudioLibrary.GetArtists': 'artists',
+    'AudioLibrary.GetSongs': 'songs',
+    'VideoLibrary.GetEpisodes': 'episodes',
+    'VideoLibrary.GetMovies': 'movies',
+    'VideoLibrary.GetMusicVideos': 'musicvideos',
+    'VideoLibrary.GetTVShows': 'tvshows',
+}
+LISTING_PAGE_ITEMS = 500
+LISTING_PAGES_AHEAD = 2  # pages run ahead of the socket at most
+
+_LIMITS = re.compile(br'"limits":\{"end":(\d+),"start":(\d+),"total":(\d+)\}')
+
+
+class Job(object):
+    """A decoded request waiting for, or holding, its JSON-RPC response."""
+
+    __slots__ = ('sequence', 'correlation_id', 'epoch', 'request', 'message_id', 'batch', 'listing', 'instance',
+                 'response', 'compressed', 'error', 'method', 'received', 'submitted')
+
+    def __init__(self, sequence, correlation_id, epoch, request, message_id=0, batch=None, listing=None, instance=0):
+        self.sequence = sequence
+        self.correlation_id = correlation_id
+        self.epoch = epoch
+        self.request = request
+        self.message_id = message_id  # control message id, 0 for a JSON-RPC request
+        self.instance = instance  # the Kodi to run it on, by its number in the announce
+        self.batch = batch  # the Batch this call belongs to, if any
+        self.listing = listing  # the Listing this is a page of, or that answers this request
+        self.response = None
+        self.compressed = None  # set instead of, or as well as, response when it is ready to send as is
+        self.error = None
+        # for the metrics
+        self.method = None
+        self.received = None  # when the request frame started arriving
+        self.submitted = None  # when it was handed to the pool
+
+
+def batch_calls(request):
+    """Returns the calls of a JSON-RPC batch request, or None when request is not a batch that can be split."""
+    if request.lstrip()[:1] != b'[':
+        return None
+    try:
+        calls = json.loads(request.decode('utf-8'))
+    except ValueError:
+        return None
+    # an empty batch is an error Kodi reports itself
+    return calls if isinstance(calls, list) and calls else None
+
+
+def listing_call(request):
+    """Returns the call of a library listing request asking for more than a page of items, or None."""
+    if b'Library.Get' not in request or request.lstrip()[:1] != b'{':
+        return None
+    try:
+        call = json.loads(request.decode('utf-8'))
+    except ValueError:
+        return None
+    if not isinstance(call, dict) or call.get('method') not in LISTING_METHODS or 'id' not in call:
+        return None
+    params = call.get('params', {})
+    limits = params.get('limits', {}) if isinstance(params, dict) else None
+    if not isinstance(limits, dict):
+        return None
+    start = limits.get('start', 0)
+    end = limits.get('end', -1)
+    if not isinstance(start, int) or not isinstance(end, int) or start < 0:
+        return None
+    return call if end < 0 or end - start > LISTING_PAGE_ITEMS else None
+
+
+def listing_items(response, key):
+    """
+    Returns (total, items) of a listing response, items the text inside the brackets of its array. Kodi writes
+    compact JSON with sorted keys, so the items are found without parsing them. Anything else is parsed and written
+    out again, a JSON-RPC error raises ValueError.
+    """
+    limits = _LIMITS.search(response)
+    if limits is not None:
+        marker = b'"' + key.encode('utf-8') + b'":['
+        begin = response.find(marker)
+        if begin < 0:
+            return int(limits.group(3)), b''  # nothing in the range asked for
+        begin += len(marker)
+        if begin < limits.start():
+            end = response.rfind(b'],"limits":')
+        else:
+            end = response.rstrip().rfind(b']}}')
+        if end >= begin:
+            return int(limits.group(3)), frames.readonly(response, begin, end - begin)
+    parsed = json.loads(response.decode('utf-8'))
+    if not isinstance(parsed, dict) or not isinstance(parsed.get('result'), dict):
+        raise ValueError(parsed.get('error') if isinstance(parsed, dict) else "not a listing")
+    result = parsed['result']
+    items = json.dumps(result.get(key, []), separators=(',', ':'), ensure_ascii=False)
+    if not isinstance(items, bytes):
+        items = items.encode('utf-8')
+    return result.get('limits', {}).get('total', 0), items[1:-1]
+
+
+def read_only(call):
+    method = call.get('method') if isinstance(call, dict) else None
+    if not isinstance(method, type(u'')):
+        return False
+    return method.rpartition('.')[2].startswith('Get') or method in READ_ONLY_METHODS
+
+
+class Batch(object):
+    """
+    A JSON-RPC batch request split into one job per call. Calls run in groups: consecutive read-only calls together in
+    parallel, any other call alone, so a call never overtakes one that may change what it sees. The responses are
+    joined into a single array for job, the job of the whole request.
+    """
+
+    def __init__(self, job, calls):
+        self.job = job
+        self.calls = calls
+        self.jobs = [Job(job.sequence, job.correlation_id, job.epoch, json.dumps(call).encode('utf-8'), batch=self,
+                         instance=job.instance) for call in calls]
+        self.running = 0
+        self._next = 0
+
+    def next_group(self):
+        """Returns the jobs to run once the previous group finished, an empty list when all have run."""
+        first = self._next
+        if first < len(self.jobs):
+            self._next += 1
+            if read_only(self.calls[first]):
+                while self._next < len(self.jobs) and read_only(self.calls[self._next]):
+                    self._next += 1
+        self.running = self._next - first
+        return self.jobs[first:self._next]
+
+    def finish(self):
+        """Records a finished call, returns True when its group is complete."""
+        self.running -= 1
+        return self.running == 0
+
+    def respond(self):
+        """Fills in the response of the whole request from the responses of its calls."""
+        responses = []
+        for call, job in zip(self.calls, self.jobs):
+            if isinstance(call, dict) and 'id' not in call:
+                continue  # notifications get no response
+            if job.error is not None:
+                responses.append(json.dumps({'jsonrpc': '2.0', 'id': call.get('id') if isinstance(call, dict) else None,
+                                             'error': {'code': -32603, 'message': str(job.error)}}).encode('utf-8'))
+            elif job.response is not None:
+                responses.append(job.response)
+            else:
+                # answered from the response cache
+                responses.append(zlib.decompress(job.compressed))
+        self.job.response = b'[' + b','.join(responses) + b']'
+
+
+class Listing(object):
+    """
+    A library listing run in pages of limits and sent as a multi-packet response, one packet per page, so the server
+    can start on the first items while Kodi produces the rest and the whole result is never held at once. The packet
+    count is known from the total the first page reports. Pages run one at a time and in order, each compressed on
+    its worker into one deflate stream that is flushed at the end of every page, so each packet inflates completely.
+
+    The listing is also the packet producer of its response in the link's outbound queue: next() returns None while
+    the next page is still running.
+    """
+
+    def __init__(self, job, call, submit, level=zlib.Z_DEFAULT_COMPRESSION, zdict=None,
+                 page_items=LISTING_PAGE_ITEMS):
+        self.job = job  # the job of the whole request
+        self.call = call
+        self.key = LISTING_METHODS[call['method']]
+        limits = call.get('params', {}).get('limits', {})
+        self.start = limits.get('start', 0)
+        self.end = limits.get('end', -1)  # until the first page tells the total
+        self.page_items = page_items
+        self.packets = None
+        self.ready = deque()  # compressed packets waiting for the socket
+        self.sent = 0
+        self.pages = 0  # started
+        self.running = False
+        self.closed = False  # the JSON text is complete, any remaining packets are empty
+        self.written = 0  # uncompressed bytes of the last page
+        self._items = False  # an item has been written, the next needs a comma
+        self._submit = submit  # called with the next page's job
+        self._deflater = frames.compressor(level, zdict)
+
+    def next_job(self):
+        """Returns the job of the next page when it is due, None while one runs or enough are ready."""
+        if self.running or len(self.ready) >= LISTING_PAGES_AHEAD:
+            return None
+        if self.packets is not None and self.pages >= self.packets:
+            return None
+        start = self.start + self.pages * self.page_items
+        end = start + self.page_items if self.end < 0 else min(start + self.page_items, self.end)
+        request = None
+        if not self.closed:
+            params = dict(self.call.get('params', {}))
+            params['limits'] = {'start': start, 'end': end}
+            request = json.dumps(dict(self.call, params=params)).encode('utf-8')
+        job = Job(self.job.sequence, self.job.correlation_id, self.job.epoch, request, listing=self,
+                  instance=self.job.instance)
+        job.method = self.call['method']
+        self.pages += 1
+        self.running = True
+        return job
+
+    def page(self, job, response):
+        """Compresses the page job ran into its packet, on the worker. response is None for a page not run."""
+        pieces = []
+        if response is not None:
+            first = self.packets is None
+            try:
+                total, items = listing_items(response, self.key)
+            except ValueError:
+                if first:
+                    # answered with an error, sent as is in a single packet
+                    self.packets = 1
+                    self.closed = True
+                    self._set(job, [response], True)
+                    return
+                items = None
+            if first:
+                self.end = total if self.end < 0 else min(self.end, total)
+                self.packets = max(1, -(-(self.end - self.start) // self.page_items))
+                limits = {'end': max(self.end, self.start), 'start': self.start, 'total': total}
+                pieces.append(b'{"id":' + json.dumps(self.call['id']).encode('utf-8') +
+                              b',"jsonrpc":"2.0","result":{"limits":' +
+                              json.dumps(limits, sort_keys=True, separators=(',', ':')).encode('utf-8') +
+                              b',"' + self.key.encode('utf-8') + b'":[')
+            if items is None:
+                self._close(pieces)  # a later page failed, the listing ends short
+            elif len(items):
+                if self._items:
+                    pieces.append(b',')
+                pieces.append(items)
+                self._items = True
+        last = self.pages >= self.packets
+        if last and not self.closed:
+            self._close(pieces)
+        self._set(job, pieces, last)
+
+    def add(self, job):
+        """Takes a finished page on the link's thread, returns True for the first, when the frame can start."""
+        self.running = False
+        first = self.pages == 1
+        if job.error is not None:
+            if first:
+                self.job.error = job.error
+                return True
+            # the page never reached page(), end the listing here
+            pieces = []
+            if not self.closed:
+                self._close(pieces)
+            self._set(job, pieces, self.pages >= self.packets)
+        self.ready.append(job.compressed)
+        self._more()
+        return first
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.sent == self.packets:
+            raise StopIteration
+        if not self.ready:
+            return None
+        self.sent += 1
+        packet = self.ready.popleft()
+        self._more()
+        return packet
+
+    next = __next__
+
+    def _more(self):
+        job = self.next_job()
+        if job is not None:
+            self._submit([job])
+
+    def _close(self, pieces):
+        pieces.append(b']}}')
+        self.closed = True
+
+    def _set(self, job, pieces, last):
+        self.written = sum(len(piece) for piece in pieces)
+        packet = b''.join([self._deflater.compress(piece) for piece in pieces] +
+                          [self._deflater.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)])
+        job.compressed = packet
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of threads running JSON-RPC requests. Finished jobs are queued for the service loop, which stays the
+    only writer on the link, and the wakeup socket is poked so a select() on the pool returns as soon as one is ready.
+    """
+
+    def __init__(self, execute, size=DEFAULT_WORKERS):
+        self.size = size
+        self._execute = execute  # called with each job, fills in its response
+        self._jobs = queue.Queue(size * BACKLOG_PER_WORKER)
+        self._done = queue.Queue()
+        self._stopped = threading.Event()
+        self._wakeup_reader, self._wakeup_writer = wakeup_pair()
+        self._threads = []
+        for i in range(size):
+            thread = threading.Thread(target=self._run, name="Media Steward worker %d" % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def fileno(self):
+        return self._wakeup_reader.fileno()
+
+    def submit(self, job):
+        """Queues a job without blocking, returns False if the backlog is full."""
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            return False
+        return True
+
+    def backlog(self):
+        return self._jobs.qsize()
+
+    def completed(self):
+        """Returns the jobs that finished since the last call."""
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except socket.error:
+            pass  # drained
+        jobs = []
+        while True:
+            try:
+                jobs.append(self._done.get_nowait())
+            except queue.Empty:
+                return jobs
+
+    def stop(self):
+        """Lets every thread finish its current job and exit, without blocking: jobs still queued are not run."""
+        self._stopped.set()
+        for _ in self._threads:
+            try:
+                self._jobs.put_nowait(None)  # wakes a thread waiting for a job
+            except queue.Full:
+                break  # every thread has a job to take, and sees the pool stopped after it
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def join(self, timeout=None):
+        """Waits for the threads of a stopped pool, so none is left running when the interpreter shuts down."""
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None or self._stopped.is_set():
+                return
+            try:
+                self._execute(job)
+            except Exception as err:
+                job.error = err
+            self._done.put(job)
+            try:
+                self._wakeup_writer.send(b'\0')
+            except socket.error:
+                pass  # already woken, or the pool was stopped